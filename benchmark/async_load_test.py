@@ -0,0 +1,70 @@
+"""Load test of the async repository functions against local Neo4j and OpenAI stand-ins.
+
+Every simulated conversation calls the same functions as the tools (organization news, number of employees,
+topic news, filter by country). The run with --blocking simulates the old tools, which called the sync
+functions from _arun and blocked the event loop.
+
+    python -m benchmark.async_load_test --conversations 200
+    python -m benchmark.async_load_test --conversations 200 --blocking
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmark.fakes import FakeAsyncDriver, FakeEmbeddings
+from repository.async_graph_db import set_async_driver, set_async_embeddings
+from repository.async_queries import (
+    afilter_by_country,
+    afilter_news_by_topic_with_score,
+    aget_number_employees,
+    asearch_by_organization,
+)
+
+
+async def _conversation(number: int) -> float:
+    start = time.perf_counter()
+    await asearch_by_organization("Google")
+    await aget_number_employees("Google")
+    await afilter_news_by_topic_with_score(f"health benefits {number}", 0.85, 0.92)
+    await afilter_by_country("Russia")
+    return time.perf_counter() - start
+
+
+async def _run(conversations: int, concurrency: int):
+    # limit how many conversations are active at the same time, like the number of users chatting
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited(number):
+        async with limit:
+            return await _conversation(number)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(limited(i) for i in range(conversations)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=50)
+    parser.add_argument("--neo4j-latency", type=float, default=0.02)
+    parser.add_argument("--openai-latency", type=float, default=0.1)
+    parser.add_argument("--blocking", action="store_true", help="block the event loop on every query")
+    args = parser.parse_args()
+
+    driver = FakeAsyncDriver(args.neo4j_latency, args.pool_size, args.blocking)
+    set_async_driver(driver)
+    set_async_embeddings(FakeEmbeddings(latency=args.openai_latency))
+
+    latencies, elapsed = asyncio.run(_run(args.conversations, args.concurrency))
+    latencies = sorted(latencies)
+    print(f"conversations: {args.conversations}, concurrency: {args.concurrency}, blocking: {args.blocking}")
+    print(f"queries: {driver.queries}, wall time: {elapsed:.2f}s")
+    print(f"throughput: {args.conversations / elapsed:.1f} conversations/s")
+    print(f"p50: {statistics.median(latencies) * 1000:.0f} ms, p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Load test of the HTTP chat API (web/api.py) with more and more uvicorn workers, against a stub agent.
+
+For every number of workers it starts the API with uvicorn, with the sessions in a shared SQLite store, and the
+simulated users chat at the same time: every user creates a session and asks the questions from questions.txt
+one after the other, and every turn is answered by whichever worker gets the request. A refused turn (503, the
+backpressure of the workers) is sent again after its Retry-After. It reports the turns per second, the p50/p95
+latency and time to first token of the turns as the users see them, the refused requests, and over how many
+workers the turns of a session were spread.
+
+    python -m benchmark.chat_api_load --workers 1 2 4 --users 64 --max-concurrency 8
+    python -m benchmark.chat_api_load --url http://127.0.0.1:8000 --users 16      # a running API, the real agent
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from benchmark.stats import percentile, print_table, summarize
+
+QUESTIONS = [
+    line.split("->")[0].strip()
+    for line in open("questions.txt", encoding="utf-8")
+    if line.strip() and not line.startswith(" ")
+]
+
+
+def stub_app():
+    """The app of the workers started by this benchmark (uvicorn benchmark.chat_api_load:stub_app --factory):
+    the stub agent, no answer cache and no intent router, so every turn takes the time of the agent."""
+    from benchmark.fakes import FakeAgentExecutor, FakeEmbeddings
+    from service.answer_cache import SemanticAnswerCache
+    from service.intent_router import IntentRouter
+    from service.serving import ChatService
+    from web.api import create_app
+
+    service = ChatService(
+        FakeAgentExecutor(float(os.getenv("BENCHMARK_FIRST_TOKEN_LATENCY", "0.5"))),
+        answer_cache=SemanticAnswerCache(FakeEmbeddings(), max_entries=0, run_query=lambda query, params=None: []),
+        router=IntentRouter(enabled=False),
+    )
+    return create_app(service)
+
+
+class Client:
+    """One simulated user of the API."""
+
+    def __init__(self, host: str, port: int, max_retries: int = 20):
+        self.host = host
+        self.port = port
+        self.max_retries = max_retries
+        self.refused = 0
+
+    def _request(self, method: str, path: str, body: Optional[Dict] = None) -> http.client.HTTPResponse:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        connection.request(method, path, data, {"Content-Type": "application/json"})
+        return connection.getresponse()
+
+    def create_session(self) -> str:
+        return json.loads(self._request("POST", "/sessions").read())["session_id"]
+
+    def ask(self, session_id: str, message: str) -> Dict:
+        """Send the question and read the answer; the latencies are from the first attempt."""
+        start = time.perf_counter()
+        for _ in range(self.max_retries):
+            response = self._request("POST", f"/sessions/{session_id}/messages", {"message": message})
+            if response.status == 503:
+                self.refused += 1
+                response.read()
+                time.sleep(float(response.getheader("Retry-After", "1")))
+                continue
+            if response.status != 200:
+                return {"error": f"HTTP {response.status}: {response.read()[:200]!r}"}
+            return self._read_events(response, start)
+        return {"error": "refused"}
+
+    @staticmethod
+    def _read_events(response: http.client.HTTPResponse, start: float) -> Dict:
+        result: Dict = {"first_token": None}
+        event = None
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "token" and result["first_token"] is None:
+                    result["first_token"] = time.perf_counter() - start
+                elif event == "done":
+                    result.update(latency=time.perf_counter() - start, worker=data.get("worker"))
+                elif event == "error":
+                    result["error"] = data.get("error")
+        return result
+
+
+def _wait_ready(host: str, port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=2)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The API on port {port} did not start")
+
+
+def run_load(host: str, port: int, users: int, turns: int) -> Dict[str, float]:
+    """All users chat at the same time, every one in its own session."""
+    lock = threading.Lock()
+    results: List[Dict] = []
+    spread: List[int] = []
+    refused = [0]
+
+    def user(i: int):
+        client = Client(host, port)
+        session_id = client.create_session()
+        workers = set()
+        for turn in range(turns):
+            result = client.ask(session_id, QUESTIONS[(i + turn) % len(QUESTIONS)])
+            workers.add(result.get("worker"))
+            with lock:
+                results.append(result)
+        with lock:
+            spread.append(len(workers - {None}))
+            refused[0] += client.refused
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(users) as pool:
+        list(pool.map(user, range(users)))
+    elapsed = time.perf_counter() - start
+
+    answered = [r for r in results if "error" not in r and "latency" in r]
+    summary = summarize([r["latency"] for r in answered], elapsed)
+    first_tokens = [r["first_token"] for r in answered if r["first_token"] is not None]
+    if first_tokens:
+        summary["ttft_p95_ms"] = percentile(first_tokens, 95) * 1000
+    summary["errors"] = len(results) - len(answered)
+    summary["refused"] = refused[0]
+    summary["workers_per_session"] = sum(spread) / len(spread) if spread else 0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=64, help="users chatting at the same time")
+    parser.add_argument("--turns", type=int, default=3, help="questions of every user")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="answers at the same time per worker")
+    parser.add_argument("--max-queue", type=int, default=8, help="turns waiting for a slot per worker")
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8077)
+    parser.add_argument("--url", help="load a running API instead of starting the workers")
+    args = parser.parse_args()
+
+    results = {}
+    if args.url:
+        url = urlparse(args.url)
+        results["running API"] = run_load(url.hostname, url.port or 80, args.users, args.turns)
+    for workers in [] if args.url else args.workers:
+        env = dict(
+            os.environ,
+            CHAT_SESSION_STORE="sqlite",
+            CHAT_SESSION_DB=os.path.join(tempfile.mkdtemp(), "sessions.sqlite3"),
+            CHAT_MAX_CONCURRENCY=str(args.max_concurrency),
+            CHAT_MAX_QUEUE=str(args.max_queue),
+            BENCHMARK_FIRST_TOKEN_LATENCY=str(args.first_token_latency),
+            LOG_LEVEL="WARNING",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmark.chat_api_load:stub_app", "--factory",
+             "--port", str(args.port), "--workers", str(workers), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            _wait_ready("127.0.0.1", args.port)
+            results[f"{workers} workers"] = run_load("127.0.0.1", args.port, args.users, args.turns)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print_table(
+        results,
+        ["throughput_per_s", "p50_ms", "p95_ms", "ttft_p95_ms", "refused", "errors", "workers_per_session"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Local stand-ins for the OpenAI chat model of the agent, so the agent runs without network access.
+
+ScriptedChatModel answers like the real model with deterministic rules: for a question it calls the tool
+which the real model calls for it (see questions.txt), and after the tool result it streams an answer made
+from the result. A question with several parts ("news for X and how many employees has X?") calls one
+tool for every part: all at once with the tools API, one per response with the functions API. RecordingChatModel records the responses of the real model, and ReplayChatModel plays them
+back (and uses the rules for the prompts which were not recorded).
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    FunctionMessage,
+    HumanMessage,
+    ToolMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# (pattern of the question, tool, argument) in the order in which they are tried
+_RULES = (
+    (re.compile(r"(?:over|more than|at least|above)\s+([\d,]+)\s+employees", re.I),
+     "NewsInformationFilterOrganizationsByEmployees", "number_employees"),
+    (re.compile(r"employees (?:has|does) (.+?)(?: have)?\s*\?*$", re.I),
+     "NewsInformationOrganizationEmployees", "organization"),
+    (re.compile(r"based in (.+?)\s*\?*$", re.I), "NewsInformationByCountry", "country_name"),
+    (re.compile(r"news (?:for|about|of) (.+?)\s*\?*$", re.I), "NewsInformationOrganization", "organization"),
+)
+_TOPIC_TOOL = "NewsInformationTopicFewShot"
+# the parts of a question, every one is answered by its own tool
+_PARTS = re.compile(r",?\s+and\s+(?=(?:how|what|which|who|news)\b)", re.I)
+# the final answer repeats at most this many words of the tool result
+_ANSWER_WORDS = 80
+_CURSOR = re.compile(r"next_cursor: \w+")
+_recordings_lock = threading.Lock()
+
+
+def prompt_key(messages: List[BaseMessage]) -> str:
+    """The key of the prompt in the recordings: the hash of the messages and the function calls."""
+    # the cursors of the paged tool results are random, they are not part of the key
+    parts = [
+        [
+            m.type,
+            _CURSOR.sub("next_cursor", str(m.content)),
+            m.additional_kwargs.get("function_call"),
+            m.additional_kwargs.get("tool_calls"),
+            getattr(m, "name", None),
+        ]
+        for m in messages
+    ]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _function_names(kwargs: Dict[str, Any]) -> Tuple[List[str], bool]:
+    """The names of the functions bound to the model, and whether they are bound with the tools API."""
+    if kwargs.get("tools"):
+        return [t["function"]["name"] for t in kwargs["tools"]], True
+    return [f["name"] for f in kwargs.get("functions") or []], False
+
+
+def _tool_calls(calls: List[Dict]) -> List[Dict]:
+    # the ids only have to be unique in the response, fixed ids keep the prompt keys of the replay stable;
+    # the replayed calls keep their recorded ids
+    return [
+        {
+            "index": i,
+            "id": call.get("id", f"call_{i}"),
+            "type": "function",
+            "function": {"name": call["name"], "arguments": call["arguments"]},
+        }
+        for i, call in enumerate(calls)
+    ]
+
+
+def _tokens(content: str) -> List[str]:
+    # the answer is streamed word by word, about one token per word
+    return [word + " " for word in content.split(" ")] if content else []
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model which chooses the tool by rules and writes the answer from the tool result,
+    with the latency of the real model: first_token_latency seconds, then tokens_per_second."""
+
+    model_name: str = "scripted-llm"
+    first_token_latency: float = 0.4
+    tokens_per_second: float = 50.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _planned_calls(self, question: str, names: List[str]) -> List[Dict]:
+        """The function calls (name and JSON arguments) which answer the question, one for every part."""
+        calls = []
+        for part in _PARTS.split(question):
+            for pattern, tool, argument in _RULES:
+                match = pattern.search(part)
+                if match and tool in names:
+                    value: Any = match.group(1).strip()
+                    if argument == "number_employees":
+                        value = int(value.replace(",", ""))
+                    calls.append({"name": tool, "arguments": json.dumps({argument: value})})
+                    break
+        if not calls and _TOPIC_TOOL in names:
+            topic = re.sub(r"\b(provide me information for|mentioned in the news|news)\b|\?", "", question, flags=re.I)
+            calls.append({"name": _TOPIC_TOOL, "arguments": json.dumps({"topic": topic.strip() or question})})
+        return calls
+
+    def _respond(self, messages: List[BaseMessage], names: List[str], tools_api: bool) -> Tuple[str, List[Dict]]:
+        """The content of the answer, and the function calls (name and JSON arguments) of the response."""
+        asked = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        question = str(messages[asked[-1]].content) if asked else ""
+        # the results of the tools called for this question
+        after = messages[asked[-1] + 1:] if asked else messages
+        results = [str(m.content) for m in after if isinstance(m, (FunctionMessage, ToolMessage))]
+        planned = self._planned_calls(question, names)
+        if not results:
+            if not planned:
+                return "I can not answer this question with the available tools.", []
+            # the functions API has room for one call per response
+            return "", planned if tools_api else planned[:1]
+        if not tools_api and len(results) < len(planned):
+            return "", [planned[len(results)]]
+        words = " ".join(results).split()
+        answer = " ".join(words[:_ANSWER_WORDS]) + (" ..." if len(words) > _ANSWER_WORDS else "")
+        return f"Here is what I found in the news database: {answer}", []
+
+    def _message(self, content: str, calls: List[Dict], tools_api: bool) -> AIMessage:
+        return AIMessage(content=content, additional_kwargs=self._call_kwargs(calls, tools_api))
+
+    @staticmethod
+    def _call_kwargs(calls: List[Dict], tools_api: bool) -> Dict[str, Any]:
+        if not calls:
+            return {}
+        return {"tool_calls": _tool_calls(calls)} if tools_api else {"function_call": calls[0]}
+
+    def _chunks(self, content: str, calls: List[Dict], tools_api: bool) -> List[ChatGenerationChunk]:
+        if calls:
+            # the function calls come in one chunk, the agent parses them only at the end anyway
+            return [ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs=self._call_kwargs(calls, tools_api)))]
+        return [ChatGenerationChunk(message=AIMessageChunk(content=token)) for token in _tokens(content)]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        names, tools_api = _function_names(kwargs)
+        content, calls = self._respond(messages, names, tools_api)
+        time.sleep(self.first_token_latency + len(_tokens(content)) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(content, calls, tools_api))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        names, tools_api = _function_names(kwargs)
+        content, calls = self._respond(messages, names, tools_api)
+        time.sleep(self.first_token_latency)
+        for chunk in self._chunks(content, calls, tools_api):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            time.sleep(1 / self.tokens_per_second)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        names, tools_api = _function_names(kwargs)
+        content, calls = self._respond(messages, names, tools_api)
+        await asyncio.sleep(self.first_token_latency)
+        for chunk in self._chunks(content, calls, tools_api):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(1 / self.tokens_per_second)
+
+
+class ReplayChatModel(ScriptedChatModel):
+    """Plays back the responses recorded by RecordingChatModel, the prompts which were not recorded
+    (for example after a change of the prompt or of the tool results) are answered by the rules."""
+
+    recordings: Dict[str, Dict] = {}
+    replayed: int = 0
+    scripted: int = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayChatModel":
+        recordings = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    recordings[record["key"]] = record
+        return cls(recordings=recordings, **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], names: List[str], tools_api: bool) -> Tuple[str, List[Dict]]:
+        record = self.recordings.get(prompt_key(messages))
+        if record is None:
+            self.scripted += 1
+            return super()._respond(messages, names, tools_api)
+        self.replayed += 1
+        if record.get("tool_calls"):
+            return record["content"], [dict(call["function"], id=call["id"]) for call in record["tool_calls"]]
+        return record["content"], [record["function_call"]] if record.get("function_call") else []
+
+
+class RecordingChatModel(BaseChatModel):
+    """Wraps the real chat model and appends every prompt key and response to a JSON-lines file,
+    for ReplayChatModel."""
+
+    inner: BaseChatModel
+    path: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # the metrics and the cost are by the name of the recorded model
+        return {"model_name": getattr(self.inner, "model_name", self.inner._llm_type)}
+
+    def _record(self, messages: List[BaseMessage], message: BaseMessage):
+        record = {
+            "key": prompt_key(messages),
+            "content": message.content,
+            "function_call": message.additional_kwargs.get("function_call"),
+            "tool_calls": message.additional_kwargs.get("tool_calls"),
+        }
+        with _recordings_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._record(messages, result.generations[0].message)
+        return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = None
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+            yield chunk
+        if message is not None:
+            self._record(messages, message)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = None
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+            yield chunk
+        if message is not None:
+            self._record(messages, message)
@@ -0,0 +1,159 @@
+"""Local stand-ins for Neo4j and OpenAI, so the benchmarks run without network access."""
+import asyncio
+import hashlib
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmark.synthetic import generate_topic_centroids
+
+# the topics of the synthetic news graph (news_graph.py), the questions about them find its chunks
+TOPICS = (
+    "health benefits",
+    "artificial intelligence",
+    "renewable energy",
+    "electric vehicles",
+    "cybersecurity",
+    "climate change",
+    "space exploration",
+    "financial results",
+    "mergers and acquisitions",
+    "layoffs",
+)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic embeddings: the same text always gets the same unit vector.
+    The latency simulates the round trip to the OpenAI API."""
+
+    model = "fake-embeddings"
+
+    def __init__(self, dimension: int = 1536, latency: float = 0.05):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class TopicEmbeddings(FakeEmbeddings):
+    """Deterministic embeddings in which the texts about the same topic are similar: the vector of a text
+    which mentions one of the TOPICS is the topic centroid plus some noise from the hash of the text, so the
+    vector and range searches of the synthetic graph find the chunks of the topic of the question."""
+
+    def __init__(self, dimension: int = 256, latency: float = 0.05, topics=TOPICS, seed: int = 0):
+        super().__init__(dimension, latency)
+        self.topics = topics
+        self.centroids = generate_topic_centroids(len(topics), dimension, seed)
+
+    def _vector(self, text: str) -> List[float]:
+        noise = np.array(super()._vector(text))
+        lowered = text.lower()
+        topic = next((i for i, t in enumerate(self.topics) if t in lowered), None)
+        if topic is None:
+            return noise.tolist()
+        # the weight of the topic, between 0.5 and 1.0, is the same for the same text
+        weight = 0.5 + int(hashlib.sha256(lowered.encode("utf-8")).hexdigest()[:4], 16) / 0xFFFF / 2
+        vector = weight * self.centroids[topic] + (1 - weight) * noise
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeRecord(dict):
+    """Record returned by the fake driver, with the same data() method as neo4j.Record."""
+
+    def data(self) -> Dict:
+        return dict(self)
+
+
+class FakeAsyncDriver:
+    """Async Neo4j driver stand-in which answers every query with canned records after some latency.
+
+    pool_size bounds how many queries run at the same time, like the connection pool of the real driver.
+    With blocking=True the latency blocks the event loop, like a sync query called from async code.
+    """
+
+    def __init__(self, latency: float = 0.02, pool_size: int = 50, blocking: bool = False):
+        self.latency = latency
+        self.blocking = blocking
+        self._pool = asyncio.Semaphore(pool_size)
+        self.queries = 0
+
+    @staticmethod
+    def _records(query: str, parameters: Dict) -> List[FakeRecord]:
+        # names and number of names for the in-memory entity resolver
+        if "AS name" in query:
+            names = ("Russia", "Germany", "Netherlands") if ":Country" in query else ("Google", "Clarity Insights", "Microsoft")
+            return [FakeRecord(name=name) for name in names]
+        if "count(DISTINCT" in query:
+            return [FakeRecord(count=3)]
+        if "AS version" in query:
+            return [FakeRecord(version=1)]
+        if "db.index.fulltext.queryNodes" in query:
+            return [FakeRecord(candidate="Google")]
+        if "db.index.vector.queryNodes" in query:
+            return [FakeRecord(chunk_text="Synthetic chunk.", score=0.9)]
+        # the paged queries return one page, shorter than the page size, so there is no next page
+        if "org_name" in parameters:
+            return [FakeRecord(number_employees=100000)]
+        if "article_summary" in query:
+            return [FakeRecord(article_summary="Summary.", organization_names=["Google"], date="2024-01-01", id="4:a:1")]
+        if "organization_name" in query:
+            return [FakeRecord(organization_name="Google", number_employees=100000)]
+        return [FakeRecord(chunk_text="Synthetic chunk.", date="2024-01-01", id="4:c:1")]
+
+    async def execute_query(self, query: str, parameters_: Optional[Dict] = None, **kwargs):
+        async with self._pool:
+            self.queries += 1
+            if self.blocking:
+                time.sleep(self.latency)
+            else:
+                await asyncio.sleep(self.latency)
+            return self._records(query, parameters_ or {}), None, []
+
+    async def close(self):
+        pass
+
+
+class FakeAgentExecutor:
+    """Agent executor stand-in for the streaming functions: it "calls" one tool and streams a short answer,
+    with latencies similar to the real agent (LLM first token, tool call, tokens)."""
+
+    def __init__(self, first_token_latency: float = 0.5, tool_latency: float = 0.1, token_latency: float = 0.02):
+        self.first_token_latency = first_token_latency
+        self.tool_latency = tool_latency
+        self.token_latency = token_latency
+
+    async def astream_events(self, agent_input: Dict, version: str = "v1", **kwargs):
+        from langchain_core.messages import AIMessageChunk
+
+        # the first LLM call chooses the tool
+        await asyncio.sleep(self.first_token_latency)
+        yield {"event": "on_tool_start", "name": "NewsInformationTopicFewShot", "data": {"input": agent_input["input"]}}
+        await asyncio.sleep(self.tool_latency)
+        yield {"event": "on_tool_end", "name": "NewsInformationTopicFewShot", "data": {"output": "Synthetic chunk."}}
+        # the second LLM call writes the answer
+        await asyncio.sleep(self.first_token_latency)
+        for token in f"Here is the news about {agent_input['input']}".split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield {"event": "on_chat_model_stream", "name": "ChatOpenAI", "data": {"chunk": AIMessageChunk(content=token + " ")}}
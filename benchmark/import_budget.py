@@ -0,0 +1,70 @@
+"""Check that importing the modules is fast and does not connect to the network.
+
+Every module is imported in a new python process, with an audit hook that fails on any socket
+connection and with the Neo4j and OpenAI settings pointing to addresses that do not exist.
+
+    python -m benchmark.import_budget --budget 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULES = [
+    "repository.graph_db",
+    "repository.queries",
+    "repository.async_queries",
+    "service.agent_inputs_and_tools",
+    "service.agent",
+    "service.streaming",
+    "web.main",
+]
+
+# runs in the new process: fail on the first socket connection, then print the import time
+_CHECK = """
+import sys, time
+
+def no_network(event, args):
+    if event == "socket.connect":
+        raise RuntimeError(f"network connection on import: {args[1:]}")
+
+sys.addaudithook(no_network)
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=5.0, help="maximum seconds to import one module")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        NEO4J_URI="bolt://127.0.0.1:1",
+        NEO4J_USERNAME="neo4j",
+        NEO4J_PASSWORD="not-used",
+        OPENAI_API_KEY="not-used",
+        OPENAI_API_BASE="http://127.0.0.1:1",
+    )
+    failed = False
+    for module in args.modules:
+        result = subprocess.run(
+            [sys.executable, "-c", _CHECK.replace("{module}", module)], env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            failed = True
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+            print(f"FAIL {module}: {error}")
+            continue
+        seconds = float(result.stdout.strip().splitlines()[-1])
+        status = "ok" if seconds <= args.budget else "SLOW"
+        failed = failed or status != "ok"
+        print(f"{status:>4} {module}: {seconds:.2f} s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
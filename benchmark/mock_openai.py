@@ -0,0 +1,168 @@
+"""Local mock of the OpenAI HTTP API (embeddings and chat completions) with a rate limit, for the gateway tests.
+
+It answers like the API: deterministic embeddings (as floats or base64, like the client asks), chat completions
+with and without streaming, and a 429 with Retry-After when the requests of the last minute go over
+requests_per_minute, or at random with error_rate. Point the OpenAI objects to it with base_url / openai_api_base:
+
+    python -m benchmark.mock_openai --port 8765 --rpm 600 --error-rate 0.05
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class MockOpenAI:
+    """The state of the mock: the rate limit and the counters of the requests."""
+
+    def __init__(self, requests_per_minute: float = 600, error_rate: float = 0.0, latency: float = 0.05,
+                 dimension: int = 256, seed: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.latency = latency
+        self.dimension = dimension
+        self._random = random.Random(seed)
+        self._times: "deque[float]" = deque()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.embedded_texts = 0
+
+    def admit(self) -> Optional[float]:
+        """None if the request is served, otherwise the seconds for Retry-After."""
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._times and now - self._times[0] > 60:
+                self._times.popleft()
+            if len(self._times) >= self.requests_per_minute:
+                self.rate_limited += 1
+                return max(60 - (now - self._times[0]), 0.1)
+            if self._random.random() < self.error_rate:
+                self.rate_limited += 1
+                return 0.5
+            self._times.append(now)
+            return None
+
+    def embedding(self, text) -> np.ndarray:
+        # the client may send the texts as lists of token ids
+        seed = int.from_bytes(hashlib.sha256(json.dumps(text).encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "embedded_texts": self.embedded_texts}
+
+
+def _handler(mock: MockOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            wait = mock.admit()
+            if wait is not None:
+                error = {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}
+                self._json(429, {"error": error}, {"Retry-After": f"{wait:.2f}"})
+                return
+            time.sleep(mock.latency)
+            if self.path.endswith("/embeddings"):
+                self._embeddings(request)
+            elif self.path.endswith("/chat/completions"):
+                self._chat(request)
+            else:
+                self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def _embeddings(self, request: Dict):
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            # a list of token ids is one text
+            if texts and isinstance(texts[0], int):
+                texts = [texts]
+            mock.embedded_texts += len(texts)
+            data = []
+            for i, text in enumerate(texts):
+                vector = mock.embedding(text)
+                embedding = (
+                    base64.b64encode(vector.tobytes()).decode("ascii")
+                    if request.get("encoding_format") == "base64"
+                    else vector.tolist()
+                )
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            tokens = sum(len(str(t)) // 4 + 1 for t in texts)
+            self._json(200, {"object": "list", "data": data, "model": request.get("model"),
+                             "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+        def _chat(self, request: Dict):
+            question = str(request["messages"][-1].get("content") or "")
+            answer = f"Mock answer to: {question[:200]}"
+            common = {"id": "chatcmpl-mock", "created": int(time.time()), "model": request.get("model")}
+            if not request.get("stream"):
+                tokens = {"prompt_tokens": len(json.dumps(request["messages"])) // 4, "completion_tokens": len(answer) // 4}
+                tokens["total_tokens"] = tokens["prompt_tokens"] + tokens["completion_tokens"]
+                choice = {"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}
+                self._json(200, {**common, "object": "chat.completion", "choices": [choice], "usage": tokens})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = answer.split(" ")
+            for i, word in enumerate(words):
+                delta = {"role": "assistant", "content": word + " "} if i == 0 else {"content": word + " "}
+                chunk = {**common, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            last = {**common, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.wfile.write(f"data: {json.dumps(last)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    return Handler
+
+
+def start_mock_server(mock: MockOpenAI, port: int = 0) -> ThreadingHTTPServer:
+    """Start the server in a background thread; its base URL is http://127.0.0.1:<server.server_port>/v1."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=float, default=600, help="requests per minute before the 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with 429")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    mock = MockOpenAI(args.rpm, args.error_rate, args.latency)
+    server = start_mock_server(mock, args.port)
+    print(f"Mock OpenAI API on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(10)
+            print(mock.stats())
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Synthetic news graph with the schema of the real one (db_schema.png), for the offline benchmarks.
+
+Countries with their cities, organizations in the cities (with the organizations of questions.txt, like
+Google and Clarity Insights), and articles which mention the organizations, with chunks about the topics
+of benchmark.fakes.TOPICS. The chunk embeddings come from TopicEmbeddings, so the benchmarks find them with
+the same fake embeddings. Every node has benchmark: true, so it can be deleted again. Point NEO4J_URI in the
+.env file to a local, empty database (for example docker run -p 7687:7687 -e NEO4J_AUTH=neo4j/password neo4j:5).
+
+    python -m benchmark.news_graph --articles 2000 --materialize-countries
+    python -m benchmark.news_graph --delete
+"""
+import argparse
+import datetime
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmark.fakes import TOPICS, TopicEmbeddings
+from repository.country_index import materialize_country_links
+from repository.graph_db import get_graph
+from repository.schema import apply_schema
+
+# the dimension of the chunk embeddings, the benchmarks embed the questions with the same
+DIMENSION = 256
+
+COUNTRIES = {
+    "United States": ["Mountain View", "Chicago", "New York", "Seattle"],
+    "Russia": ["Moscow", "Saint Petersburg", "Novosibirsk"],
+    "Germany": ["Berlin", "Munich", "Hamburg"],
+    "Netherlands": ["Amsterdam", "Rotterdam", "Utrecht"],
+    "France": ["Paris", "Lyon"],
+    "Japan": ["Tokyo", "Osaka"],
+}
+
+# (name, city, number of employees) of the organizations which the questions ask about;
+# the Amsterdam Green organizations are the similar names for "Amsterdam Green Member"
+KNOWN_ORGANIZATIONS = [
+    ("Google", "Mountain View", 190000),
+    ("Microsoft", "Seattle", 221000),
+    ("Clarity Insights", "Chicago", 350),
+    ("Amsterdam Green Members", "Amsterdam", 40),
+    ("Amsterdam Green Energy", "Amsterdam", 1200),
+    ("Yandex", "Moscow", 18000),
+    ("Gazprom", "Saint Petersburg", 466000),
+    ("Siemens", "Munich", 320000),
+]
+
+CREATE_PLACES_QUERY = """UNWIND $cities AS row
+MERGE (country:Country {name: row.country})
+SET country.benchmark = true
+MERGE (city:City {name: row.city})
+SET city.benchmark = true
+MERGE (city)-[:IN_COUNTRY]->(country)
+"""
+
+CREATE_ORGANIZATIONS_QUERY = """UNWIND $organizations AS row
+MERGE (o:Organization {name: row.name})
+SET o.nbrEmployees = row.number_employees, o.benchmark = true
+WITH o, row
+MATCH (city:City {name: row.city})
+MERGE (o)-[:IN_CITY]->(city)
+"""
+
+CREATE_ARTICLES_QUERY = """UNWIND $articles AS row
+CREATE (a:Article {id: row.id, benchmark: true})
+SET a.title = row.title, a.date = date(row.date), a.summary = row.summary
+WITH a, row
+CALL {
+    WITH a, row
+    UNWIND row.organizations AS name
+    MATCH (o:Organization {name: name})
+    MERGE (a)-[:MENTIONS]->(o)
+}
+CALL {
+    WITH a, row
+    UNWIND row.chunks AS chunk
+    CREATE (a)-[:HAS_CHUNK]->(c:Chunk {id: chunk.id, benchmark: true})
+    SET c.text = chunk.text
+    WITH c, chunk
+    CALL db.create.setNodeVectorProperty(c, 'embedding', chunk.embedding)
+}
+"""
+
+def generate_organizations(number: int, seed: int = 0) -> List[Dict]:
+    """The known organizations and number - len(KNOWN_ORGANIZATIONS) generated ones in random cities."""
+    rng = np.random.default_rng(seed)
+    cities = [city for country_cities in COUNTRIES.values() for city in country_cities]
+    organizations = [
+        {"name": name, "city": city, "number_employees": employees} for name, city, employees in KNOWN_ORGANIZATIONS
+    ]
+    for i in range(max(number - len(organizations), 0)):
+        organizations.append({
+            "name": f"Synthetic Organization {i}",
+            "city": cities[rng.integers(len(cities))],
+            # most organizations are small, a few are very big
+            "number_employees": int(rng.lognormal(7, 2)),
+        })
+    return organizations
+
+
+def generate_articles(
+    number: int, organizations: List[Dict], chunks_per_article: int, embeddings: TopicEmbeddings, seed: int = 0
+) -> List[Dict]:
+    """Articles which mention 1-3 organizations (the known ones more often), each about one topic,
+    with up to chunks_per_article chunks and a date in the last two years."""
+    rng = np.random.default_rng(seed)
+    names = [o["name"] for o in organizations]
+    # the known organizations are mentioned by many articles, so their news have several pages
+    weights = np.array([20.0 if i < len(KNOWN_ORGANIZATIONS) else 1.0 for i in range(len(names))])
+    weights /= weights.sum()
+    today = datetime.date(2024, 6, 1)
+    articles = []
+    for i in range(number):
+        topic = TOPICS[rng.integers(len(TOPICS))]
+        mentioned = [str(name) for name in rng.choice(names, size=int(rng.integers(1, 4)), replace=False, p=weights)]
+        date = today - datetime.timedelta(days=int(rng.integers(0, 730)))
+        texts = [
+            f"Article {i}, part {j}: {', '.join(mentioned)} in the news about {topic}. "
+            f"Synthetic text number {rng.integers(1_000_000)} with more details about {topic}."
+            for j in range(int(rng.integers(1, chunks_per_article + 1)))
+        ]
+        vectors = embeddings.embed_documents(texts)
+        articles.append({
+            "id": f"benchmark-article-{i}",
+            "title": f"Synthetic article {i} about {topic}",
+            "date": date.isoformat(),
+            "summary": f"{', '.join(mentioned)} and {topic}: synthetic summary of article {i}.",
+            "organizations": mentioned,
+            "chunks": [
+                {"id": f"benchmark-article-{i}-{j}", "text": text, "embedding": vector}
+                for j, (text, vector) in enumerate(zip(texts, vectors))
+            ],
+        })
+    return articles
+
+
+def write_news_graph(graph, organizations: List[Dict], articles: List[Dict], dimension: int, batch_size: int = 200):
+    cities = [
+        {"country": country, "city": city} for country, country_cities in COUNTRIES.items() for city in country_cities
+    ]
+    graph.query(CREATE_PLACES_QUERY, params={"cities": cities})
+    for i in range(0, len(organizations), batch_size):
+        graph.query(CREATE_ORGANIZATIONS_QUERY, params={"organizations": organizations[i:i + batch_size]})
+    for i in range(0, len(articles), batch_size):
+        graph.query(CREATE_ARTICLES_QUERY, params={"articles": articles[i:i + batch_size]})
+    # the same indexes as the real database
+    apply_schema(graph.query, dimension)
+
+
+def delete_news_graph(graph):
+    graph.query("MATCH (n) WHERE n.benchmark CALL { WITH n DETACH DELETE n } IN TRANSACTIONS")
+    graph.query("DROP INDEX news IF EXISTS")
+    graph.query("DROP INDEX entity IF EXISTS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--organizations", type=int, default=300)
+    parser.add_argument("--chunks-per-article", type=int, default=3)
+    parser.add_argument("--dimension", type=int, default=DIMENSION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--materialize-countries", action="store_true", help="create the MENTIONS_COUNTRY links")
+    parser.add_argument("--delete", action="store_true", help="delete the synthetic graph and its indexes")
+    args = parser.parse_args()
+
+    graph = get_graph()
+    if args.delete:
+        delete_news_graph(graph)
+        print("Deleted the synthetic news graph.")
+        return
+
+    # the benchmarks compare numbers of rows and timings, any other data in the database would change them
+    existing = graph.query("MATCH (a:Article) WHERE a.benchmark IS NULL RETURN count(a) AS count")[0]["count"]
+    if existing:
+        raise SystemExit(f"The database already has {existing} articles, use an empty local database.")
+
+    start = time.perf_counter()
+    embeddings = TopicEmbeddings(args.dimension, latency=0)
+    organizations = generate_organizations(args.organizations, args.seed)
+    articles = generate_articles(args.articles, organizations, args.chunks_per_article, embeddings, args.seed)
+    write_news_graph(graph, organizations, articles, args.dimension)
+    chunks = sum(len(a["chunks"]) for a in articles)
+    print(
+        f"Created {len(organizations)} organizations, {len(articles)} articles and {chunks} chunks "
+        f"in {time.perf_counter() - start:.1f}s."
+    )
+    if args.materialize_countries:
+        print(f"Linked {materialize_country_links(graph.query)} articles to their countries.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Load test of the OpenAI gateway against the local mock of the API, which answers with 429s over its limit.
+
+Every simulated session embeds a popular topic (many sessions ask about the same topics at the same moment)
+and asks the chat model, like one turn of the agent. The run without the gateway uses the OpenAI objects
+with their own retries.
+
+    python -m benchmark.openai_gateway_load --sessions 200 --rpm 300 --error-rate 0.05
+    python -m benchmark.openai_gateway_load --sessions 200 --rpm 300 --error-rate 0.05 --no-gateway
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from benchmark.fakes import TOPICS
+from benchmark.mock_openai import MockOpenAI, start_mock_server
+from benchmark.stats import print_table, summarize
+from repository.openai_gateway import GatewayChatModel, GatewayEmbeddings, TokenBucketLimiter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rpm", type=float, default=300, help="requests per minute of the mock API")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="share of random 429s")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--no-gateway", action="store_true", help="only the retries of the OpenAI client")
+    args = parser.parse_args()
+
+    mock = MockOpenAI(args.rpm, args.error_rate, args.latency)
+    server = start_mock_server(mock)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    client = {"openai_api_key": "mock", "openai_api_base": base_url}
+    if args.no_gateway:
+        embeddings = OpenAIEmbeddings(check_embedding_ctx_length=False, **client)
+        llm = ChatOpenAI(model="gpt-4-turbo", **client)
+    else:
+        # the embeddings and the chat model share the limit of the mock
+        limiter = TokenBucketLimiter(args.rpm, 10_000_000, name="mock")
+        embeddings = GatewayEmbeddings(
+            OpenAIEmbeddings(check_embedding_ctx_length=False, max_retries=0, **client), limiter
+        )
+        llm = GatewayChatModel(inner=ChatOpenAI(model="gpt-4-turbo", max_retries=0, **client), limiter=limiter)
+
+    # the popular topics are asked much more often (Zipf-like)
+    rng = random.Random(0)
+    weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    topics = rng.choices(TOPICS, weights, k=args.sessions)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def session(topic: str):
+        start = time.perf_counter()
+        try:
+            embeddings.embed_query(topic)
+            llm.invoke(f"What are the news about {topic}?")
+        except Exception as e:
+            with lock:
+                errors.append(type(e).__name__)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(session, topics))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print_table({"sessions": summarize(latencies, elapsed)}, ["p50_ms", "p95_ms", "max_ms", "count"])
+    print(f"failed sessions: {len(errors)}, mock API: {mock.stats()}")
+    if not args.no_gateway:
+        print(f"gateway: {embeddings.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""End-to-end replay of the questions in questions.txt through the agent executor and the chat service.
+
+The agent runs with its real prompt, tools and repository functions against the synthetic news graph
+(python -m benchmark.news_graph), with local stand-ins for OpenAI:
+
+    python -m benchmark.replay_questions                          # the scripted LLM
+    python -m benchmark.replay_questions --record                 # the real LLM, recording its responses
+    python -m benchmark.replay_questions --replay                 # the recorded responses again
+    python -m benchmark.replay_questions --output .benchmarks/replay.json
+    python -m benchmark.replay_questions --baseline .benchmarks/replay.json
+    python -m benchmark.replay_questions --sequential-tools       # one tool call per LLM response
+    python -m benchmark.replay_questions --no-router              # all questions through the agent
+    python -m benchmark.replay_questions --no-speculation         # no prefetch while the LLM chooses the tools
+
+It reports p50/p95 latency and time to first token of the turns, the throughput, and the LLM calls,
+tokens and tool calls per turn; --sequential-tools shows how many more LLM round trips the questions
+need without parallel tool calls. The bypass rate is the share of the turns answered by the intent router,
+and the latency of the turns is reported by what answered them (compare with --no-router for the
+savings). The speculative prefetch reports how many of its lookups the tools used and the seconds it saved
+and wasted (compare with --no-speculation). With --baseline it exits with status 1 on a regression.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmark.fake_llm import RecordingChatModel, ReplayChatModel, ScriptedChatModel
+from benchmark.fakes import TopicEmbeddings
+from benchmark.news_graph import DIMENSION
+from benchmark.stats import compare_to_baseline, percentile, print_table, save_results, summarize
+from observability.metrics import registry
+from repository.async_graph_db import set_async_embeddings
+from repository.graph_db import set_embeddings
+from service.agent import create_agent_executor
+from service.answer_cache import SemanticAnswerCache
+from service.intent_router import IntentRouter
+from service.serving import ChatService, ChatSession
+from service.speculation import SpeculativePrefetcher, get_prefetcher, set_prefetcher
+
+RECORDINGS_PATH = ".benchmarks/llm_recordings.jsonl"
+_FOLLOW_UP = re.compile(r"Then ask:\s*(.+?)\s*(?:->|$)")
+
+
+def load_conversations(path: str = "questions.txt") -> List[List[str]]:
+    """The questions, every one in its own conversation; the indented "Then ask:" lines are the next
+    question of the conversation above them."""
+    conversations = []
+    for line in open(path, encoding="utf-8"):
+        if not line.strip():
+            continue
+        follow_up = _FOLLOW_UP.search(line)
+        if line.startswith((" ", "\t")) and follow_up and conversations:
+            conversations[-1].append(follow_up.group(1))
+        elif not line.startswith((" ", "\t")):
+            conversations.append([line.split("->")[0].strip()])
+    return conversations
+
+
+def _create_llm(args):
+    if args.record:
+        from langchain_openai import ChatOpenAI
+
+        os.makedirs(os.path.dirname(args.recordings) or ".", exist_ok=True)
+        return RecordingChatModel(
+            inner=ChatOpenAI(temperature=0, model="gpt-4-turbo", streaming=True), path=args.recordings
+        )
+    latency = {"first_token_latency": args.first_token_latency, "tokens_per_second": args.tokens_per_second}
+    if args.replay:
+        return ReplayChatModel.from_file(args.recordings, **latency)
+    return ScriptedChatModel(**latency)
+
+
+def _conversation(service: ChatService, questions: List[str]) -> List[Dict]:
+    session = ChatSession()
+    for question in questions:
+        service.answer(session, question)
+    return [dict(metrics, question=question) for question, metrics in zip(questions, session.metrics)]
+
+
+def _llm_stats(turns: int) -> Dict[str, float]:
+    llm = [stats for name, stats in registry.snapshot().items() if name.startswith("llm:")]
+    return {
+        "llm_calls_per_turn": sum(s.get("count", 0) for s in llm) / turns,
+        "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in llm) / turns,
+        "completion_tokens": sum(s.get("completion_tokens", 0) for s in llm) / turns,
+        "cost_usd_per_turn": sum(s.get("cost_usd", 0) for s in llm) / turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", action="store_true", help="use the OpenAI LLM and record its responses")
+    mode.add_argument("--replay", action="store_true", help="play back the recorded responses")
+    parser.add_argument("--recordings", default=RECORDINGS_PATH)
+    parser.add_argument("--repeat", type=int, default=3, help="how many times every conversation runs")
+    parser.add_argument("--concurrency", type=int, default=4, help="conversations at the same time")
+    parser.add_argument("--first-token-latency", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--dimension", type=int, default=DIMENSION)
+    parser.add_argument(
+        "--sequential-tools", action="store_true", help="bind the tools with the functions API, one call per response"
+    )
+    parser.add_argument("--no-router", action="store_true", help="do not answer structured questions without the agent")
+    parser.add_argument("--no-speculation", action="store_true", help="do not prefetch the likely tool lookups")
+    parser.add_argument("--answer-cache", action="store_true", help="answer the repeated questions from the cache")
+    parser.add_argument("--output", help="save the results as JSON, to compare later runs with")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    embeddings = TopicEmbeddings(args.dimension, latency=0.05)
+    set_embeddings(embeddings)
+    set_async_embeddings(embeddings)
+    set_prefetcher(SpeculativePrefetcher(enabled=not args.no_speculation))
+    llm = _create_llm(args)
+    answer_cache = SemanticAnswerCache(embeddings, max_entries=None if args.answer_cache else 0)
+    service = ChatService(
+        create_agent_executor(llm, parallel_tool_calls=not args.sequential_tools),
+        args.concurrency,
+        answer_cache=answer_cache,
+        router=IntentRouter(enabled=not args.no_router),
+    )
+
+    conversations = load_conversations() * args.repeat
+    registry.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        turns = [turn for result in pool.map(lambda c: _conversation(service, c), conversations) for turn in result]
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for question in dict.fromkeys(turn["question"] for turn in turns):
+        latencies = [t["total_latency"] for t in turns if t["question"] == question]
+        results[question[:60]] = summarize(latencies)
+    all_turns = summarize([t["total_latency"] for t in turns], elapsed)
+    first_tokens = [t["time_to_first_token"] for t in turns if t["time_to_first_token"] is not None]
+    if first_tokens:
+        all_turns["ttft_p50_ms"] = percentile(first_tokens, 50) * 1000
+        all_turns["ttft_p95_ms"] = percentile(first_tokens, 95) * 1000
+    all_turns["tool_calls_per_turn"] = sum(len(t["tool_calls"]) for t in turns) / len(turns)
+    all_turns.update(_llm_stats(len(turns)))
+    all_turns["bypass_rate"] = service.router.stats()["bypass_rate"]
+    speculation = get_prefetcher().stats()
+    all_turns["prefetch_hit_rate"] = speculation["hit_rate"]
+    all_turns["prefetch_saved_ms_per_turn"] = speculation["saved_seconds"] * 1000 / len(turns)
+    all_turns["prefetch_wasted_ms_per_turn"] = speculation["wasted_seconds"] * 1000 / len(turns)
+    results["all turns"] = all_turns
+    for source in sorted({t["source"] for t in turns}):
+        results[f"answered by {source}"] = summarize([t["total_latency"] for t in turns if t["source"] == source])
+
+    print_table(results, ["p50_ms", "p95_ms", "count"])
+    print(f"turns: {len(turns)}, wall time: {elapsed:.2f}s, throughput: {all_turns['throughput_per_s']:.2f} turns/s")
+    for key in ("ttft_p50_ms", "ttft_p95_ms", "tool_calls_per_turn", "llm_calls_per_turn",
+                "prompt_tokens", "completion_tokens", "cost_usd_per_turn", "bypass_rate",
+                "prefetch_hit_rate", "prefetch_saved_ms_per_turn", "prefetch_wasted_ms_per_turn"):
+        if key in all_turns:
+            print(f"{key}: {all_turns[key]:.4g}")
+    if isinstance(llm, ReplayChatModel):
+        print(f"replayed LLM responses: {llm.replayed}, answered by the rules: {llm.scripted}")
+
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print("regression:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Microbenchmarks of the functions in repository/queries.py against the synthetic news graph.
+
+Create the graph first with python -m benchmark.news_graph. The questions are embedded locally with
+TopicEmbeddings, so only the database is measured (add --embedding-latency to simulate the OpenAI API).
+The result cache is off unless --cache is given, so every call goes to the database.
+
+    python -m benchmark.repository_micro --repeat 50 --output .benchmarks/repository.json
+    python -m benchmark.repository_micro --repeat 50 --baseline .benchmarks/repository.json
+
+With --baseline it exits with status 1 if a function got slower than the baseline by more than --tolerance.
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Dict
+
+from benchmark.fakes import TopicEmbeddings
+from benchmark.news_graph import DIMENSION
+from benchmark.stats import compare_to_baseline, print_table, save_results, summarize
+from observability.metrics import registry
+from repository.cypher import CANDIDATES_QUERY
+from repository.entity_resolver import country_resolver, organization_resolver
+from repository.graph_db import set_embeddings
+from repository.queries import (
+    _run_query,
+    brute_force_range_search,
+    filter_by_country,
+    filter_by_number_employees,
+    filter_news_by_topic_with_score,
+    filter_news_by_topics_with_score,
+    find_country,
+    find_organization,
+    get_candidates,
+    get_number_employees,
+    hybrid_search,
+    search_by_organization,
+    search_news_by_topic,
+    vector_range_search,
+)
+from repository.result_cache import set_result_cache
+
+
+def _benchmarks(embeddings: TopicEmbeddings) -> Dict[str, Callable[[], object]]:
+    # the same arguments as the tools get for the questions in questions.txt
+    topic_embedding = embeddings.embed_query("health benefits")
+    return {
+        "get_candidates": lambda: get_candidates("Gogle", CANDIDATES_QUERY),
+        "search_news_by_topic": lambda: search_news_by_topic("health benefits"),
+        "vector_range_search": lambda: vector_range_search(topic_embedding, 0.85, 0.92),
+        "brute_force_range_search": lambda: brute_force_range_search(topic_embedding, 0.85, 0.92),
+        "filter_news_by_topic_with_score": lambda: filter_news_by_topic_with_score("health benefits", 0.85, 0.92),
+        "filter_news_by_topics_with_score": lambda: filter_news_by_topics_with_score(
+            ["health benefits", "renewable energy", "layoffs"], 0.85, 0.92
+        ),
+        "hybrid_search": lambda: hybrid_search("layoffs", "Google"),
+        "find_organization": lambda: find_organization("Gogle"),
+        "search_by_organization": lambda: search_by_organization("Google"),
+        "filter_by_number_employees": lambda: filter_by_number_employees(30000),
+        "get_number_employees": lambda: get_number_employees("Clarity Insights"),
+        "find_country": lambda: find_country("Rusia"),
+        "filter_by_country": lambda: filter_by_country("Russia"),
+    }
+
+
+def _wait_for_resolvers(timeout: float = 30):
+    # the names are loaded in a background thread on the first call, the benchmarks measure the loaded state
+    find_organization("Google")
+    find_country("Russia")
+    deadline = time.monotonic() + timeout
+    while not (organization_resolver.loaded and country_resolver.loaded) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run(function: Callable[[], object], repeat: int, warmup: int) -> Dict[str, float]:
+    """Latency of the function, and the Cypher queries and rows of one call."""
+    for _ in range(warmup):
+        function()
+    registry.reset()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - call_start)
+    result = summarize(latencies, time.perf_counter() - start)
+    cypher = [stats for name, stats in registry.snapshot().items() if name.startswith("cypher:")]
+    result["queries_per_call"] = sum(s.get("count", 0) for s in cypher) / repeat
+    result["rows_per_call"] = sum(s.get("rows", 0) for s in cypher) / repeat
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--dimension", type=int, default=DIMENSION)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--cache", action="store_true", help="keep the result cache on")
+    parser.add_argument("--only", nargs="+", help="run only these functions")
+    parser.add_argument("--output", help="save the results as JSON, to compare later runs with")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    embeddings = TopicEmbeddings(args.dimension, latency=args.embedding_latency)
+    set_embeddings(embeddings)
+    if not args.cache:
+        set_result_cache(None)
+    if _run_query("MATCH (a:Article) WHERE a.benchmark RETURN count(a) AS count")[0]["count"] == 0:
+        raise SystemExit("The synthetic news graph is empty, create it with python -m benchmark.news_graph")
+    _wait_for_resolvers()
+
+    results = {}
+    for name, function in _benchmarks(embeddings).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run(function, args.repeat, args.warmup)
+    print_table(results, ["p50_ms", "p95_ms", "throughput_per_s", "queries_per_call", "rows_per_call"])
+
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print("regression:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
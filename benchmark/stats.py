@@ -0,0 +1,72 @@
+"""Latency statistics of the benchmarks, and the comparison with the results of an earlier run."""
+import json
+import math
+import os
+import statistics
+from typing import Dict, List, Optional
+
+# the metrics which are worse when they are higher, and compared with the baseline
+COMPARED = ("p50_ms", "p95_ms", "prompt_tokens", "completion_tokens")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """The q-th percentile (0 < q <= 100) of the values, by the nearest rank."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * q / 100) - 1, 0)]
+
+
+def summarize(latencies: List[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """p50, p95, mean and max in milliseconds of the latencies in seconds, and the throughput
+    (calls per second) if the wall time of the run is given."""
+    if not latencies:
+        return {"count": 0}
+    summary = {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+    if elapsed:
+        summary["throughput_per_s"] = len(latencies) / elapsed
+    return summary
+
+
+def print_table(results: Dict[str, Dict[str, float]], columns: List[str]):
+    """One line for every benchmark, with the columns which it has."""
+    width = max([len(name) for name in results] + [9])
+    print(f"{'benchmark':<{width}} " + " ".join(f"{column:>14}" for column in columns))
+    for name, result in results.items():
+        values = []
+        for column in columns:
+            value = result.get(column)
+            values.append(f"{value:>14.1f}" if isinstance(value, (int, float)) else f"{'-':>14}")
+        print(f"{name:<{width}} " + " ".join(values))
+
+
+def save_results(path: str, results: Dict[str, Dict[str, float]]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, float]], baseline_path: str, tolerance: float = 0.2, min_ms: float = 1.0
+) -> List[str]:
+    """The regressions against the results saved in baseline_path: the metrics which are more than
+    tolerance (relative) worse. Differences under min_ms milliseconds are noise."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, result in results.items():
+        for metric in COMPARED:
+            old, new = baseline.get(name, {}).get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if metric.endswith("_ms") and new - old < min_ms:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {old:.1f} -> {new:.1f}")
+    return regressions
@@ -0,0 +1,89 @@
+"""Multi-session benchmark of the Streamlit page, driven headlessly with streamlit.testing against a stub agent.
+
+Every session runs the page in its own thread and sends the questions from questions.txt,
+so many sessions chat at the same time through the shared chat service.
+
+    python -m benchmark.streamlit_sessions --sessions 20 --max-concurrency 8
+
+With --answer-cache the repeated questions are answered from the answer cache (with fake embeddings).
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from benchmark.fakes import FakeAgentExecutor, FakeEmbeddings
+from service.answer_cache import SemanticAnswerCache
+from service.intent_router import IntentRouter
+from service.serving import ChatService, set_chat_service
+
+QUESTIONS = [
+    line.split("->")[0].strip()
+    for line in open("questions.txt", encoding="utf-8")
+    if line.strip() and not line.startswith(" ")
+]
+
+
+def _session(turns: int, latencies, errors):
+    app = AppTest.from_file("web/streamlit.py", default_timeout=120)
+    app.run()
+    for i in range(turns):
+        start = time.perf_counter()
+        app.chat_input[0].set_value(QUESTIONS[i % len(QUESTIONS)]).run()
+        if app.exception:
+            errors.append(str(app.exception[0].value))
+            return
+        latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--answer-cache", action="store_true", help="answer the repeated questions from the cache")
+    args = parser.parse_args()
+
+    # the page gets this service from get_chat_service(), so all sessions use the stub agent
+    answer_cache = SemanticAnswerCache(
+        FakeEmbeddings(), max_entries=5000 if args.answer_cache else 0, run_query=lambda query, params=None: []
+    )
+    # there is no database, all questions go to the stub agent
+    service = ChatService(
+        FakeAgentExecutor(args.first_token_latency),
+        args.max_concurrency,
+        answer_cache=answer_cache,
+        router=IntentRouter(enabled=False),
+    )
+    set_chat_service(service)
+
+    latencies, errors = [], []
+    threads = [
+        threading.Thread(target=_session, args=(args.turns, latencies, errors)) for _ in range(args.sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"sessions: {args.sessions}, turns per session: {args.turns}, max concurrency: {args.max_concurrency}")
+    print(f"turns: {len(latencies)}, errors: {len(errors)}, wall time: {elapsed:.2f}s")
+    if latencies:
+        print(f"throughput: {len(latencies) / elapsed:.1f} turns/s")
+        print(
+            f"p50: {statistics.median(latencies) * 1000:.0f} ms, "
+            f"p95: {latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000:.0f} ms"
+        )
+    print("service:", service.stats())
+    for error in errors[:5]:
+        print("error:", error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+from typing import Dict, List
+
+import numpy as np
+
+
+def generate_topic_centroids(number_topics: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Generate random unit vectors that represent the topics of the synthetic news."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((number_topics, dimension)).astype(np.float32)
+    # normalize every row so the cosine similarity is just a dot product
+    return centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+
+
+def generate_chunk_embeddings(
+    centroids: np.ndarray, number_chunks: int, noise: float = 0.9, seed: int = 1
+) -> np.ndarray:
+    """Generate embeddings for chunks around the topic centroids.
+    The noise controls how similar the chunks of the same topic are between each other.
+    """
+    rng = np.random.default_rng(seed)
+    dimension = centroids.shape[1]
+    # every chunk belongs to a random topic
+    topics = rng.integers(0, len(centroids), number_chunks)
+    vectors = centroids[topics] + noise * rng.standard_normal((number_chunks, dimension)).astype(np.float32) / np.sqrt(dimension)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def generate_chunks(
+    centroids: np.ndarray, number_chunks: int, start: int = 0, noise: float = 0.9, seed: int = 1
+) -> List[Dict]:
+    """Generate chunk rows (id, text, embedding) ready to be written to the graph database."""
+    vectors = generate_chunk_embeddings(centroids, number_chunks, noise, seed + start)
+    return [
+        {"id": f"synthetic-{start + i}", "text": f"Synthetic chunk number {start + i}.", "embedding": v.tolist()}
+        for i, v in enumerate(vectors)
+    ]
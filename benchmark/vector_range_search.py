@@ -0,0 +1,98 @@
+"""Benchmark of the vector index range search against the brute-force scan of all chunks.
+
+Synthetic chunks are written to the graph database from the .env file, so point NEO4J_URI to a local,
+empty database (for example docker run -p 7687:7687 -e NEO4J_AUTH=neo4j/password neo4j:5).
+
+    python -m benchmark.vector_range_search --sizes 1000 5000 20000 50000
+"""
+import argparse
+import statistics
+import time
+
+from benchmark.synthetic import generate_chunks, generate_topic_centroids
+from repository.graph_db import get_graph
+from repository.queries import brute_force_range_search, vector_range_search
+
+
+def _write_chunks(graph, chunks, batch_size: int = 1000):
+    # every chunk gets its own article, because the queries match only chunks connected to an article
+    query = """UNWIND $chunks AS chunk
+    CREATE (a:Article {id: chunk.id, benchmark: true})-[:HAS_CHUNK]->(c:Chunk {id: chunk.id, benchmark: true})
+    SET c.text = chunk.text
+    WITH c, chunk
+    CALL db.create.setNodeVectorProperty(c, 'embedding', chunk.embedding)
+    """
+    for i in range(0, len(chunks), batch_size):
+        graph.query(query, params={"chunks": chunks[i:i + batch_size]})
+
+
+def _median_ms(function, queries, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            function(q)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    graph = get_graph()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--low", type=float, default=0.85)
+    parser.add_argument("--upper", type=float, default=0.92)
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--keep", action="store_true", help="do not delete the synthetic chunks at the end")
+    args = parser.parse_args()
+
+    # the brute-force query scans every chunk, so any other chunk in the database would change the results
+    existing = graph.query("MATCH (c:Chunk) RETURN count(c) AS count")[0]["count"]
+    if existing:
+        raise SystemExit(f"The database already has {existing} chunks, use an empty local database.")
+
+    graph.query(
+        """CREATE VECTOR INDEX news IF NOT EXISTS FOR (c:Chunk) ON (c.embedding)
+        OPTIONS {indexConfig: {`vector.dimensions`: $dimension, `vector.similarity_function`: 'cosine'}}""",
+        params={"dimension": args.dimension},
+    )
+    centroids = generate_topic_centroids(args.topics, args.dimension)
+    # the queries are generated around the same topics as the chunks, so some chunks land inside the bounds
+    queries = [q.tolist() for q in generate_topic_centroids(args.topics, args.dimension)[: args.queries]]
+
+    print(f"{'chunks':>8} {'index ms':>10} {'scan ms':>10} {'faster':>8}")
+    crossover = None
+    written = 0
+    try:
+        for size in sorted(args.sizes):
+            _write_chunks(graph, generate_chunks(centroids, size - written, start=written))
+            written = size
+            graph.query("CALL db.awaitIndexes(600)")
+
+            index_ms = _median_ms(
+                lambda q: vector_range_search(q, args.low, args.upper, args.k), queries, args.repeat
+            )
+            scan_ms = _median_ms(
+                lambda q: brute_force_range_search(q, args.low, args.upper, args.k), queries, args.repeat
+            )
+            faster = "index" if index_ms < scan_ms else "scan"
+            if faster == "index" and crossover is None:
+                crossover = size
+            print(f"{size:>8} {index_ms:>10.2f} {scan_ms:>10.2f} {faster:>8}")
+    finally:
+        if not args.keep:
+            graph.query("MATCH (n) WHERE n.benchmark CALL { WITH n DETACH DELETE n } IN TRANSACTIONS")
+            graph.query("DROP INDEX news IF EXISTS")
+
+    if crossover is None:
+        print("The vector index was not faster for any of the sizes.")
+    else:
+        print(f"The vector index is faster from {crossover} chunks.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""LangChain callback handler which records the spans of the agent run: the LLM calls with their tokens
+and cost, and the tool calls. Give it in the config of the run, so the LLM and the tools inherit it:
+
+    agent_executor.astream_events(agent_input, config={"callbacks": [InstrumentationCallbackHandler()]})
+"""
+import threading
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from observability.tracing import Span, estimate_cost, start_span
+
+
+def _count_tokens(text: str) -> int:
+    # the tokenizer of the chat models, imported only when the first LLM call is recorded
+    from service.chat_history import count_tokens
+
+    return count_tokens(text) if text else 0
+
+
+class InstrumentationCallbackHandler(BaseCallbackHandler):
+    """Opens a span when a run starts and ends it when the run ends, by the run id.
+
+    The agent run (the chain without a parent) is the parent of the LLM and tool spans. The streaming
+    LLM calls do not return the token usage, so the tokens are counted with the tokenizer then.
+    """
+
+    def __init__(self):
+        self._spans: Dict[UUID, Span] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], kind: str, name: str, **attributes):
+        with self._lock:
+            parent = self._spans.get(parent_run_id) if parent_run_id else None
+            self._spans[run_id] = start_span(kind, name, parent.span_id if parent else None, **attributes)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes):
+        with self._lock:
+            current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.set(**attributes)
+            current.end(error)
+
+    # the agent executor
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        if parent_run_id is None:
+            self._start(run_id, None, "agent", kwargs.get("name") or "agent")
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    # the LLM calls
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or "llm"
+        prompt_tokens = sum(_count_tokens(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, parent_run_id, "llm", model, model=model, prompt_tokens=prompt_tokens)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or "llm"
+        prompt_tokens = sum(_count_tokens(p) for p in prompts)
+        self._start(run_id, parent_run_id, "llm", model, model=model, prompt_tokens=prompt_tokens)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        current = self._spans.get(run_id)
+        if current is not None and "time_to_first_token" not in current.attributes:
+            current.set(time_to_first_token=current.elapsed())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        current = self._spans.get(run_id)
+        if current is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or current.attributes.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = 0
+            for generations in response.generations:
+                for generation in generations:
+                    completion_tokens += _count_tokens(generation.text)
+                    message = getattr(generation, "message", None)
+                    message_kwargs = message.additional_kwargs if message else {}
+                    # the function call of the functions API, or the tool calls of the tools API
+                    calls = [message_kwargs["function_call"]] if message_kwargs.get("function_call") else []
+                    calls += [call.get("function") or {} for call in message_kwargs.get("tool_calls") or []]
+                    for call in calls:
+                        completion_tokens += _count_tokens(call.get("name") or "")
+                        completion_tokens += _count_tokens(call.get("arguments") or "")
+        cost = estimate_cost(current.attributes.get("model"), prompt_tokens, completion_tokens)
+        attributes = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        if cost is not None:
+            attributes["cost_usd"] = cost
+        self._end(run_id, **attributes)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    # the tools
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        self._start(run_id, parent_run_id, "tool", serialized.get("name") or kwargs.get("name") or "tool")
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, output_tokens=_count_tokens(str(output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
@@ -0,0 +1,51 @@
+"""Logging of the application: leveled, with the debug messages (the results of the queries and the tools)
+only sampled, so they do not slow down every answer."""
+import logging
+import os
+import random
+import threading
+from typing import Optional
+
+_configured = False
+_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """Let through all records from INFO up, and only sample_rate of the DEBUG records."""
+
+    def __init__(self, sample_rate: float = 0.01):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self.sample_rate
+
+
+def configure_observability(level: Optional[str] = None, debug_sample_rate: Optional[float] = None):
+    """Configure the logging of the process (only the first call does something) and start the metrics
+    endpoint if OBSERVABILITY_METRICS_PORT is set. Called by the entry points, not by the modules."""
+    global _configured
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter(
+        debug_sample_rate if debug_sample_rate is not None else float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+    ))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
+    # the HTTP requests of every OpenAI call are logged by these libraries on INFO
+    for name in ("httpx", "openai", "neo4j"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    port = os.getenv("OBSERVABILITY_METRICS_PORT")
+    if port:
+        from observability.metrics import start_metrics_server
+
+        start_metrics_server(int(port))
+        logging.getLogger(__name__).info("Metrics on http://127.0.0.1:%s/metrics", port)
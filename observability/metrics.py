@@ -0,0 +1,118 @@
+"""Aggregated metrics of the spans, in the Prometheus text format.
+
+Every finished span is added to a latency histogram by its kind (llm, embedding, cypher, tool, repository,
+turn, speculation), name and status, and its rows, tokens, cost, LLM and tool calls and the seconds saved and
+wasted by the speculative prefetch to counters. The metrics can be
+read with render_prometheus(), or scraped from the HTTP endpoint started with start_metrics_server().
+"""
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+PREFIX = "news_chatbot"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# span attributes which are added up to counters
+COUNTERS = (
+    "rows", "texts", "prompt_tokens", "completion_tokens", "cost_usd", "llm_calls", "tool_calls",
+    "saved_seconds", "wasted_seconds",
+)
+
+
+class MetricsRegistry:
+    """Histograms and counters of the spans, by (kind, name, status)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[tuple, List] = {}
+        self._counters: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def record(self, span):
+        key = (span.kind, span.name, "error" if span.error else "ok")
+        with self._lock:
+            # counts of every bucket, the sum and the count of the durations
+            histogram = self._histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += span.duration
+            histogram[2] += 1
+            for counter in COUNTERS:
+                value = span.attributes.get(counter)
+                if isinstance(value, (int, float)):
+                    self._counters[key[:2]][counter] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and average seconds and the counters of every kind and name."""
+        with self._lock:
+            result = {}
+            for (kind, name, status), (_, total, count) in self._histograms.items():
+                stats = result.setdefault(f"{kind}:{name}", {"count": 0, "errors": 0, "seconds": 0.0})
+                stats["count"] += count
+                stats["seconds"] += total
+                if status == "error":
+                    stats["errors"] += count
+            for (kind, name), counters in self._counters.items():
+                result.setdefault(f"{kind}:{name}", {}).update(counters)
+            for stats in result.values():
+                if stats.get("count"):
+                    stats["average_seconds"] = stats["seconds"] / stats["count"]
+            return result
+
+    def render_prometheus(self) -> str:
+        lines = [
+            f"# HELP {PREFIX}_stage_duration_seconds Duration of the stages of the answers.",
+            f"# TYPE {PREFIX}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (kind, name, status), (counts, total, count) in sorted(self._histograms.items()):
+                labels = f'kind="{kind}",name="{_escape(name)}",status="{status}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{PREFIX}_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'{PREFIX}_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"{PREFIX}_stage_duration_seconds_sum{{{labels}}} {total}")
+                lines.append(f"{PREFIX}_stage_duration_seconds_count{{{labels}}} {count}")
+            for counter in COUNTERS:
+                lines.append(f"# TYPE {PREFIX}_{counter}_total counter")
+                for (kind, name), counters in sorted(self._counters.items()):
+                    if counter in counters:
+                        labels = f'kind="{kind}",name="{_escape(name)}"'
+                        lines.append(f"{PREFIX}_{counter}_total{{{labels}}} {counters[counter]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # every scrape would be written to stderr
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the metrics on http://host:port/metrics from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,223 @@
+"""Spans of the stages of an answer: LLM calls, embedding calls, Cypher queries, tools and repository functions.
+
+A span is opened with the span() context manager or the traced() decorator, and when it ends it is given to
+the sinks: the metrics registry (always), a JSON-lines file if OBSERVABILITY_SPANS_PATH is set, and
+OpenTelemetry if OBSERVABILITY_OTEL=1 and the opentelemetry package is installed.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from observability.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+
+# price in USD per 1M tokens (input, output), to estimate the cost of the calls
+PRICES = {
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "text-embedding-ada-002": (0.1, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int = 0) -> Optional[float]:
+    """Cost of a call in USD, None for an unknown model."""
+    # the longest name that the model starts with, e.g. gpt-4-turbo-2024-04-09 is gpt-4-turbo
+    names = [name for name in PRICES if model and model.startswith(name)]
+    if not names:
+        return None
+    input_price, output_price = PRICES[max(names, key=len)]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+@dataclass
+class Span:
+    """One timed stage. The duration is in seconds, start is the wall clock time."""
+
+    kind: str
+    name: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    parent_id: Optional[int] = None
+    span_id: int = field(default_factory=lambda: next(_ids))
+    start: float = field(default_factory=time.time)
+    duration: float = 0.0
+    error: Optional[str] = None
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        """Seconds since the start of the span."""
+        return time.perf_counter() - self._started
+
+    def end(self, error: Optional[BaseException] = None):
+        """End the span and give it to the sinks."""
+        self.duration = self.elapsed()
+        if error is not None:
+            self.error = type(error).__name__
+        _record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_sinks: List[Callable[[Span], None]] = [registry.record]
+
+
+def add_sink(sink: Callable[[Span], None]):
+    """Give the finished spans also to the sink."""
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[Span], None]):
+    _sinks.remove(sink)
+
+
+def _record(finished: Span):
+    for sink in list(_sinks):
+        try:
+            sink(finished)
+        except Exception:
+            logger.exception("Span sink %r failed", sink)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def start_span(kind: str, name: str, parent_id: Optional[int] = None, **attributes) -> Span:
+    """A span which is ended with span.end(), for stages that start and end in different calls
+    (like the callbacks of LangChain). The parent is the current span if parent_id is not given."""
+    if parent_id is None:
+        parent = _current.get()
+        parent_id = parent.span_id if parent else None
+    return Span(kind, name, attributes, parent_id)
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes) -> Iterator[Span]:
+    """Time the block; the spans opened inside it are its children."""
+    current = start_span(kind, name, **attributes)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        current.end(error)
+
+
+def _result_attributes(current: Span, result: Any):
+    # the number of rows of the results which are lists
+    if isinstance(result, list):
+        current.set(rows=len(result))
+
+
+def traced(kind: str = "repository", name: Optional[str] = None):
+    """Decorator which records a span for every call of the function (sync or async)."""
+
+    def decorator(function):
+        span_name = name or function.__name__
+
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(kind, span_name) as current:
+                    result = await function(*args, **kwargs)
+                    _result_attributes(current, result)
+                    return result
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(kind, span_name) as current:
+                result = function(*args, **kwargs)
+                _result_attributes(current, result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+class JsonLinesSink:
+    """Write the spans to a file, one JSON object per line. Only sample_rate of the spans are written."""
+
+    def __init__(self, path: str, sample_rate: float = 1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, finished: Span):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        line = json.dumps(finished.to_dict(), default=str) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class OpenTelemetrySink:
+    """Copy the spans to the OpenTelemetry tracer provider which is configured in the process."""
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer("news_chatbot")
+
+    def __call__(self, finished: Span):
+        start_ns = int(finished.start * 1e9)
+        otel_span = self._tracer.start_span(f"{finished.kind} {finished.name}", start_time=start_ns)
+        for key, value in finished.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        if finished.error:
+            otel_span.set_attribute("error.type", finished.error)
+        otel_span.end(end_time=start_ns + int(finished.duration * 1e9))
+
+
+def _install_configured_sinks():
+    path = os.getenv("OBSERVABILITY_SPANS_PATH")
+    if path:
+        add_sink(JsonLinesSink(path, float(os.getenv("OBSERVABILITY_SPANS_SAMPLE_RATE", "1.0"))))
+    if os.getenv("OBSERVABILITY_OTEL") == "1":
+        try:
+            add_sink(OpenTelemetrySink())
+        except ImportError:
+            logger.warning("OBSERVABILITY_OTEL=1 but the opentelemetry package is not installed")
+
+
+_install_configured_sinks()
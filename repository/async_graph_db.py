@@ -0,0 +1,74 @@
+"""Async access to the graph database and embeddings, for serving many conversations from one process."""
+import os
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from neo4j import AsyncDriver, AsyncGraphDatabase, RoutingControl
+
+from observability.tracing import span
+from repository.cypher import query_name
+
+load_dotenv()
+
+# The async driver keeps a pool of connections, the size of the pool bounds how many queries run at the same time.
+# The driver belongs to the event loop in which it was created, so use one event loop per process.
+_driver: Optional[AsyncDriver] = None
+_embeddings: Optional[Embeddings] = None
+
+
+def get_async_driver() -> AsyncDriver:
+    """Get the async driver to the graph database, created on the first call."""
+    global _driver
+    if _driver is None:
+        _driver = AsyncGraphDatabase.driver(
+            os.environ["NEO4J_URI"],
+            auth=(os.environ["NEO4J_USERNAME"], os.environ["NEO4J_PASSWORD"]),
+            max_connection_pool_size=int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "50")),
+            # how long to wait for a free connection when all of them are used
+            connection_acquisition_timeout=float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", "30")),
+        )
+    return _driver
+
+
+def set_async_driver(driver: AsyncDriver):
+    """Replace the async driver, for example with a local stand-in for load tests."""
+    global _driver
+    _driver = driver
+
+
+async def close_async_driver():
+    """Close all connections in the pool."""
+    global _driver
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
+
+
+def get_async_embeddings() -> Embeddings:
+    """Get the embeddings object, the same cached object that the sync functions use."""
+    global _embeddings
+    if _embeddings is None:
+        from repository.graph_db import get_embeddings
+
+        _embeddings = get_embeddings()
+    return _embeddings
+
+
+def set_async_embeddings(embeddings: Embeddings):
+    """Replace the embeddings object, for example with a local stand-in for load tests."""
+    global _embeddings
+    _embeddings = embeddings
+
+
+async def query(cypher: str, params: Optional[Dict] = None) -> List[Dict]:
+    """Execute a read query and return the records as list of dicts, like Neo4jGraph.query does."""
+    with span("cypher", query_name(cypher)) as current:
+        records, _, _ = await get_async_driver().execute_query(
+            cypher,
+            parameters_=params or {},
+            database_=os.getenv("NEO4J_DATABASE", "neo4j"),
+            routing_=RoutingControl.READ,
+        )
+        current.set(rows=len(records))
+    return [record.data() for record in records]
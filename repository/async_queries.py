@@ -0,0 +1,362 @@
+"""Async versions of the functions in queries.py, used by the tools when the agent runs asynchronously."""
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import asyncio
+import time
+from functools import partial
+
+from repository.async_graph_db import get_async_embeddings, query
+from repository.entity_resolver import EntityResolver, organization_resolver, country_resolver
+from repository.data_version import apoll_graph_version
+from repository.embedding_cache import aquery_vector
+from repository.result_cache import acached_query
+from repository.local_vector_engine import get_local_vector_engine
+from observability.tracing import traced
+from repository.pagination import NEWS_KEY, ORGANIZATIONS_BY_EMPLOYEES_KEY, apaginate, apaginate_by_score
+from repository.cypher import (
+    CANDIDATES_QUERY,
+    VECTOR_SEARCH_QUERY,
+    VECTOR_RANGE_SEARCH_QUERY,
+    BATCH_VECTOR_RANGE_SEARCH_QUERY,
+    BRUTE_FORCE_RANGE_SEARCH_QUERY,
+    NEWS_BY_ORGANIZATION_QUERY,
+    ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY,
+    NUMBER_EMPLOYEES_QUERY,
+    NEWS_BY_COUNTRY_QUERY,
+    NEWS_BY_COUNTRY_TRAVERSAL_QUERY,
+    RESULT_CACHE_TTLS,
+    generate_full_text_query,
+    select_candidates,
+    organization_result,
+    next_range_search_candidates,
+    batch_range_search_round,
+    hybrid_search_queries,
+    reciprocal_rank_fusion,
+)
+
+
+# references to the running refresh tasks, so they are not garbage collected before they finish
+_refresh_tasks: Set[asyncio.Task] = set()
+
+
+def _refresh_in_background(resolver: EntityResolver):
+    # refresh the names in memory in a task, so this question does not wait for it
+    if resolver.needs_check():
+        task = asyncio.ensure_future(resolver.arefresh(query))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _acached_query(cypher: str, params: Dict) -> List[Dict]:
+    """Execute the query or get the result from the result cache."""
+    await apoll_graph_version(query)
+    return await acached_query(query, cypher, params, RESULT_CACHE_TTLS.get(cypher))
+
+
+@traced()
+async def aget_candidates(input: str, candidate_query: str, limit: int = 5) -> List[str]:
+    """Async version of get_candidates."""
+    ft_query = generate_full_text_query(input)
+    candidates = await _acached_query(
+        candidate_query, {"fulltextQuery": ft_query, "index": 'entity', "limit": limit}
+    )
+    return select_candidates(input, candidates)
+
+
+@traced()
+async def asearch_news_by_topic(topic: str, k: int = 2) -> List[str]:
+    """Async version of search_news_by_topic."""
+    engine = get_local_vector_engine()
+    if engine is not None:
+        return [r["chunk_text"] for r in engine.search(await aquery_vector(get_async_embeddings(), topic), k)]
+    topic_embedding = await get_async_embeddings().aembed_query(topic)
+    results = await query(VECTOR_SEARCH_QUERY, {"index": "news", "k": k, "embedding": topic_embedding})
+    return [r["chunk_text"] for r in results]
+
+
+@traced()
+async def avector_range_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    index_name: str = "news",
+    overfetch: int = 4,
+    max_candidates: int = 1000,
+) -> List[Dict]:
+    """Async version of vector_range_search."""
+    candidates = min(k * overfetch, max_candidates)
+    while candidates is not None:
+        results = await query(
+            VECTOR_RANGE_SEARCH_QUERY,
+            {
+                "index": index_name,
+                "candidates": candidates,
+                "embedding": topic_embedding,
+                "low_bound_cosine": low_bound_cosine,
+                "upper_bound_cosine": upper_bound_cosine,
+            },
+        )
+        candidates = next_range_search_candidates(
+            results, k, candidates, low_bound_cosine, overfetch, max_candidates
+        )
+    return [r for r in results if r["chunk_text"] is not None][:k]
+
+
+@traced()
+async def abrute_force_range_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+) -> List[Dict]:
+    """Async version of brute_force_range_search."""
+    return await query(
+        BRUTE_FORCE_RANGE_SEARCH_QUERY,
+        {
+            "low_bound_cosine": low_bound_cosine,
+            "upper_bound_cosine": upper_bound_cosine,
+            "embedding": topic_embedding,
+            "k": k,
+        },
+    )
+
+
+async def _arange_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    use_vector_index: bool = True,
+) -> List[Dict]:
+    engine = get_local_vector_engine()
+    if engine is not None:
+        return engine.search(topic_embedding, k, low_bound_cosine, upper_bound_cosine)
+    if use_vector_index:
+        return await avector_range_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k)
+    return await abrute_force_range_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k)
+
+
+@traced()
+async def afilter_news_by_topic_with_score(
+    topic: str,
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    use_vector_index: bool = True,
+    lazy: bool = False,
+    topic_embedding: Optional[List[float]] = None,
+):
+    """Async version of filter_news_by_topic_with_score."""
+    if topic_embedding is None:
+        topic_embedding = await get_async_embeddings().aembed_query(topic)
+    if lazy:
+        return aiter_news_by_topic(topic_embedding, low_bound_cosine, upper_bound_cosine, k, use_vector_index)
+    results = await _arange_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k, use_vector_index)
+    return [r['chunk_text'] for r in results]
+
+
+def aiter_news_by_topic(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    page_size: int = 2,
+    use_vector_index: bool = True,
+) -> AsyncIterator[Dict]:
+    """Async version of iter_news_by_topic."""
+    return apaginate_by_score(
+        lambda upper, k: _arange_search(topic_embedding, low_bound_cosine, upper, k, use_vector_index),
+        upper_bound_cosine,
+        page_size,
+    )
+
+
+@traced()
+async def abatch_vector_range_search(
+    topic_embeddings: Dict[str, List[float]],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    index_name: str = "news",
+    overfetch: int = 4,
+    max_candidates: int = 1000,
+) -> Dict[str, List[Dict]]:
+    """Async version of batch_vector_range_search."""
+    candidates = {topic: min(k * overfetch, max_candidates) for topic in topic_embeddings}
+    found = {}
+    while candidates:
+        rows = await query(
+            BATCH_VECTOR_RANGE_SEARCH_QUERY,
+            {
+                "index": index_name,
+                "topics": [
+                    {"topic": topic, "embedding": topic_embeddings[topic], "candidates": number}
+                    for topic, number in candidates.items()
+                ],
+                "low_bound_cosine": low_bound_cosine,
+                "upper_bound_cosine": upper_bound_cosine,
+            },
+        )
+        candidates = batch_range_search_round(
+            rows, candidates, found, k, low_bound_cosine, overfetch, max_candidates
+        )
+    return {topic: found.get(topic, []) for topic in topic_embeddings}
+
+
+@traced()
+async def afilter_news_by_topics_with_score(
+    topics: List[str],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+) -> Dict[str, List[str]]:
+    """Async version of filter_news_by_topics_with_score."""
+    topics = list(dict.fromkeys(t for t in topics if t))
+    if not topics:
+        return {}
+    topic_embeddings = dict(zip(topics, await get_async_embeddings().aembed_documents(topics)))
+    engine = get_local_vector_engine()
+    if engine is not None:
+        results = {
+            topic: engine.search(embedding, k, low_bound_cosine, upper_bound_cosine)
+            for topic, embedding in topic_embeddings.items()
+        }
+    else:
+        results = await abatch_vector_range_search(topic_embeddings, low_bound_cosine, upper_bound_cosine, k)
+    return {topic: [r["chunk_text"] for r in rows] for topic, rows in results.items()}
+
+
+@traced()
+async def ahybrid_search(
+    topic: str,
+    organization: Optional[str] = None,
+    k: int = 3,
+    candidates: int = 20,
+    rrf_k: int = 60,
+    topic_embedding: Optional[List[float]] = None,
+) -> Dict:
+    """Async version of hybrid_search, the vector and the full-text search run at the same time."""
+    start = time.perf_counter()
+    if topic_embedding is None:
+        topic_embedding = await get_async_embeddings().aembed_query(topic or organization)
+    timings = {"embedding_ms": (time.perf_counter() - start) * 1000}
+
+    async def timed(name: str, cypher: str, params: Dict) -> List[Dict]:
+        stage = time.perf_counter()
+        rows = await query(cypher, params)
+        timings[f"{name}_ms"] = (time.perf_counter() - stage) * 1000
+        return rows
+
+    queries = hybrid_search_queries(topic_embedding, organization, candidates)
+    rows = await asyncio.gather(*(timed(name, cypher, params) for name, (cypher, params) in queries.items()))
+    stage = time.perf_counter()
+    results = reciprocal_rank_fusion(dict(zip(queries, rows)), k, rrf_k)
+    finished = time.perf_counter()
+    timings["fusion_ms"] = (finished - stage) * 1000
+    timings["total_ms"] = (finished - start) * 1000
+    return {"results": results, "timings": timings}
+
+
+@traced()
+async def afind_organization(organization: str) -> Tuple[bool, list | str]:
+    """Async version of find_organization."""
+    _refresh_in_background(organization_resolver)
+    candidates = organization_resolver.candidates(organization)
+    if not candidates:
+        candidates = await aget_candidates(organization, CANDIDATES_QUERY)
+    return organization_result(candidates)
+
+
+def aiter_news_by_organization(organization: str, page_size: int = 5) -> AsyncIterator[Dict]:
+    """Async version of iter_news_by_organization."""
+    return apaginate(partial(_acached_query, NEWS_BY_ORGANIZATION_QUERY), {"organization": organization}, NEWS_KEY, page_size)
+
+
+@traced()
+async def asearch_by_organization(organization: str, k: int = 2, lazy: bool = False):
+    """Async version of search_by_organization."""
+    found, candidates = await afind_organization(organization)
+    if not found:
+        return candidates
+    rows = aiter_news_by_organization(candidates[0], page_size=k)
+    if lazy:
+        return rows
+    return [{"chunk_text": r["chunk_text"]} async for r in _atake(rows, k)]
+
+
+def aiter_organizations_by_number_employees(number_employees: int, page_size: int = 5) -> AsyncIterator[Dict]:
+    """Async version of iter_organizations_by_number_employees."""
+    return apaginate(
+        partial(_acached_query, ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY),
+        {"number_employees": number_employees},
+        ORGANIZATIONS_BY_EMPLOYEES_KEY,
+        page_size,
+    )
+
+
+@traced()
+async def afilter_by_number_employees(number_employees: str, k: int = 5, lazy: bool = False):
+    """Async version of filter_by_number_employees."""
+    rows = aiter_organizations_by_number_employees(number_employees, page_size=k)
+    if lazy:
+        return rows
+    return [r async for r in _atake(rows, k)]
+
+
+@traced()
+async def aget_number_employees(organization: str):
+    """Async version of get_number_employees."""
+    found, candidates = await afind_organization(organization)
+    if not found:
+        return candidates
+    return await _acached_query(NUMBER_EMPLOYEES_QUERY, {"org_name": candidates[0]})
+
+
+@traced()
+async def afind_country(country_name: str) -> Tuple[bool, list | str]:
+    """Async version of find_country."""
+    _refresh_in_background(country_resolver)
+    if not country_resolver.loaded:
+        return True, [country_name]
+    return organization_result(country_resolver.candidates(country_name), "country")
+
+
+async def aiter_news_by_country(country_name: str, page_size: int = 5) -> AsyncIterator[Dict]:
+    """Async version of iter_news_by_country."""
+    params = {"country_name": country_name}
+    found = False
+    async for row in apaginate(partial(_acached_query, NEWS_BY_COUNTRY_QUERY), params, NEWS_KEY, page_size):
+        found = True
+        yield row
+    if not found:
+        async for row in apaginate(
+            partial(_acached_query, NEWS_BY_COUNTRY_TRAVERSAL_QUERY), params, NEWS_KEY, page_size
+        ):
+            yield row
+
+
+@traced()
+async def afilter_by_country(country_name: str, page_size: int = 5, lazy: bool = False):
+    """Async version of filter_by_country."""
+    found, countries = await afind_country(country_name)
+    if not found:
+        return countries
+    rows = aiter_news_by_country(countries[0], page_size)
+    if lazy:
+        return rows
+    results = [{key: value for key, value in r.items() if key != "id"} async for r in _atake(rows, page_size)]
+    return f"Here are article summaries for organizations in {countries[0]}" + str(results)
+
+
+async def _atake(rows: AsyncIterator[Dict], k: int) -> AsyncIterator[Dict]:
+    # the first K rows, like itertools.islice; the iterator is closed so its page is not kept
+    count = 0
+    try:
+        async for row in rows:
+            yield row
+            count += 1
+            # stop before the next row, it could be the first one of the next page
+            if count >= k:
+                break
+    finally:
+        await rows.aclose()
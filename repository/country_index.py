@@ -0,0 +1,72 @@
+"""Precomputed links from articles to the countries of the organizations they mention.
+
+filter_by_country would otherwise walk Article-[:MENTIONS]->Organization-[:IN_CITY]->City-[:IN_COUNTRY]->Country
+on every question. This job creates (Article)-[:MENTIONS_COUNTRY {organizations}]->(Country) once for every
+article, and later only for the new articles.
+
+    python -m repository.country_index            # only the articles without links
+    python -m repository.country_index --rebuild  # all articles again
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from repository.data_version import BUMP_GRAPH_VERSION_QUERY, bump_data_version
+
+# Every processed article gets the time of the job in countryLinksVersion, so the next incremental job
+# processes only the articles without it, and a rebuild processes the articles with an older time.
+MATERIALIZE_COUNTRY_LINKS_QUERY = """MATCH (a:Article)
+WHERE a.countryLinksVersion IS NULL OR a.countryLinksVersion < $rebuild_before
+WITH a LIMIT $batch_size
+CALL {
+    WITH a
+    OPTIONAL MATCH (a)-[old:MENTIONS_COUNTRY]->()
+    DELETE old
+}
+CALL {
+    WITH a
+    MATCH (a)-[:MENTIONS]->(o:Organization)-[:IN_CITY]->(:City)-[:IN_COUNTRY]->(country:Country)
+    WITH a, country, collect(DISTINCT o.name) AS organizations
+    MERGE (a)-[r:MENTIONS_COUNTRY]->(country)
+    SET r.organizations = organizations
+}
+SET a.countryLinksVersion = $version
+RETURN count(a) AS processed
+"""
+
+
+def materialize_country_links(
+    run_query: Callable[..., List[Dict]], batch_size: int = 500, rebuild: bool = False
+) -> int:
+    """Create the MENTIONS_COUNTRY links for the articles that do not have them yet (or for all articles
+    with rebuild), one batch per transaction. Returns the number of processed articles."""
+    version = int(time.time() * 1000)
+    params = {"version": version, "rebuild_before": version if rebuild else 0, "batch_size": batch_size}
+    total = 0
+    while True:
+        processed = run_query(MATERIALIZE_COUNTRY_LINKS_QUERY, params=params)[0]["processed"]
+        total += processed
+        if processed < batch_size:
+            break
+    if total:
+        # the cached results of filter_by_country are old now, in this and in the other processes
+        bump_data_version()
+        run_query(BUMP_GRAPH_VERSION_QUERY)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="create the links again for all articles")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from repository.graph_db import get_graph
+
+    start = time.perf_counter()
+    processed = materialize_country_links(get_graph().query, args.batch_size, args.rebuild)
+    print(f"Country links created for {processed} articles in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Cypher queries and helpers shared by the sync (queries.py) and async (async_queries.py) repository functions."""
+from typing import Dict, List, Optional, Tuple
+
+from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
+
+
+# Full-text search for organizations on the entity index, used to map the organization from the user question
+# to the name in the database.
+CANDIDATES_QUERY = """
+CALL db.index.fulltext.queryNodes($index, $fulltextQuery, {limit: $limit})
+YIELD node
+WHERE node:Organization // Filter organization nodes
+RETURN distinct node.name AS candidate
+"""
+
+# The K most similar chunks from the vector index (the same query that the Neo4jVector object runs).
+VECTOR_SEARCH_QUERY = """CALL db.index.vector.queryNodes($index, $k, $embedding)
+YIELD node, score
+RETURN node.text as chunk_text, score
+ORDER BY score DESC
+"""
+
+# The index returns the scores in the same range (0, 1) as vector.similarity.cosine, so the bounds are the same.
+# The text is returned only for chunks inside the bounds, for the rest we need only the score.
+VECTOR_RANGE_SEARCH_QUERY = """CALL db.index.vector.queryNodes($index, $candidates, $embedding)
+YIELD node, score
+WITH node, score, score <= $upper_bound_cosine AND score >= $low_bound_cosine AS in_bounds
+RETURN CASE WHEN in_bounds AND EXISTS {(node)<-[:HAS_CHUNK]-(:Article)} THEN node.text END as chunk_text, score
+ORDER BY score DESC
+"""
+
+# The range search for several topics in one round trip. Every topic has its own embedding and number of candidates.
+BATCH_VECTOR_RANGE_SEARCH_QUERY = """UNWIND $topics AS topic
+CALL {
+    WITH topic
+    CALL db.index.vector.queryNodes($index, topic.candidates, topic.embedding)
+    YIELD node, score
+    WITH node, score, score <= $upper_bound_cosine AND score >= $low_bound_cosine AS in_bounds
+    RETURN collect({
+        chunk_text: CASE WHEN in_bounds AND EXISTS {(node)<-[:HAS_CHUNK]-(:Article)} THEN node.text END,
+        score: score
+    }) AS results
+}
+RETURN topic.topic AS topic, results
+"""
+
+BRUTE_FORCE_RANGE_SEARCH_QUERY = """MATCH (c:Chunk)<-[:HAS_CHUNK]-(a:Article) 
+WITH c.text as chunk_text, vector.similarity.cosine(c.embedding,$embedding) AS score 
+WHERE score <= $upper_bound_cosine AND score >= $low_bound_cosine
+RETURN chunk_text, score
+ORDER BY score DESC
+LIMIT $k
+"""
+
+# Hybrid search: the chunks from the vector index and the chunks of the articles that mention the organizations
+# from the full-text index are ranked by two queries, so the time of every stage is known, and merged in python
+# with reciprocal rank fusion (reciprocal_rank_fusion), which keeps only the best chunk of every article.
+HYBRID_VECTOR_QUERY = """CALL db.index.vector.queryNodes($vector_index, $candidates, $embedding)
+YIELD node, score
+MATCH (a:Article)-[:HAS_CHUNK]->(node)
+RETURN elementId(node) AS chunk_id, node.text AS chunk_text, elementId(a) AS article_id, a.title AS title, score
+ORDER BY score DESC
+"""
+HYBRID_FULLTEXT_QUERY = """CALL db.index.fulltext.queryNodes($fulltext_index, $fulltextQuery, {limit: $limit})
+YIELD node, score
+WHERE node:Organization
+MATCH (node)<-[:MENTIONS]-(a:Article)-[:HAS_CHUNK]->(c:Chunk)
+WITH a, c, max(score) AS score
+RETURN elementId(c) AS chunk_id, c.text AS chunk_text, elementId(a) AS article_id, a.title AS title, score
+ORDER BY score DESC
+LIMIT $candidates
+"""
+
+# The paged queries below use keyset pagination: $after is the sort key of the last row of the previous
+# page (null for the first page). Unlike SKIP, a page does not read and throw away all rows of the previous
+# pages, and the pages stay stable when new articles are added in the meantime.
+NEWS_BY_ORGANIZATION_QUERY = """MATCH (c:Chunk)<-[:HAS_CHUNK]-(a:Article)
+WHERE EXISTS {(a)-[:MENTIONS]->(:Organization {name: $organization})}
+WITH c, coalesce(toString(a.date), '') AS date, elementId(c) AS id
+WHERE $after IS NULL OR date < $after.date OR (date = $after.date AND id > $after.id)
+RETURN c.text AS chunk_text, date, id
+ORDER BY date DESC, id
+LIMIT $k
+"""
+
+ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY = """MATCH (o:Organization)
+WHERE o.nbrEmployees >= $number_employees
+  AND ($after IS NULL OR o.nbrEmployees < $after.number_employees
+       OR (o.nbrEmployees = $after.number_employees AND o.name > $after.organization_name))
+RETURN o.name as organization_name, o.nbrEmployees as number_employees
+ORDER BY o.nbrEmployees DESC, o.name
+LIMIT $k
+"""
+
+NUMBER_EMPLOYEES_QUERY = """MATCH (o:Organization{name:$org_name})
+RETURN o.nbrEmployees as number_employees
+"""
+
+# The articles for a country from the precomputed MENTIONS_COUNTRY links (see country_index.py),
+# the newest first, one page at a time.
+NEWS_BY_COUNTRY_QUERY = """MATCH (:Country {name: $country_name})<-[r:MENTIONS_COUNTRY]-(a:Article)
+WITH a, r, coalesce(toString(a.date), '') AS date, elementId(a) AS id
+WHERE $after IS NULL OR date < $after.date OR (date = $after.date AND id > $after.id)
+RETURN a.summary AS article_summary, r.organizations AS organization_names, date, id
+ORDER BY date DESC, id
+LIMIT $k
+"""
+
+# The same articles by walking the graph, used when the links are not created yet.
+NEWS_BY_COUNTRY_TRAVERSAL_QUERY = """MATCH (a:Article)-[:MENTIONS]->(o:Organization)-[:IN_CITY]->(city:City)-[:IN_COUNTRY]->(country:Country{name:$country_name})
+WITH a, collect(DISTINCT o.name) AS organization_names
+WITH a, organization_names, coalesce(toString(a.date), '') AS date, elementId(a) AS id
+WHERE $after IS NULL OR date < $after.date OR (date = $after.date AND id > $after.id)
+RETURN a.summary AS article_summary, organization_names, date, id
+ORDER BY date DESC, id
+LIMIT $k
+"""
+
+# How long (seconds) the results of the read queries stay in the result cache.
+RESULT_CACHE_TTLS = {
+    CANDIDATES_QUERY: 3600,
+    NEWS_BY_ORGANIZATION_QUERY: 600,
+    ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY: 3600,
+    NUMBER_EMPLOYEES_QUERY: 3600,
+    NEWS_BY_COUNTRY_QUERY: 600,
+    NEWS_BY_COUNTRY_TRAVERSAL_QUERY: 600,
+}
+
+
+def query_name(query: str) -> str:
+    """Name of the query constant, for the logs and the metrics; "cypher" for other queries."""
+    return _QUERY_NAMES.get(query, "cypher")
+
+
+def generate_full_text_query(input: str) -> str:
+    """
+    Generate a full-text search query for a given input string.
+
+    This function constructs a query string suitable for a full-text search.
+    It processes the input string by splitting it into words and appending a
+    similarity threshold (~0.8) to each word, then combines them using the AND
+    operator. Useful for mapping organization from user questions
+    to database values, and allows for some misspelings.
+    """
+    full_text_query = ""
+    # remove lucene special characters from the input, then split the input into words and save it as list of words
+    words = [el for el in remove_lucene_chars(input).split() if el]
+    # iterate all of the words ([:-1] means except for the last word ) in order to create the query
+    # with sign ~ and the AND operator to search in the database with proxinimity search.
+    # If the input is "Amsterdam Inc. Coorporation" then it will produce: Amsterdam~2 AND Inc~ AND Coorporation~2
+    for word in words[:-1]:
+        full_text_query += f" {word}~2 AND"  # ~2 proximity search; indicates that the words should be within two chars of each other.
+
+    full_text_query += f" {words[-1]}~2"
+    # remove the empty spaces in the beggining and end of the query
+    return full_text_query.strip()
+
+
+def hybrid_search_queries(
+    topic_embedding: List[float], organization: Optional[str], candidates: int
+) -> Dict[str, Tuple[str, Dict]]:
+    """The query and the parameters of every ranking of the hybrid search, by the name of the ranking.
+    Without organization there is nothing to search in the full-text index."""
+    queries = {
+        "vector": (
+            HYBRID_VECTOR_QUERY,
+            {"vector_index": "news", "embedding": topic_embedding, "candidates": candidates},
+        )
+    }
+    if organization and remove_lucene_chars(organization).split():
+        queries["fulltext"] = (
+            HYBRID_FULLTEXT_QUERY,
+            {
+                "fulltext_index": "entity",
+                "fulltextQuery": generate_full_text_query(organization),
+                "limit": 5,
+                "candidates": candidates,
+            },
+        )
+    return queries
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Dict]], k: int, rrf_k: int) -> List[Dict]:
+    """Merge the rankings of the chunks (rows with chunk_id, chunk_text, article_id and title, the best first)
+    with reciprocal rank fusion: the score of a chunk is the sum of 1 / (rrf_k + rank) over the rankings.
+    Returns the best chunk of the K best articles, with title, chunk_text, score and sources."""
+    fused: Dict[str, Dict] = {}
+    for source, rows in rankings.items():
+        for rank, row in enumerate(rows, 1):
+            chunk = fused.setdefault(row["chunk_id"], {"row": row, "score": 0.0, "sources": []})
+            chunk["score"] += 1.0 / (rrf_k + rank)
+            chunk["sources"].append(source)
+    best: Dict[str, Dict] = {}
+    for chunk in sorted(fused.values(), key=lambda c: c["score"], reverse=True):
+        best.setdefault(chunk["row"]["article_id"], chunk)
+    return [
+        {"title": c["row"]["title"], "chunk_text": c["row"]["chunk_text"], "score": c["score"], "sources": c["sources"]}
+        for c in list(best.values())[:k]
+    ]
+
+
+def select_candidates(input: str, candidates: List[Dict[str, str]]) -> List[str]:
+    """If there is direct match in the results from database return only that, otherwise return all options."""
+    direct_match = [
+        el["candidate"] for el in candidates if el["candidate"].lower() == input.lower()
+    ]
+    if direct_match:
+        return direct_match
+
+    return [el["candidate"] for el in candidates]
+
+
+def organization_result(candidates: List[str], entity: str = "organization") -> Tuple[bool, list | str]:
+    """Create the result of find_organization from the candidates for the organization
+    (or for another entity, like country)."""
+    # if there are no candidates , return that to the chatbot so it will know.
+    if len(candidates) == 0:
+        return (
+            False,  # The organization does not exist
+            f"There are not any available {entity_plural(entity)} with this name. "
+            f"Ask the user to reconsider the {entity}.",
+        )
+    # if there is more than 1 candidate, ask the user which organization it meant.
+    if len(candidates) > 1:  # Ask for follow up if too many options
+        return (
+            False,
+            f"Ask a follow up question which of the available {entity_plural(entity)} "
+            f"did the user mean. Available options: {candidates}",
+        )
+
+    # if there is exact one candidate, return it
+    return True, candidates
+
+
+def entity_plural(entity: str) -> str:
+    return entity[:-1] + "ies" if entity.endswith("y") else entity + "s"
+
+
+def batch_range_search_round(
+    rows: List[Dict],
+    candidates: Dict[str, int],
+    found: Dict[str, List[Dict]],
+    k: int,
+    low_bound_cosine: float,
+    overfetch: int,
+    max_candidates: int,
+) -> Dict[str, int]:
+    """Save the results of one round of the batch range search in found, and return
+    the number of candidates for the topics that need another round."""
+    next_candidates = {}
+    for row in rows:
+        results = sorted(row["results"], key=lambda r: r["score"], reverse=True)
+        found[row["topic"]] = [r for r in results if r["chunk_text"] is not None][:k]
+        more = next_range_search_candidates(
+            results, k, candidates[row["topic"]], low_bound_cosine, overfetch, max_candidates
+        )
+        if more is not None:
+            next_candidates[row["topic"]] = more
+    return next_candidates
+
+
+def next_range_search_candidates(
+    results: List[Dict],
+    k: int,
+    candidates: int,
+    low_bound_cosine: float,
+    overfetch: int,
+    max_candidates: int,
+) -> Optional[int]:
+    """Number of candidates to ask the vector index for in the next round of the range search,
+    or None if the search is done."""
+    in_bounds = [r for r in results if r["chunk_text"] is not None]
+    # Stop if we have K results, if the index has no more chunks, if the lowest score is already under
+    # the lower bound (the next candidates can only have lower scores) or if we reached the maximum.
+    if (
+        len(in_bounds) >= k
+        or len(results) < candidates
+        or (results and results[-1]["score"] < low_bound_cosine)
+        or candidates >= max_candidates
+    ):
+        return None
+    # widen the search
+    return min(candidates * overfetch, max_candidates)
+
+
+# the query constants of this module by their text
+_QUERY_NAMES = {value: name for name, value in list(globals().items()) if name.endswith("_QUERY")}
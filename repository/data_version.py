@@ -0,0 +1,78 @@
+"""Version of the data in the graph database. Every ingestion increases it, and the caches drop
+the results that were calculated for an older version."""
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# The ingestion increases the version on the DataVersion node, so the other processes see the change too.
+GRAPH_VERSION_QUERY = "MATCH (v:DataVersion {name: 'news'}) RETURN v.version AS version"
+BUMP_GRAPH_VERSION_QUERY = """MERGE (v:DataVersion {name: 'news'})
+SET v.version = coalesce(v.version, 0) + 1
+RETURN v.version AS version
+"""
+
+_lock = threading.Lock()
+_version = 0
+# the graph was not read yet; None is a graph without the DataVersion node (nothing was ingested yet)
+_UNSET = object()
+# the last version read from the graph, and when it was read
+_graph_version: Any = _UNSET
+_last_poll = 0.0
+# how often (seconds) to read the version from the graph
+POLL_INTERVAL = 30.0
+
+
+def get_data_version() -> int:
+    """The current version of the data, known in this process."""
+    return _version
+
+
+def bump_data_version() -> int:
+    """Increase the version in this process, which invalidates the cached results."""
+    global _version
+    with _lock:
+        _version += 1
+        return _version
+
+
+def _should_poll() -> bool:
+    global _last_poll
+    with _lock:
+        if time.monotonic() - _last_poll < POLL_INTERVAL:
+            return False
+        _last_poll = time.monotonic()
+        return True
+
+
+def _apply_graph_version(results: List[Dict]):
+    global _graph_version
+    version = results[0]["version"] if results else None
+    # the first read only remembers the version, the next changes (also the first ingestion, from no
+    # version to 1) invalidate the caches
+    if _graph_version is not _UNSET and version != _graph_version:
+        bump_data_version()
+    _graph_version = version
+
+
+def poll_graph_version(run_query: Callable[[str], List[Dict]]):
+    """Read the version from the graph (at most every POLL_INTERVAL seconds) and
+    increase the version in this process if it changed."""
+    if not _should_poll():
+        return
+    try:
+        _apply_graph_version(run_query(GRAPH_VERSION_QUERY))
+    except Exception as e:
+        logger.warning("Error in reading the data version from the graph database. %s", e)
+
+
+async def apoll_graph_version(run_query: Callable[[str], Awaitable[List[Dict]]]):
+    """Async version of poll_graph_version."""
+    if not _should_poll():
+        return
+    try:
+        _apply_graph_version(await run_query(GRAPH_VERSION_QUERY))
+    except Exception as e:
+        logger.warning("Error in reading the data version from the graph database. %s", e)
@@ -0,0 +1,216 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import ContextManager, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from observability.tracing import Span, estimate_cost, span
+
+
+def normalize_text(text: str) -> str:
+    """Normalize the text before using it as a cache key, so the same question
+    written with different spacing gets the same embedding."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper which caches the vectors in memory (LRU) and on disk (SQLite).
+
+    The key is the normalized text plus the model name, so changing the model never returns old vectors.
+    The cache keeps the vectors as read-only float32 numpy arrays (half the memory of the lists of python
+    floats). The *_array methods return these arrays without a copy, for the callers in this process (the
+    answer cache and the local vector engine); the Embeddings methods return new lists, like the embeddings
+    API, and copy the vector on every call.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: Optional[str] = None,
+        max_memory_items: int = 10000,
+    ):
+        self.embeddings = embeddings
+        # OpenAIEmbeddings has the model name in the model attribute
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        # the disk tier is optional, without path the cache lives only in memory
+        self._db = None
+        path = path if path is not None else os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # the connection is shared between the threads, the lock protects it
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        # called with the lock acquired
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Find the vectors for the keys in memory first and then on disk."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.hits_memory += 1
+            missing = [key for key in keys if key not in found]
+            if missing and self._db is not None:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing
+                ).fetchall()
+                for key, blob in rows:
+                    # frombuffer does not copy the bytes, and the array is read-only
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.hits_disk += 1
+            self.misses += len([key for key in keys if key not in found])
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> Dict[str, np.ndarray]:
+        stored = {}
+        with self._lock:
+            for key, values in items.items():
+                vector = np.asarray(values, dtype=np.float32)
+                vector.setflags(write=False)
+                stored[key] = vector
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    [(key, self.model, vector.tobytes()) for key, vector in stored.items()],
+                )
+                self._db.commit()
+        return stored
+
+    def _api_span(self, texts: List[str]) -> "ContextManager[Span]":
+        # the span of a call to the embeddings API, the tokens are estimated (about 4 characters per token)
+        tokens = sum(len(t) for t in texts) // 4 + len(texts)
+        attributes = {"texts": len(texts), "prompt_tokens": tokens}
+        cost = estimate_cost(self.model, tokens)
+        if cost is not None:
+            attributes["cost_usd"] = cost
+        return span("embedding", self.model, **attributes)
+
+    def _missing(self, keys: List[str], texts: List[str], found: Dict[str, np.ndarray]) -> Dict[str, str]:
+        # the same text can be more than once in the list, embed it only once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        return missing
+
+    def embed_documents_arrays(self, texts: List[str]) -> List[np.ndarray]:
+        """The vectors of the texts as the read-only arrays of the cache, without a copy. The API is called
+        only for the texts that are not in the cache."""
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            with self._api_span(list(missing.values())):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            found.update(self._store(dict(zip(missing.keys(), vectors))))
+        return [found[key] for key in keys]
+
+    def embed_query_array(self, text: str) -> np.ndarray:
+        """The vector of the query text as the read-only array of the cache, without a copy."""
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._api_span([text]):
+            vector = self.embeddings.embed_query(text)
+        return self._store({key: vector})[key]
+
+    async def aembed_documents_arrays(self, texts: List[str]) -> List[np.ndarray]:
+        """Async version of embed_documents_arrays, only the API call is awaited."""
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            with self._api_span(list(missing.values())):
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            found.update(self._store(dict(zip(missing.keys(), vectors))))
+        return [found[key] for key in keys]
+
+    async def aembed_query_array(self, text: str) -> np.ndarray:
+        """Async version of embed_query_array, only the API call is awaited."""
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+        with self._api_span([text]):
+            vector = await self.embeddings.aembed_query(text)
+        return self._store({key: vector})[key]
+
+    # the Embeddings methods return new lists of python floats, like the embeddings API (the Neo4j driver
+    # does not take numpy arrays)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self.embed_documents_arrays(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_query_array(text).tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in await self.aembed_documents_arrays(texts)]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_query_array(text)).tolist()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counters, to see if the cache is useful."""
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def clear(self):
+        """Remove all vectors from the memory and disk cache."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+
+def query_vector(embeddings: Embeddings, text: str) -> np.ndarray:
+    """The embedding of the text as a float32 array, without a copy from CachedEmbeddings."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_query_array(text)
+    return np.asarray(embeddings.embed_query(text), dtype=np.float32)
+
+
+async def aquery_vector(embeddings: Embeddings, text: str) -> np.ndarray:
+    """Async version of query_vector."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return await embeddings.aembed_query_array(text)
+    return np.asarray(await embeddings.aembed_query(text), dtype=np.float32)
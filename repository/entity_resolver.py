@@ -0,0 +1,260 @@
+"""In-process index of entity names (for example Organization.name) for resolving the names from the user
+questions without a full-text query to the database.
+
+It matches the same names as the full-text query from generate_full_text_query: every word of the input
+has to be within edit distance 2 of a word of the name (word~2 AND word~2 ...), except that a transposition
+counts as two edits here (see _edit_distance).
+"""
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split the text in lowercase words, like the standard analyzer of the full-text index."""
+    return _WORD.findall(text.lower())
+
+
+def _edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance between a and b. Unlike the Lucene fuzzy query a transposition is two edits:
+    the BK-tree needs a distance with the triangle inequality, which the distance with transpositions of
+    neighbouring characters only (OSA) does not have. A name that matches only with the transpositions is
+    found by the full-text query.
+    Returns max_distance + 1 as soon as the distance is known to be bigger than max_distance."""
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    if len_a == 0 or len_b == 0:
+        return max(len_a, len_b)
+    previous = list(range(len_b + 1))
+    for i in range(1, len_a + 1):
+        char_a = a[i - 1]
+        current = [i] * (len_b + 1)
+        row_min = i
+        for j in range(1, len_b + 1):
+            char_b = b[j - 1]
+            # substitution, deletion and insertion
+            value = previous[j - 1] if char_a == char_b else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        # every value in the row is bigger than the maximum, so the distance is bigger too
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[len_b]
+
+
+# rapidfuzz (optional) calculates the same distance in C, which makes loading the index much faster
+try:
+    from rapidfuzz.distance import Levenshtein
+
+    def edit_distance(a: str, b: str, max_distance: int) -> int:
+        return Levenshtein.distance(a, b, score_cutoff=max_distance)
+
+except ImportError:
+    edit_distance = _edit_distance
+
+
+class BKTree:
+    """BK-tree of words, to find all words within some edit distance without comparing with every word."""
+
+    def __init__(self):
+        # every node is (word, {distance: child node})
+        self._root: Optional[Tuple[str, Dict]] = None
+
+    def add(self, word: str):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0], max(len(word), len(node[0])))
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[str, int]]:
+        """All words within max_distance of the word, with their distance."""
+        found = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word, max(len(word), len(node_word)))
+            if distance <= max_distance:
+                found.append((node_word, distance))
+            # by the triangle inequality, only these children can have words within max_distance
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return found
+
+
+class _NameIndex:
+    """The names with their words in a BK-tree. It is not changed after it is built: a change of the names
+    builds a new index and replaces the old one, so the lookups read it without the lock."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: FrozenSet[str] = frozenset(name for name in names if name)
+        self.exact: Dict[str, Set[str]] = {}
+        self.names_by_word: Dict[str, Set[str]] = {}
+        self.words = BKTree()
+        for name in self.names:
+            self.exact.setdefault(name.lower(), set()).add(name)
+            for word in tokenize(name):
+                if word not in self.names_by_word:
+                    self.words.add(word)
+                self.names_by_word.setdefault(word, set()).add(name)
+
+
+class EntityResolver:
+    """Exact and fuzzy lookup of entity names, loaded once from the database and refreshed when the
+    number of entities changes."""
+
+    def __init__(self, label: str, property: str = "name", refresh_interval: float = 300, max_edits: int = 2):
+        self.label = label
+        self.property = property
+        self.refresh_interval = refresh_interval
+        self.max_edits = max_edits
+        self.names_query = f"MATCH (n:{label}) WHERE n.{property} IS NOT NULL RETURN n.{property} AS name"
+        self.count_query = f"MATCH (n:{label}) RETURN count(DISTINCT n.{property}) AS count"
+        self._lock = threading.Lock()
+        self._index = _NameIndex()
+        self.loaded = False
+        self._last_check = 0.0
+        self._refreshing = False
+
+    def __len__(self) -> int:
+        return len(self._index.names)
+
+    def needs_check(self) -> bool:
+        """True if the names were never loaded or it is time to check if the entities in the database changed."""
+        return not self.loaded or time.monotonic() - self._last_check > self.refresh_interval
+
+    def checked(self):
+        """Remember that the entities in the database were checked now."""
+        self._last_check = time.monotonic()
+
+    def _set_names(self, names: FrozenSet[str]):
+        # called with the lock, the lookups see the old index until the new one is complete
+        if names != self._index.names:
+            self._index = _NameIndex(names)
+
+    def add_names(self, names: Iterable[str]):
+        """Add names to the index, for example the organizations of newly ingested articles."""
+        with self._lock:
+            self._set_names(self._index.names | {name for name in names if name})
+
+    def remove_names(self, names: Iterable[str]):
+        """Remove names from the index."""
+        with self._lock:
+            self._set_names(self._index.names - set(names))
+
+    def replace_names(self, names: Iterable[str]):
+        """Update the index to exactly these names."""
+        with self._lock:
+            self._set_names(frozenset(names))
+        self.loaded = True
+        self.checked()
+
+    def _start_refresh(self) -> bool:
+        """True if the caller should refresh the names, False if they are fresh or another refresh is running."""
+        with self._lock:
+            if self._refreshing or not self.needs_check():
+                return False
+            self._refreshing = True
+            return True
+
+    def _refresh_error(self, e: Exception):
+        logger.warning("Error in loading the %s names, using the full-text index. %s", self.label, e)
+        # try again after the refresh interval
+        self.checked()
+
+    def refresh_in_background(self, run_query: Callable[[str], List[Dict]]):
+        """Load the names in a background thread if they were never loaded, or reload them if the number
+        of names in the database changed. run_query executes a Cypher query, like graph.query."""
+        if not self._start_refresh():
+            return
+
+        def refresh():
+            try:
+                if self.loaded and run_query(self.count_query)[0]["count"] == len(self):
+                    self.checked()
+                else:
+                    self.replace_names(r["name"] for r in run_query(self.names_query))
+            except Exception as e:
+                self._refresh_error(e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name=f"{self.label}-resolver-refresh", daemon=True).start()
+
+    async def arefresh(self, run_query: Callable[[str], Awaitable[List[Dict]]]):
+        """Async version of refresh_in_background, the index is built in a worker thread."""
+        if not self._start_refresh():
+            return
+        try:
+            if self.loaded and (await run_query(self.count_query))[0]["count"] == len(self):
+                self.checked()
+            else:
+                names = [r["name"] for r in await run_query(self.names_query)]
+                await asyncio.to_thread(self.replace_names, names)
+        except Exception as e:
+            self._refresh_error(e)
+        finally:
+            self._refreshing = False
+
+    def _max_distance(self, word: str) -> int:
+        # very short words would match almost every other short word
+        return min(self.max_edits, max(len(word) - 1, 0))
+
+    def candidates(self, input: str, limit: int = 5) -> List[str]:
+        """Names that match the input, only the exact name if there is one. Empty list if nothing matches
+        or the names are not loaded yet (the callers use the full-text index then)."""
+        if not self.loaded:
+            return []
+        # the index of this moment, a refresh in another thread replaces it with a new one
+        index = self._index
+        exact = sorted(index.exact.get(input.lower().strip(), ()))
+        if exact:
+            return exact
+        words = tokenize(input)
+        if not words:
+            return []
+        # every word of the input has to match a word of the name (AND), the names with the
+        # smallest total distance are the best candidates
+        scores: Optional[Dict[str, int]] = None
+        for word in words:
+            distances: Dict[str, int] = {}
+            for match, distance in index.words.search(word, self._max_distance(word)):
+                for name in index.names_by_word.get(match, ()):
+                    if name not in distances or distance < distances[name]:
+                        distances[name] = distance
+            if scores is None:
+                scores = distances
+            else:
+                scores = {name: scores[name] + d for name, d in distances.items() if name in scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda name: (scores[name], len(name), name))[:limit]
+
+
+# the organizations from the questions are resolved with this index, and only on a miss with the full-text index
+organization_resolver = EntityResolver("Organization")
+# the countries are resolved in the same way, there is no full-text index for them
+country_resolver = EntityResolver("Country")
@@ -1,20 +1,105 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import threading
+import time
 from typing import Dict, List
 from langchain_community.graphs import Neo4jGraph
 from langchain_community.vectorstores import Neo4jVector
 from langchain_openai import OpenAIEmbeddings
 
-
-# Object to access the graph database
-graph = Neo4jGraph()
-# Object to access the openAI models API to create embeddings
-embeddings = OpenAIEmbeddings()
-
-# the index already exists - no expenses for creating embeddings for the existing entities
-# The vector index is made on the text property of Chunk entities (property text)
-vector_index = Neo4jVector.from_existing_index(embeddings, index_name="news")
+from repository.embedding_cache import CachedEmbeddings
+from repository.openai_gateway import GatewayEmbeddings
+
+
+# The objects are created on the first use and shared by the whole process, so importing this module
+# does not connect to the database and does not need the network.
+_graph = None
+_embeddings = None
+_vector_index = None
+_lock = threading.Lock()
+
+
+def get_graph() -> Neo4jGraph:
+    """Object to access the graph database."""
+    global _graph
+    if _graph is None:
+        with _lock:
+            if _graph is None:
+                # the schema is read only when it is needed (get_graph_schema)
+                _graph = Neo4jGraph(refresh_schema=False)
+    return _graph
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Object to access the openAI models API to create embeddings.
+    The embeddings are cached in memory and on disk, so the same question is embedded only once, and the
+    API calls go through the gateway (single-flight, micro-batching and rate limiting, see openai_gateway.py)."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                # the gateway retries the 429s, the OpenAI client does not retry on its own
+                _embeddings = CachedEmbeddings(GatewayEmbeddings(OpenAIEmbeddings(max_retries=0)))
+    return _embeddings
+
+
+def set_embeddings(embeddings):
+    """Replace the embeddings object, for example with a local stand-in for benchmarks.
+    The vector index object is created again with the new embeddings."""
+    global _embeddings, _vector_index
+    with _lock:
+        _embeddings = embeddings
+        _vector_index = None
+
+
+def get_vector_index() -> Neo4jVector:
+    """Object to search the chunks by similarity of the embeddings."""
+    global _vector_index
+    if _vector_index is None:
+        embeddings = get_embeddings()
+        with _lock:
+            if _vector_index is None:
+                # the index already exists - no expenses for creating embeddings for the existing entities
+                # The vector index is made on the text property of Chunk entities (property text)
+                _vector_index = Neo4jVector.from_existing_index(embeddings, index_name="news")
+    return _vector_index
+
+
+def __getattr__(name: str):
+    # the old module attributes graph, embeddings and vector_index still work, and create the objects on first use
+    if name == "graph":
+        return get_graph()
+    if name == "embeddings":
+        return get_embeddings()
+    if name == "vector_index":
+        return get_vector_index()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up():
+    """Create all objects now instead of on the first question, for example when the server starts."""
+    get_graph()
+    get_embeddings()
+    get_vector_index()
+
+
+def health_check(check_embeddings: bool = False) -> Dict[str, Dict]:
+    """Check if the graph database (and optionally the embeddings API) is reachable.
+    Returns for every dependency if it is ok, how long the check took and the error if there is one."""
+    checks = {"graph_db": lambda: get_graph().query("RETURN 1 AS ok")}
+    if check_embeddings:
+        # this calls the API, so it is not checked by default
+        checks["embeddings"] = lambda: get_embeddings().embeddings.embed_query("health check")
+    status = {}
+    for name, check in checks.items():
+        start = time.perf_counter()
+        try:
+            check()
+            status[name] = {"ok": True, "seconds": time.perf_counter() - start}
+        except Exception as e:
+            status[name] = {"ok": False, "seconds": time.perf_counter() - start, "error": str(e)}
+    return status
 
 
 def check_graph_db_connection():
@@ -26,7 +111,7 @@ def check_graph_db_connection():
     # try to execute the code and handle exception if raised
     try:
         # use the object to graph db to execute the query
-        response = graph.query(query)
+        response = get_graph().query(query)
         print(response)
         # get the first organization that is returned
         response = response[0]
@@ -47,7 +132,7 @@ def get_entity_types():
     RETURN collect(label) AS entity_types
     """
     # use the object to graph db to execute the query
-    response = graph.query(query)
+    response = get_graph().query(query)
     # print the response as is returned by Neo4j
     print("Before:", response)
     # Get the first object in the list of results
@@ -62,7 +147,9 @@ def get_entity_types():
 
 def get_graph_schema():
     """Get graph database schema."""
-    # use the object to graph db to access the schema of the database
+    # use the object to graph db to access the schema of the database (it is read only now, not when connecting)
+    graph = get_graph()
+    graph.refresh_schema()
     schema = graph.get_schema
     print(f"Graph schema: {schema}\n")
     return schema
@@ -71,7 +158,7 @@ def get_graph_schema():
 def get_embedding_dimension():
     """Get embedding dimension for embeddings created from OpenAI API."""
     # embed the given query to produce embedding with the use of openAI object that we have created upper
-    embedding = embeddings.embed_query("Calculate embedding for this query.")
+    embedding = get_embeddings().embed_query("Calculate embedding for this query.")
     # get the lenght of the embedding - list with float numbers 
     dimension = len(embedding)
     print(f"Embedding dimension for openAI embeddings: {dimension}\n")
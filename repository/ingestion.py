@@ -0,0 +1,388 @@
+"""Loading of news articles from a JSON-lines file into the graph database.
+
+Every line is one article: {"id", "title", "date", "summary", "text", "organizations": [names]}, or with
+"chunks": [texts] instead of "text". The pipeline reads the articles one batch at a time, cuts the texts
+into chunks, embeds the new and changed chunks with embed_documents (several batches at the same time, at
+most `concurrency` of them waiting to be written, so the memory stays bounded), and writes every batch in
+one transaction, with one UNWIND query for the articles with their MENTIONS and one for the chunks with HAS_CHUNK.
+The chunks are embedded through the gateway, but not through the embedding cache of the questions.
+
+The chunks and the articles have a content hash: unchanged articles are not written again, and unchanged
+chunks are not embedded again. After every written batch the line of the file is saved in the checkpoint
+file, so an interrupted run continues from there.
+
+The vector and full-text indexes of the database follow the writes by themselves. The in-process layers are
+updated too: the new chunks are added to the local vector engine (if it is used), the organizations to the
+organization resolver, and at the end the country links are created for the changed articles and the data
+version is increased, so the cached results and answers in all processes are dropped.
+
+    python -m repository.ingestion articles.jsonl
+    python -m repository.ingestion articles.jsonl --checkpoint .cache/ingestion.json --concurrency 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import date, datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from repository.country_index import materialize_country_links
+from repository.data_version import BUMP_GRAPH_VERSION_QUERY, bump_data_version
+from repository.entity_resolver import organization_resolver
+from repository.local_vector_engine import LocalVectorEngine, get_local_vector_engine
+
+logger = logging.getLogger(__name__)
+
+# the content hashes of the articles in the batch and of their chunks
+EXISTING_HASHES_QUERY = """UNWIND $ids AS id
+MATCH (a:Article {id: id})
+OPTIONAL MATCH (a)-[:HAS_CHUNK]->(c:Chunk)
+RETURN a.id AS id, a.contentHash AS hash, collect({id: c.id, hash: c.contentHash}) AS chunks
+"""
+
+# The articles with their organizations. The chunks which are not unchanged are deleted (the changed ones
+# are created again by WRITE_CHUNKS_QUERY), and the country links are created again by the country_index job.
+WRITE_ARTICLES_QUERY = """UNWIND $articles AS row
+MERGE (a:Article {id: row.id})
+SET a.title = row.title, a.date = CASE WHEN row.date IS NULL THEN null ELSE date(row.date) END,
+    a.summary = row.summary, a.contentHash = row.hash, a.countryLinksVersion = null
+WITH a, row
+CALL {
+    WITH a, row
+    OPTIONAL MATCH (a)-[:HAS_CHUNK]->(old:Chunk)
+    WHERE NOT old.id IN row.unchanged_chunk_ids
+    WITH old, elementId(old) AS old_id
+    DETACH DELETE old
+    RETURN collect(old_id) AS deleted
+}
+CALL {
+    WITH a, row
+    MATCH (a)-[old:MENTIONS]->(o:Organization)
+    WHERE NOT o.name IN row.organizations
+    DELETE old
+}
+CALL {
+    WITH a, row
+    UNWIND row.organizations AS name
+    MERGE (o:Organization {name: name})
+    MERGE (a)-[:MENTIONS]->(o)
+}
+RETURN a.id AS id, deleted
+"""
+
+WRITE_CHUNKS_QUERY = """UNWIND $chunks AS row
+MATCH (a:Article {id: row.article_id})
+MERGE (c:Chunk {id: row.id})
+MERGE (a)-[:HAS_CHUNK]->(c)
+SET c.text = row.text, c.contentHash = row.hash
+WITH c, row
+CALL {
+    WITH c, row
+    CALL db.create.setNodeVectorProperty(c, 'embedding', row.embedding)
+}
+RETURN elementId(c) AS id, row.id AS chunk_id
+"""
+
+
+def content_hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def graph_write_runner(graph) -> Callable[[List[Tuple[str, Dict]]], List[List[Dict]]]:
+    """run_write for IngestionPipeline with the driver of the Neo4jGraph object (its query() runs every query
+    in its own transaction): runs the (query, params) pairs in one write transaction and returns their rows."""
+
+    def run_write(statements: List[Tuple[str, Dict]]) -> List[List[Dict]]:
+        def work(tx):
+            # the rows are read inside the transaction, the results are gone after the commit
+            return [[record.data() for record in tx.run(query, params)] for query, params in statements]
+
+        with graph._driver.session(database=graph._database) as session:
+            return session.execute_write(work)
+
+    return run_write
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
+    """Cut the text into chunks of at most chunk_size characters at the spaces, the next chunk repeats
+    the last overlap characters of the previous one."""
+    text = " ".join((text or "").split())
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # end at a space, unless the word is longer than the chunk
+            space = text.rfind(" ", start + 1, end)
+            end = space if space > start + overlap else end
+        chunks.append(text[start:end].strip())
+        if end == len(text):
+            break
+        start = max(end - overlap, start + 1)
+        # the overlap starts at the beginning of a word
+        space = text.find(" ", start, end)
+        start = space + 1 if 0 <= space < end - 1 else start
+    return [chunk for chunk in chunks if chunk]
+
+
+def article_date(value) -> Optional[str]:
+    """The day of the date of an article as YYYY-MM-DD for date() in Cypher, which does not take the
+    timestamps like 2024-05-01T10:00:00Z. None without a date or for a date which can not be read."""
+    if not value:
+        return None
+    text = str(value).strip()
+    try:
+        # fromisoformat before python 3.11 does not take the Z
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).date().isoformat()
+    except ValueError:
+        pass
+    try:
+        return date.fromisoformat(text[:10]).isoformat()
+    except ValueError:
+        logger.warning("Skipping the date %r, it is not an ISO date", value)
+        return None
+
+
+def read_articles(path: str, start_line: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """The articles of the JSON-lines file after start_line, with the number of their line."""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number <= start_line or not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping line %d of %s, it is not JSON: %s", line_number, path, e)
+
+
+def read_checkpoint(checkpoint_path: Optional[str], source: str) -> int:
+    """The last written line of the source file, 0 without a checkpoint or for another file."""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    return checkpoint["line"] if checkpoint.get("source") == os.path.abspath(source) else 0
+
+
+def write_checkpoint(checkpoint_path: Optional[str], source: str, line: int):
+    if not checkpoint_path:
+        return
+    if os.path.dirname(checkpoint_path):
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    # write to another file and rename it, so an interrupted write does not lose the checkpoint
+    with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source), "line": line}, f)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+@dataclass
+class _Batch:
+    """The changed articles of a batch of lines, and the chunks which need an embedding."""
+
+    last_line: int
+    articles: List[Dict] = field(default_factory=list)
+    chunks: List[Dict] = field(default_factory=list)
+    embeddings: Optional[Future] = None
+
+
+@dataclass
+class IngestionStats:
+    read: int = 0
+    unchanged_articles: int = 0
+    written_articles: int = 0
+    embedded_chunks: int = 0
+    unchanged_chunks: int = 0
+    deleted_chunks: int = 0
+    seconds: float = 0.0
+
+
+class IngestionPipeline:
+    """Reads, chunks, embeds and writes the articles of JSON-lines files. run_query executes a Cypher query,
+    like graph.query, run_write executes several queries in one write transaction (see graph_write_runner),
+    and vector_engine is the local vector engine to keep up to date (or None)."""
+
+    def __init__(
+        self,
+        run_query: Callable[..., List[Dict]],
+        run_write: Callable[[List[Tuple[str, Dict]]], List[List[Dict]]],
+        embeddings: Embeddings,
+        vector_engine: Optional[LocalVectorEngine] = None,
+        batch_size: int = 50,
+        embedding_batch_size: int = 100,
+        concurrency: int = 4,
+        chunk_size: int = 1000,
+        overlap: int = 100,
+    ):
+        self.run_query = run_query
+        self.run_write = run_write
+        self.embeddings = embeddings
+        self.vector_engine = vector_engine
+        self.batch_size = batch_size
+        self.embedding_batch_size = embedding_batch_size
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def _chunks(self, article: Dict) -> List[str]:
+        if article.get("chunks") is not None:
+            return [chunk for chunk in article["chunks"] if chunk and chunk.strip()]
+        return chunk_text(article.get("text") or "", self.chunk_size, self.overlap)
+
+    def _prepare(self, lines: List[Tuple[int, Dict]], stats: IngestionStats) -> _Batch:
+        """Chunk the articles and compare them with the hashes in the database."""
+        batch = _Batch(last_line=lines[-1][0])
+        # an article repeated in the batch is written once, with its last line
+        articles = list({article["id"]: article for _, article in lines if article.get("id")}.values())
+        existing = {
+            row["id"]: row
+            for row in self.run_query(EXISTING_HASHES_QUERY, params={"ids": [a["id"] for a in articles]})
+        }
+        for article in articles:
+            chunks = self._chunks(article)
+            organizations = sorted(set(article.get("organizations") or []))
+            fields = (article.get("title"), article.get("date"), article.get("summary"), organizations)
+            article_hash = content_hash(fields, chunks)
+            old = existing.get(article["id"])
+            if old is not None and old["hash"] == article_hash:
+                stats.unchanged_articles += 1
+                continue
+            old_chunks = {c["id"]: c["hash"] for c in old["chunks"] if c["id"] is not None} if old else {}
+            unchanged = []
+            for index, text in enumerate(chunks):
+                chunk = {"article_id": article["id"], "id": f"{article['id']}-{index}", "text": text}
+                chunk["hash"] = content_hash(text)
+                if old_chunks.get(chunk["id"]) == chunk["hash"]:
+                    unchanged.append(chunk["id"])
+                else:
+                    batch.chunks.append(chunk)
+            stats.unchanged_chunks += len(unchanged)
+            batch.articles.append({
+                "id": article["id"],
+                "title": article.get("title"),
+                "date": article_date(article.get("date")),
+                "summary": article.get("summary"),
+                "organizations": organizations,
+                "hash": article_hash,
+                "unchanged_chunk_ids": unchanged,
+            })
+        return batch
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.embedding_batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[i:i + self.embedding_batch_size]))
+        return vectors
+
+    def _write(self, batch: _Batch, stats: IngestionStats):
+        vectors = batch.embeddings.result() if batch.embeddings is not None else []
+        for chunk, vector in zip(batch.chunks, vectors):
+            chunk["embedding"] = vector
+        if batch.articles:
+            statements = [(WRITE_ARTICLES_QUERY, {"articles": batch.articles})]
+            if batch.chunks:
+                statements.append((WRITE_CHUNKS_QUERY, {"chunks": batch.chunks}))
+            # in one transaction: the new content hash of an article without its new chunks would make the
+            # next run (after a crash between the two) skip the article
+            results = self.run_write(statements)
+            written, created = results[0], results[1] if batch.chunks else []
+            deleted = [chunk_id for row in written for chunk_id in row["deleted"]]
+            stats.written_articles += len(batch.articles)
+            stats.embedded_chunks += len(batch.chunks)
+            stats.deleted_chunks += len(deleted)
+            organization_resolver.add_names(name for a in batch.articles for name in a["organizations"])
+            if self.vector_engine is not None:
+                # the local engine has the chunks by their element id, like the sync from the graph
+                by_chunk_id = {chunk["id"]: chunk for chunk in batch.chunks}
+                self.vector_engine.delete(deleted)
+                self.vector_engine.append(
+                    {"id": row["id"], "text": by_chunk_id[row["chunk_id"]]["text"],
+                     "embedding": by_chunk_id[row["chunk_id"]]["embedding"]}
+                    for row in created
+                )
+
+    def run(self, path: str, checkpoint_path: Optional[str] = None) -> IngestionStats:
+        """Ingest the articles of the file, from the checkpoint on."""
+        start = time.perf_counter()
+        stats = IngestionStats()
+        articles = read_articles(path, read_checkpoint(checkpoint_path, path))
+        pending: "deque[_Batch]" = deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingestion-embed") as pool:
+
+            def write_oldest():
+                # in the order of the file, so the checkpoint never skips an unwritten batch
+                batch = pending.popleft()
+                self._write(batch, stats)
+                write_checkpoint(checkpoint_path, path, batch.last_line)
+
+            while True:
+                lines = list(islice(articles, self.batch_size))
+                if not lines:
+                    break
+                stats.read += len(lines)
+                # the hashes of an article in a waiting batch are read after that batch is written, else
+                # the article would be compared with its old version and its chunks written twice
+                ids = {article.get("id") for _, article in lines}
+                while pending and any(a["id"] in ids for waiting in pending for a in waiting.articles):
+                    write_oldest()
+                batch = self._prepare(lines, stats)
+                if batch.chunks:
+                    batch.embeddings = pool.submit(self._embed, [chunk["text"] for chunk in batch.chunks])
+                pending.append(batch)
+                if len(pending) >= self.concurrency:
+                    write_oldest()
+            while pending:
+                write_oldest()
+
+        if stats.written_articles:
+            # the country links of the changed articles, and the cached results in all processes are old now
+            materialize_country_links(self.run_query)
+            bump_data_version()
+            self.run_query(BUMP_GRAPH_VERSION_QUERY)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSON-lines file with one article per line")
+    parser.add_argument("--checkpoint", default=".cache/ingestion.json", help="empty to start from the beginning")
+    parser.add_argument("--batch-size", type=int, default=50, help="articles per write transaction")
+    parser.add_argument("--embedding-batch-size", type=int, default=100, help="texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches embedded at the same time")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="characters per chunk")
+    parser.add_argument("--overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    from repository.embedding_cache import CachedEmbeddings
+    from repository.graph_db import get_embeddings, get_graph
+
+    embeddings = get_embeddings()
+    if isinstance(embeddings, CachedEmbeddings):
+        # through the gateway, but not through the cache of the questions: the chunks are embedded once,
+        # and the cache on disk would keep all of them
+        embeddings = embeddings.embeddings
+    pipeline = IngestionPipeline(
+        get_graph().query,
+        graph_write_runner(get_graph()),
+        embeddings,
+        get_local_vector_engine(),
+        batch_size=args.batch_size,
+        embedding_batch_size=args.embedding_batch_size,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+    )
+    stats = pipeline.run(args.path, args.checkpoint or None)
+    print(f"Ingested in {stats.seconds:.1f} s: {stats}")
+
+
+if __name__ == "__main__":
+    main()
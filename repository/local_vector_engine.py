@@ -0,0 +1,312 @@
+"""Local copy of the Chunk embeddings and texts, for answering the topic questions in-process without the
+vector index of the database (and without a database at all in tests).
+
+The embeddings are stored in one contiguous file which is memory-mapped as a (count, dimension) matrix,
+optionally quantized to float16 or int8 to use less memory. The texts are stored one after another in
+one file, with the offset of every text in another file. New chunks are appended to the end of the files,
+and the meta file with their number is written last, so the rows of an interrupted append are not used
+(and are cut off by the next append).
+
+    python -m repository.local_vector_engine sync --path .cache/chunks --dtype int8
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# ids of all chunks that are connected to an article, and the rows of some of them
+CHUNK_IDS_QUERY = """MATCH (:Article)-[:HAS_CHUNK]->(c:Chunk)
+WHERE c.embedding IS NOT NULL
+RETURN DISTINCT elementId(c) AS id
+"""
+CHUNKS_BY_ID_QUERY = """MATCH (c:Chunk)
+WHERE elementId(c) IN $ids
+RETURN elementId(c) AS id, c.text AS text, c.embedding AS embedding
+"""
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+@dataclass(frozen=True)
+class _State:
+    """The memory-mapped files for the number of chunks in the meta file. A reload or a delete builds a new
+    state and replaces the old one in one assignment, so a search sees the arrays of the same moment."""
+
+    dimension: int
+    count: int
+    vectors: np.ndarray
+    scales: Optional[np.ndarray]
+    offsets: np.ndarray
+    texts: np.ndarray
+    alive: np.ndarray
+    ids: List[str]
+    rows: Dict[str, int]
+
+    def text(self, row: int) -> str:
+        return bytes(self.texts[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+
+class LocalVectorEngine:
+    """Exact top-k cosine search over a memory-mapped matrix of chunk embeddings.
+
+    The scores are in the same range as vector.similarity.cosine in Neo4j ((1 + cosine) / 2), so the
+    same bounds can be used. One process (the sync command or the ingestion) writes to the files, the
+    other processes see the new chunks when the meta file changes.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32", block_rows: int = 65536):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype {dtype}, use one of {list(DTYPES)}")
+        self.path = path
+        self.block_rows = block_rows
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        meta = self._read_meta()
+        # an existing engine keeps its dtype
+        self.dtype = meta["dtype"] if meta else dtype
+        self._meta_mtime = 0.0
+        self._last_reload_check = 0.0
+        self._open()
+
+    @property
+    def dimension(self) -> int:
+        return self._state.dimension
+
+    @property
+    def count(self) -> int:
+        return self._state.count
+
+    @property
+    def ids(self) -> List[str]:
+        return self._state.ids
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        return self._state.rows
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> Optional[Dict]:
+        if not os.path.exists(self._file("meta.json")):
+            return None
+        with open(self._file("meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, dimension: int, count: int):
+        meta = {"dtype": self.dtype, "dimension": dimension, "count": count}
+        # write to another file and rename it, so the readers never see half of the file
+        with open(self._file("meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self._file("meta.json.tmp"), self._file("meta.json"))
+
+    def _open(self):
+        """Memory-map the files for the number of chunks in the meta file."""
+        meta = self._read_meta() or {"dtype": self.dtype, "dimension": 0, "count": 0}
+        dimension, count = meta["dimension"], meta["count"]
+        self._meta_mtime = os.path.getmtime(self._file("meta.json")) if os.path.exists(self._file("meta.json")) else 0.0
+        if count:
+            vectors = np.memmap(self._file("vectors.bin"), dtype=DTYPES[self.dtype], mode="r", shape=(count, dimension))
+            scales = (
+                np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r", shape=(count,))
+                if self.dtype == "int8"
+                else None
+            )
+            offsets = np.memmap(self._file("offsets.bin"), dtype=np.int64, mode="r", shape=(count + 1,))
+            texts = np.memmap(self._file("texts.bin"), dtype=np.uint8, mode="r")
+        else:
+            vectors = np.zeros((0, dimension), dtype=DTYPES[self.dtype])
+            scales = np.zeros(0, dtype=np.float32)
+            offsets = np.zeros(1, dtype=np.int64)
+            texts = np.zeros(0, dtype=np.uint8)
+        with open(self._file("ids.txt"), "a+", encoding="utf-8") as f:
+            f.seek(0)
+            ids = f.read().splitlines()[:count]
+        rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        with open(self._file("deleted.txt"), "a+", encoding="utf-8") as f:
+            f.seek(0)
+            deleted = set(f.read().splitlines())
+        alive = np.ones(count, dtype=bool)
+        for chunk_id in deleted:
+            if chunk_id in rows:
+                alive[rows[chunk_id]] = False
+        self._state = _State(dimension, count, vectors, scales, offsets, texts, alive, ids, rows)
+
+    def _reload_if_changed(self):
+        # another process may have appended chunks, check the meta file at most once per second
+        if time.monotonic() - self._last_reload_check < 1:
+            return
+        self._last_reload_check = time.monotonic()
+        path = self._file("meta.json")
+        if os.path.exists(path) and os.path.getmtime(path) != self._meta_mtime:
+            with self._lock:
+                self._open()
+
+    def _truncate(self, state: _State):
+        """Cut the files to the chunks in the meta file. A crash after the rows were appended to the files and
+        before the meta file was written leaves bytes at their ends, the next rows must not come after them."""
+        sizes = {
+            "vectors.bin": state.count * state.dimension * np.dtype(DTYPES[self.dtype]).itemsize,
+            "scales.bin": state.count * 4,
+            "offsets.bin": (state.count + 1) * 8 if state.count else 0,
+            "texts.bin": int(state.offsets[-1]),
+            "ids.txt": sum(len(chunk_id.encode("utf-8")) + 1 for chunk_id in state.ids),
+        }
+        for name, size in sizes.items():
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def append(self, rows: Iterable[Dict]):
+        """Add chunks (dicts with id, text and embedding) to the end of the files.
+        Chunks with an id that is already in the engine are skipped."""
+        rows = [r for r in rows if r["id"] not in self.rows and r.get("embedding") is not None]
+        if not rows:
+            return
+        with self._lock:
+            state = self._state
+            self._truncate(state)
+            vectors = np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+            if state.dimension and vectors.shape[1] != state.dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} is not {state.dimension}")
+            # normalized vectors, so the dot product is the cosine similarity
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            texts = [(r["text"] or "").encode("utf-8") for r in rows]
+            offsets = state.offsets[-1] + np.cumsum([len(t) for t in texts], dtype=np.int64)
+
+            with open(self._file("vectors.bin"), "ab") as f:
+                if self.dtype == "int8":
+                    # every row is scaled so its biggest value is 127, the scale is kept to undo it
+                    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32)
+                    f.write(np.round(vectors / scales[:, None] * 127).astype(np.int8).tobytes())
+                    with open(self._file("scales.bin"), "ab") as s:
+                        s.write((scales / 127).tobytes())
+                else:
+                    f.write(vectors.astype(DTYPES[self.dtype]).tobytes())
+            with open(self._file("offsets.bin"), "ab") as f:
+                if state.count == 0:
+                    f.write(np.zeros(1, dtype=np.int64).tobytes())
+                f.write(offsets.tobytes())
+            with open(self._file("texts.bin"), "ab") as f:
+                f.write(b"".join(texts))
+            with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{r['id']}\n" for r in rows))
+
+            self._write_meta(vectors.shape[1], state.count + len(rows))
+            self._open()
+
+    def delete(self, ids: Iterable[str]):
+        """Mark chunks as deleted, they are not returned by the search anymore."""
+        ids = [chunk_id for chunk_id in ids if chunk_id in self.rows]
+        if not ids:
+            return
+        with self._lock:
+            with open(self._file("deleted.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{chunk_id}\n" for chunk_id in ids))
+            state = self._state
+            # a new array, a search in another thread keeps reading the old one
+            alive = state.alive.copy()
+            for chunk_id in ids:
+                if chunk_id in state.rows:
+                    alive[state.rows[chunk_id]] = False
+            self._state = replace(state, alive=alive)
+
+    def text(self, row: int) -> str:
+        return self._state.text(row)
+
+    def search(
+        self,
+        query_embedding: List[float],
+        k: int = 2,
+        low_bound_cosine: float = 0,
+        upper_bound_cosine: float = 1,
+    ) -> List[Dict]:
+        """The K most similar chunks with score inside the bounds, as dicts with chunk_text and score."""
+        self._reload_if_changed()
+        # the state of this moment, an append or a delete in another thread replaces it with a new one
+        state = self._state
+        vectors, scales, alive = state.vectors, state.scales, state.alive
+        if len(vectors) == 0:
+            return []
+        # a copy, the caller may give a read-only numpy array
+        query = np.array(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        # the matrix is processed in blocks, so float16 and int8 are converted only one block at a time
+        for start in range(0, len(vectors), self.block_rows):
+            block = np.asarray(vectors[start:start + self.block_rows], dtype=np.float32)
+            cosine = block @ query
+            if scales is not None and self.dtype == "int8":
+                cosine *= scales[start:start + len(block)]
+            scores = (1 + cosine) / 2
+            mask = alive[start:start + len(block)] & (scores >= low_bound_cosine) & (scores <= upper_bound_cosine)
+            rows = np.nonzero(mask)[0]
+            # keep the K best of this block together with the K best of the previous blocks
+            rows_scores = np.concatenate([best_scores, scores[rows]])
+            rows = np.concatenate([best_rows, rows + start])
+            if len(rows) > k:
+                top = np.argpartition(-rows_scores, k - 1)[:k]
+                rows, rows_scores = rows[top], rows_scores[top]
+            best_rows, best_scores = rows, rows_scores
+
+        order = np.argsort(-best_scores)
+        return [
+            {"chunk_text": state.text(int(best_rows[i])), "score": float(best_scores[i])}
+            for i in order
+        ]
+
+    def sync_from_graph(self, run_query: Callable[..., List[Dict]], batch_size: int = 1000) -> Dict[str, int]:
+        """Copy the new chunks from the graph database and mark the removed ones as deleted.
+        On an empty engine this is the full export. run_query executes a Cypher query, like graph.query."""
+        graph_ids = [r["id"] for r in run_query(CHUNK_IDS_QUERY)]
+        graph_id_set = set(graph_ids)
+        new_ids = [chunk_id for chunk_id in graph_ids if chunk_id not in self.rows]
+        removed = [chunk_id for chunk_id in self.ids if chunk_id not in graph_id_set]
+        for i in range(0, len(new_ids), batch_size):
+            self.append(run_query(CHUNKS_BY_ID_QUERY, params={"ids": new_ids[i:i + batch_size]}))
+        self.delete(removed)
+        return {"added": len(new_ids), "deleted": len(removed), "count": self.count}
+
+
+_engine: Optional[LocalVectorEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_local_vector_engine() -> Optional[LocalVectorEngine]:
+    """The local engine if LOCAL_VECTOR_ENGINE_PATH is set, otherwise None (the database is used)."""
+    global _engine
+    path = os.getenv("LOCAL_VECTOR_ENGINE_PATH")
+    if not path:
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LocalVectorEngine(path, os.getenv("LOCAL_VECTOR_ENGINE_DTYPE", "float32"))
+    return _engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["sync"], help="copy the new chunks from the graph database")
+    parser.add_argument("--path", default=os.getenv("LOCAL_VECTOR_ENGINE_PATH", ".cache/chunks"))
+    parser.add_argument("--dtype", choices=list(DTYPES), default="float32")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from repository.graph_db import get_graph
+
+    engine = LocalVectorEngine(args.path, args.dtype)
+    start = time.perf_counter()
+    result = engine.sync_from_graph(get_graph().query, args.batch_size)
+    print(f"Synced in {time.perf_counter() - start:.1f} s: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""Client-side gateway for the calls to the OpenAI API: the embeddings and the chat model.
+
+Under load many sessions embed the same popular topics at the same moment, and the LLM calls of all
+sessions together go over the rate limits of the account, which answers with 429 and the retries make the
+slow answers even slower. The gateway sits between the LangChain objects and the API:
+
+- single-flight: identical embed_query calls which are in flight at the same time make one request,
+- micro-batching: the embed_query calls of up to max_wait seconds are sent as one embed_documents request,
+- a token bucket for the requests and the tokens per minute, shared by all threads of the process, which
+  waits before the request instead of getting a 429,
+- on a 429 anyway all callers pause (for Retry-After if the API sends it), the rate is halved and grows back
+  with every successful call, and the request is retried after a jittered exponential backoff.
+
+The limits are set with OPENAI_LLM_RPM / OPENAI_LLM_TPM, OPENAI_SUMMARY_RPM / OPENAI_SUMMARY_TPM (the model of
+the chat history summaries) and OPENAI_EMBEDDING_RPM / OPENAI_EMBEDDING_TPM.
+benchmark/openai_gateway_load.py runs it against a local mock of the API which answers with 429s.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    # about 4 characters per token, like the estimate of the embedding spans
+    return sum(len(t) for t in texts) // 4 + len(texts)
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """True for a 429 of the OpenAI client (openai.RateLimitError) or of another HTTP client."""
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429 or type(e).__name__ == "RateLimitError"
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """The seconds from the Retry-After header of the 429 response, if there is one."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter, so the retries of many callers do not come at the same moment."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucketLimiter:
+    """Requests and tokens per minute, as two token buckets which refill continuously.
+
+    acquire() reserves a request and its tokens and waits until the buckets had time to refill. The reservation
+    is made at once, so the callers are served in the order in which they came. After a 429 throttled()
+    pauses all callers and halves the rate, and every succeeded() call brings it back a little.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, name: str = "openai",
+                 min_rate_factor: float = 0.1, recovery: float = 0.05):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_rate_factor = min_rate_factor
+        self.recovery = recovery
+        self.rate_factor = 1.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttles = 0
+
+    @classmethod
+    def from_env(cls, prefix: str, requests_per_minute: float, tokens_per_minute: float) -> "TokenBucketLimiter":
+        """The limiter with the limits from OPENAI_<prefix>_RPM and OPENAI_<prefix>_TPM, or the defaults."""
+        return cls(
+            float(os.getenv(f"OPENAI_{prefix}_RPM", str(requests_per_minute))),
+            float(os.getenv(f"OPENAI_{prefix}_TPM", str(tokens_per_minute))),
+            name=prefix.lower(),
+        )
+
+    def _refill(self, now: float):
+        # called with the lock acquired
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute, self._requests + elapsed * self.requests_per_minute * self.rate_factor / 60
+        )
+        self._tokens = min(
+            self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute * self.rate_factor / 60
+        )
+
+    def _reserve(self, tokens: int) -> float:
+        """Take a request and the tokens from the buckets, the seconds to wait until they are there."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # a request bigger than the bucket would wait forever
+            self._requests -= 1
+            self._tokens -= min(tokens, self.tokens_per_minute)
+            wait = max(
+                0.0,
+                -self._requests * 60 / (self.requests_per_minute * self.rate_factor),
+                -self._tokens * 60 / (self.tokens_per_minute * self.rate_factor),
+                self._paused_until - now,
+            )
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+            return wait
+
+    def acquire(self, tokens: int = 0):
+        wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0):
+        wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def throttled(self, pause: Optional[float] = None):
+        """The API answered with a 429: pause all callers and slow down."""
+        with self._lock:
+            self.throttles += 1
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + (pause or 1.0))
+        logger.warning("OpenAI %s rate limit, %.0f%% of the configured rate now", self.name, self.rate_factor * 100)
+
+    def succeeded(self):
+        if self.rate_factor < 1.0:
+            with self._lock:
+                self.rate_factor = min(1.0, self.rate_factor + self.recovery)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "waits": self.waits,
+            "wait_seconds": self.wait_seconds,
+            "throttles": self.throttles,
+            "rate_factor": self.rate_factor,
+        }
+
+
+def call_with_retries(limiter: TokenBucketLimiter, tokens: int, call: Callable[[], T], max_retries: int) -> T:
+    """Call after the limiter allows it, and again after a backoff when the API answers with a 429."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire(tokens)
+        try:
+            result = call()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            limiter.throttled(retry_after(e))
+            time.sleep(backoff(attempt))
+            continue
+        limiter.succeeded()
+        return result
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retries(
+    limiter: TokenBucketLimiter, tokens: int, call: Callable[[], Awaitable[T]], max_retries: int
+) -> T:
+    """Async version of call_with_retries."""
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == max_retries:
+                raise
+            limiter.throttled(retry_after(e))
+            await asyncio.sleep(backoff(attempt))
+            continue
+        limiter.succeeded()
+        return result
+    raise AssertionError("unreachable")
+
+
+class SingleFlight:
+    """The concurrent calls with the same key share the result of the first one."""
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key: str, call: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class MicroBatcher:
+    """Collects the texts of the concurrent embed_query calls and embeds them with one embed_documents call.
+
+    The first caller waits max_wait seconds for the others, a batch is sent earlier when it has max_batch texts.
+    """
+
+    def __init__(self, embed_documents: Callable[[List[str]], List], max_batch: int = 64, max_wait: float = 0.01):
+        self.embed_documents = embed_documents
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, Future]] = []
+        self._collecting = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def _take(self) -> List[Tuple[str, Future]]:
+        # called with the lock acquired
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _run(self, batch: List[Tuple[str, Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.texts += len(texts)
+        try:
+            vectors = dict(zip(texts, self.embed_documents(texts)))
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    def submit(self, text: str):
+        """The embedding of the text, embedded together with the texts of the other callers."""
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            leader = not self._collecting
+            self._collecting = True
+            batch = self._take() if len(self._pending) >= self.max_batch else None
+        if batch:
+            self._run(batch)
+        if leader:
+            if batch is None:
+                time.sleep(self.max_wait)
+            with self._lock:
+                self._collecting = False
+                batch = self._take()
+            if batch:
+                self._run(batch)
+        return future.result()
+
+
+class GatewayEmbeddings(Embeddings):
+    """Embeddings wrapper with single-flight, micro-batching, rate limiting and retries.
+    It goes under CachedEmbeddings, so only the texts which are not in the cache come here."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        limiter: Optional[TokenBucketLimiter] = None,
+        max_batch: int = 64,
+        max_wait: float = 0.01,
+        max_retries: int = 6,
+    ):
+        self.embeddings = embeddings
+        # the cache keys and the cost estimates are by the model name of the wrapped object
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.limiter = limiter or TokenBucketLimiter.from_env("EMBEDDING", 3000, 1_000_000)
+        self.max_retries = max_retries
+        self._single_flight = SingleFlight()
+        self._batcher = MicroBatcher(self._embed_batch, max_batch, max_wait)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return call_with_retries(
+            self.limiter, estimate_tokens(texts), lambda: self.embeddings.embed_documents(texts), self.max_retries
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_batch(texts) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._single_flight.do(text, lambda: self._batcher.submit(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return await acall_with_retries(
+            self.limiter, estimate_tokens(texts), lambda: self.embeddings.aembed_documents(texts), self.max_retries
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # the batches are collected across the threads and the event loops, so the call runs in a thread
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "shared_calls": self._single_flight.shared,
+            "batches": self._batcher.batches,
+            "batched_texts": self._batcher.texts,
+            **self.limiter.stats(),
+        }
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model wrapper with rate limiting and retries of the 429s, for the OpenAI chat model of the agent.
+    Give the wrapped model max_retries=0, so it does not retry on its own too.
+
+    A streamed answer is retried only if the 429 came before its first chunk."""
+
+    inner: BaseChatModel
+    limiter: Optional[Any] = None
+    max_retries: int = 6
+    # the tokens of the answer, which are not known before the call
+    completion_tokens_estimate: int = 256
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "openai-gateway"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # the metrics and the cost are by the name of the wrapped model
+        return {"model_name": getattr(self.inner, "model_name", self.inner._llm_type)}
+
+    def _limiter(self) -> TokenBucketLimiter:
+        return self.limiter or get_llm_limiter()
+
+    def _tokens(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> int:
+        texts = [str(m.content) for m in messages]
+        # the tool calls of the messages and the definitions of the tools are sent as JSON, and are tokens too
+        texts += [json.dumps(m.additional_kwargs, default=str) for m in messages if m.additional_kwargs]
+        texts += [json.dumps(kwargs[name], default=str) for name in ("tools", "functions") if kwargs.get(name)]
+        return estimate_tokens(texts) + self.completion_tokens_estimate
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return call_with_retries(
+            self._limiter(),
+            self._tokens(messages, kwargs),
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            self.max_retries,
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await acall_with_retries(
+            self._limiter(),
+            self._tokens(messages, kwargs),
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            self.max_retries,
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        limiter, tokens = self._limiter(), self._tokens(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire(tokens)
+            started = False
+            try:
+                for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started or not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                limiter.throttled(retry_after(e))
+                time.sleep(backoff(attempt))
+                continue
+            limiter.succeeded()
+            return
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        limiter, tokens = self._limiter(), self._tokens(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            await limiter.aacquire(tokens)
+            started = False
+            try:
+                async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started or not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                limiter.throttled(retry_after(e))
+                await asyncio.sleep(backoff(attempt))
+                continue
+            limiter.succeeded()
+            return
+
+
+# one limiter for all calls of the agent model in the process (the limits of the account are per model), and
+# one for the model of the chat history summaries; the embeddings object of the process has its own
+_llm_limiter: Optional[TokenBucketLimiter] = None
+_summary_limiter: Optional[TokenBucketLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter() -> TokenBucketLimiter:
+    global _llm_limiter
+    if _llm_limiter is None:
+        with _limiter_lock:
+            if _llm_limiter is None:
+                _llm_limiter = TokenBucketLimiter.from_env("LLM", 500, 300_000)
+    return _llm_limiter
+
+
+def get_summary_limiter() -> TokenBucketLimiter:
+    global _summary_limiter
+    if _summary_limiter is None:
+        with _limiter_lock:
+            if _summary_limiter is None:
+                _summary_limiter = TokenBucketLimiter.from_env("SUMMARY", 3500, 200_000)
+    return _summary_limiter
@@ -0,0 +1,90 @@
+"""Lazy iteration over the results of the paged queries in cypher.py.
+
+The results are read one page at a time with keyset pagination: the next page is requested only when the
+previous one is consumed, with the sort key of its last row as the $after parameter. Every page is read
+completely before its rows are returned, so an iterator that is not consumed to the end (for example one
+that waits for "fetch more" in the chat) does not hold a connection of the pool.
+"""
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+# sort key of a row of the news queries (ordered by date DESC, id) and of the organizations by employees
+NEWS_KEY = ("date", "id")
+ORGANIZATIONS_BY_EMPLOYEES_KEY = ("number_employees", "organization_name")
+
+
+def row_key(row: Dict, key: tuple) -> Dict:
+    """The $after parameter for the page that follows the row."""
+    return {name: row[name] for name in key}
+
+
+def paginate(
+    run_page: Callable[[Dict], List[Dict]],
+    params: Dict,
+    key: tuple,
+    page_size: int = 5,
+    after: Optional[Dict] = None,
+) -> Iterator[Dict]:
+    """Yield the rows of all pages of a paged query. run_page executes the query with the parameters
+    (including $after and $k) and returns the rows of one page."""
+    while True:
+        rows = run_page({**params, "after": after, "k": page_size})
+        yield from rows
+        # a page that is not full is the last one
+        if len(rows) < page_size:
+            return
+        after = row_key(rows[-1], key)
+
+
+async def apaginate(
+    run_page: Callable[[Dict], Awaitable[List[Dict]]],
+    params: Dict,
+    key: tuple,
+    page_size: int = 5,
+    after: Optional[Dict] = None,
+) -> AsyncIterator[Dict]:
+    """Async version of paginate."""
+    while True:
+        rows = await run_page({**params, "after": after, "k": page_size})
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = row_key(rows[-1], key)
+
+
+def paginate_by_score(
+    run_page: Callable[[float, int], List[Dict]],
+    upper_bound_cosine: float = 1,
+    page_size: int = 5,
+) -> Iterator[Dict]:
+    """Yield the results of a vector range search ordered by score, one page at a time.
+    run_page(upper_bound_cosine, k) returns the K best rows (dicts with chunk_text and score) up to the bound.
+    The next page starts at the score of the last row, the rows with that score which were already
+    returned are skipped."""
+    seen = set()
+    while True:
+        rows = run_page(upper_bound_cosine, page_size + len(seen))
+        new_rows = [r for r in rows if r["chunk_text"] not in seen]
+        yield from new_rows
+        if len(rows) < page_size + len(seen) or not new_rows:
+            return
+        upper_bound_cosine = new_rows[-1]["score"]
+        seen = {r["chunk_text"] for r in rows if r["score"] == upper_bound_cosine}
+
+
+async def apaginate_by_score(
+    run_page: Callable[[float, int], Awaitable[List[Dict]]],
+    upper_bound_cosine: float = 1,
+    page_size: int = 5,
+) -> AsyncIterator[Dict]:
+    """Async version of paginate_by_score."""
+    seen = set()
+    while True:
+        rows = await run_page(upper_bound_cosine, page_size + len(seen))
+        new_rows = [r for r in rows if r["chunk_text"] not in seen]
+        for row in new_rows:
+            yield row
+        if len(rows) < page_size + len(seen) or not new_rows:
+            return
+        upper_bound_cosine = new_rows[-1]["score"]
+        seen = {r["chunk_text"] for r in rows if r["score"] == upper_bound_cosine}
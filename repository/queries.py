@@ -1,32 +1,56 @@
-from typing import Dict, List, Tuple
-from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
-from repository.graph_db import graph, embeddings, vector_index
+import logging
+import time
+from functools import partial
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from repository.graph_db import get_graph, get_embeddings, get_vector_index
+from repository.entity_resolver import organization_resolver, country_resolver
+from repository.data_version import poll_graph_version
+from repository.embedding_cache import query_vector
+from repository.result_cache import cached_query
+from repository.local_vector_engine import get_local_vector_engine
+from observability.tracing import span, traced
+from repository.pagination import NEWS_KEY, ORGANIZATIONS_BY_EMPLOYEES_KEY, paginate, paginate_by_score
+from repository.cypher import (
+    CANDIDATES_QUERY,
+    VECTOR_RANGE_SEARCH_QUERY,
+    BATCH_VECTOR_RANGE_SEARCH_QUERY,
+    BRUTE_FORCE_RANGE_SEARCH_QUERY,
+    NEWS_BY_ORGANIZATION_QUERY,
+    ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY,
+    NUMBER_EMPLOYEES_QUERY,
+    NEWS_BY_COUNTRY_QUERY,
+    NEWS_BY_COUNTRY_TRAVERSAL_QUERY,
+    RESULT_CACHE_TTLS,
+    generate_full_text_query,
+    select_candidates,
+    organization_result,
+    next_range_search_candidates,
+    batch_range_search_round,
+    hybrid_search_queries,
+    reciprocal_rank_fusion,
+    query_name,
+)
 
+logger = logging.getLogger(__name__)
 
-def generate_full_text_query(input: str) -> str:
-    """
-    Generate a full-text search query for a given input string.
 
-    This function constructs a query string suitable for a full-text search.
-    It processes the input string by splitting it into words and appending a
-    similarity threshold (~0.8) to each word, then combines them using the AND
-    operator. Useful for mapping organization from user questions
-    to database values, and allows for some misspelings.
-    """
-    full_text_query = ""
-    # remove lucene special characters from the input, then split the input into words and save it as list of words
-    words = [el for el in remove_lucene_chars(input).split() if el]
-    # iterate all of the words ([:-1] means except for the last word ) in order to create the query
-    # with sign ~ and the AND operator to search in the database with proxinimity search.
-    # If the input is "Amsterdam Inc. Coorporation" then it will produce: Amsterdam~2 AND Inc~ AND Coorporation~2
-    for word in words[:-1]:
-        full_text_query += f" {word}~2 AND"  # ~2 proximity search; indicates that the words should be within two chars of each other.
+def _run_query(query: str, params: Optional[Dict] = None) -> List[Dict]:
+    """Execute the query in the graph database, with its time and number of rows in the metrics."""
+    with span("cypher", query_name(query)) as current:
+        results = get_graph().query(query, params=params or {})
+        current.set(rows=len(results))
+    return results
+
 
-    full_text_query += f" {words[-1]}~2"
-    # remove the empty spaces in the beggining and end of the query
-    return full_text_query.strip()
+def _cached_query(query: str, params: Dict) -> List[Dict]:
+    """Execute the query or get the result from the result cache."""
+    # check from time to time if the data was changed by the ingestion in another process
+    poll_graph_version(_run_query)
+    return cached_query(_run_query, query, params, RESULT_CACHE_TTLS.get(query))
 
 
+@traced()
 def get_candidates(input: str, candidate_query: str, limit: int = 5) -> List[Dict[str, str]]:
     """
     Retrieve a list of candidate entities from database based on the input string.
@@ -39,103 +63,269 @@ def get_candidates(input: str, candidate_query: str, limit: int = 5) -> List[Dic
     # Use the upper function to create the query with proximity search, and save it in ft_query variable
     ft_query = generate_full_text_query(input)
     # Use the graph object to execute the query and give parameters: limit and index
-    candidates = graph.query(
+    candidates = _cached_query(
         candidate_query, {"fulltextQuery": ft_query, "index": 'entity', "limit": limit}
     )
     # If there is direct match in the results from database return only that, otherwise return all options
-    direct_match = [
-        el["candidate"] for el in candidates if el["candidate"].lower() == input.lower()
-    ]
-    if direct_match:
-        return direct_match
-
-    return [el["candidate"] for el in candidates]
+    return select_candidates(input, candidates)
 
 
+@traced()
 def search_news_by_topic(topic: str):
     """Search for news in database by a topic provided by the user (variable)."""
+    # If the local copy of the chunks is enabled, search there instead of in the database
+    engine = get_local_vector_engine()
+    if engine is not None:
+        return [r["chunk_text"] for r in engine.search(query_vector(get_embeddings(), topic), k=2)]
     # Use the similarity_search function in the vector_index object, that is created upper, which creates
     # embedding of the topic and compares it with the embeddings of the chunk texts
     # Returns the most similar K topics by cosine similarity
-    results = vector_index.similarity_search(query=topic, k=2)
+    results = get_vector_index().similarity_search(query=topic, k=2)
     # The result is a list of dict objects with keys:page_content and metadata.
     # Saving only the page_contents in list, as these are the most simiar texts that we want to show.
     page_contents = []
     for r in results:
-        print("Page content: ", r.page_content)
-        print("Metadata: ", r.metadata)
+        logger.debug("Page content: %s, metadata: %s", r.page_content, r.metadata)
         # adding new element to the list
         page_contents.append(r.page_content)
     # No need of metadata (decreasing the input tokens to GPT)
     return page_contents
 
 
-def filter_news_by_topic_with_score(
-    topic: str, low_bound_cosine: float = 0, upper_bound_cosine: float = 1
-):
-    """Same as the upper function, just filters the results by the cosine similarity score."""
-    query = """MATCH (c:Chunk)<-[:HAS_CHUNK]-(a:Article) 
-    WITH c.text as chunk_text, vector.similarity.cosine(c.embedding,$embedding) AS score 
-    WHERE score <= $upper_bound_cosine AND score >= $low_bound_cosine
-    RETURN chunk_text, score
-    ORDER BY score DESC
-    LIMIT $k
+@traced()
+def vector_range_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    index_name: str = "news",
+    overfetch: int = 4,
+    max_candidates: int = 1000,
+) -> List[Dict]:
+    """Find the K most similar chunks whose score is inside [low_bound_cosine, upper_bound_cosine]
+    by using the vector index instead of calculating the similarity for every chunk.
+
+    The index returns the candidates ordered by score, so we ask it for a few more candidates than we need
+    and filter them by the bounds. If not enough candidates land inside the bounds (the upper bound removes
+    the most similar ones), we ask the index again for more candidates until we have K results.
     """
-    # Create embedding for the topic entered by the user
-    topic_embedding = embeddings.embed_query(topic)
+    candidates = min(k * overfetch, max_candidates)
+    while candidates is not None:
+        results = _run_query(
+            VECTOR_RANGE_SEARCH_QUERY,
+            params={
+                "index": index_name,
+                "candidates": candidates,
+                "embedding": topic_embedding,
+                "low_bound_cosine": low_bound_cosine,
+                "upper_bound_cosine": upper_bound_cosine,
+            },
+        )
+        candidates = next_range_search_candidates(
+            results, k, candidates, low_bound_cosine, overfetch, max_candidates
+        )
+    return [r for r in results if r["chunk_text"] is not None][:k]
+
+
+@traced()
+def brute_force_range_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+) -> List[Dict]:
+    """Find the K most similar chunks whose score is inside the bounds by calculating
+    the cosine similarity for every chunk in the database."""
     # We provide query to the graph object to be executed, and parameters are the bounds of the cosine similarity
     # in which we want the result to be.
-    results = graph.query(
-        query,
+    return _run_query(
+        BRUTE_FORCE_RANGE_SEARCH_QUERY,
         params={
             "low_bound_cosine": low_bound_cosine,
             "upper_bound_cosine": upper_bound_cosine,
             "embedding": topic_embedding,
-            "k": 2,
+            "k": k,
         },
     )
-    print("RESULTS: ", results)
+
+
+def _range_search(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    use_vector_index: bool = True,
+) -> List[Dict]:
+    engine = get_local_vector_engine()
+    if engine is not None:
+        return engine.search(topic_embedding, k, low_bound_cosine, upper_bound_cosine)
+    if use_vector_index:
+        return vector_range_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k)
+    return brute_force_range_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k)
+
+
+@traced()
+def filter_news_by_topic_with_score(
+    topic: str,
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    use_vector_index: bool = True,
+    lazy: bool = False,
+    topic_embedding: Optional[List[float]] = None,
+):
+    """Same as the upper function, just filters the results by the cosine similarity score.
+    By default it uses the vector index, set use_vector_index to False to scan all chunks.
+    With lazy=True it returns an iterator over all results (dicts with chunk_text and score), K at a time.
+    The topic_embedding can be given when it is already known (prefetched while the LLM chose the tool).
+    """
+    # Create embedding for the topic entered by the user
+    if topic_embedding is None:
+        topic_embedding = get_embeddings().embed_query(topic)
+    if lazy:
+        return iter_news_by_topic(topic_embedding, low_bound_cosine, upper_bound_cosine, k, use_vector_index)
+    results = _range_search(topic_embedding, low_bound_cosine, upper_bound_cosine, k, use_vector_index)
+    logger.debug("Results: %s", results)
     # The result is list of dicts with key chunk_text so we are accessing it.
     results = [r['chunk_text'] for r in results]
     return results
 
 
+def iter_news_by_topic(
+    topic_embedding: List[float],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    page_size: int = 2,
+    use_vector_index: bool = True,
+) -> Iterator[Dict]:
+    """All chunks with score inside the bounds, the most similar first, searched one page at a time."""
+    return paginate_by_score(
+        lambda upper, k: _range_search(topic_embedding, low_bound_cosine, upper, k, use_vector_index),
+        upper_bound_cosine,
+        page_size,
+    )
+
+
+@traced()
+def batch_vector_range_search(
+    topic_embeddings: Dict[str, List[float]],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+    index_name: str = "news",
+    overfetch: int = 4,
+    max_candidates: int = 1000,
+) -> Dict[str, List[Dict]]:
+    """Same as vector_range_search, but for several topics in one query. Only the topics which
+    do not have K results yet are searched again with more candidates."""
+    candidates = {topic: min(k * overfetch, max_candidates) for topic in topic_embeddings}
+    found = {}
+    while candidates:
+        rows = _run_query(
+            BATCH_VECTOR_RANGE_SEARCH_QUERY,
+            params={
+                "index": index_name,
+                "topics": [
+                    {"topic": topic, "embedding": topic_embeddings[topic], "candidates": number}
+                    for topic, number in candidates.items()
+                ],
+                "low_bound_cosine": low_bound_cosine,
+                "upper_bound_cosine": upper_bound_cosine,
+            },
+        )
+        candidates = batch_range_search_round(
+            rows, candidates, found, k, low_bound_cosine, overfetch, max_candidates
+        )
+    return {topic: found.get(topic, []) for topic in topic_embeddings}
+
+
+@traced()
+def filter_news_by_topics_with_score(
+    topics: List[str],
+    low_bound_cosine: float = 0,
+    upper_bound_cosine: float = 1,
+    k: int = 2,
+) -> Dict[str, List[str]]:
+    """Same as filter_news_by_topic_with_score, but for several topics with one call to the
+    embeddings API and one query to the database."""
+    # the same topic only once, in the same order
+    topics = list(dict.fromkeys(t for t in topics if t))
+    if not topics:
+        return {}
+    topic_embeddings = dict(zip(topics, get_embeddings().embed_documents(topics)))
+    engine = get_local_vector_engine()
+    if engine is not None:
+        results = {
+            topic: engine.search(embedding, k, low_bound_cosine, upper_bound_cosine)
+            for topic, embedding in topic_embeddings.items()
+        }
+    else:
+        results = batch_vector_range_search(topic_embeddings, low_bound_cosine, upper_bound_cosine, k)
+    logger.debug("Results: %s", results)
+    return {topic: [r["chunk_text"] for r in rows] for topic, rows in results.items()}
+
+
+@traced()
+def hybrid_search(
+    topic: str,
+    organization: Optional[str] = None,
+    k: int = 3,
+    candidates: int = 20,
+    rrf_k: int = 60,
+    topic_embedding: Optional[List[float]] = None,
+) -> Dict:
+    """Search the news by topic (vector index) and by organization (full-text index), and merge both
+    rankings with reciprocal rank fusion. Returns the results (the best chunk of every article) and how
+    long every stage took, in milliseconds: embedding, vector and fulltext search, fusion and total."""
+    start = time.perf_counter()
+    # when there is no topic, the organization is used as the text for the vector search
+    if topic_embedding is None:
+        topic_embedding = get_embeddings().embed_query(topic or organization)
+    timings = {"embedding_ms": (time.perf_counter() - start) * 1000}
+    rankings = {}
+    for name, (query, params) in hybrid_search_queries(topic_embedding, organization, candidates).items():
+        stage = time.perf_counter()
+        rankings[name] = _run_query(query, params)
+        timings[f"{name}_ms"] = (time.perf_counter() - stage) * 1000
+    stage = time.perf_counter()
+    results = reciprocal_rank_fusion(rankings, k, rrf_k)
+    finished = time.perf_counter()
+    timings["fusion_ms"] = (finished - stage) * 1000
+    timings["total_ms"] = (finished - start) * 1000
+    logger.info("Hybrid search timings: %s", timings)
+    return {"results": results, "timings": timings}
+
+
+@traced()
 def find_organization(organization: str) -> Tuple[bool, list | str]:
     """Find organizarion in the database which is provided by the user.
     Here we are using the fulltextQuery (with proximity search) that we created above
     in order to get similar organizations if we don't have the exact one in the database.
     (because of typo or it is not part of the database).
     """
-    suggested_organizations_query = """
-    CALL db.index.fulltext.queryNodes($index, $fulltextQuery, {limit: $limit})
-    YIELD node
-    WHERE node:Organization // Filter organization nodes
-    RETURN distinct node.name AS candidate
-    """
-    # Call the function that is created above to get the candidates from database
-    candidates = get_candidates(organization, suggested_organizations_query)
-    print("Candidates for organization:", candidates)
-
-    # if there are no candidates , return that to the chatbot so it will know.
-    if len(candidates) == 0:
-        return (
-            False,  # The organization does not exist
-            "There are not any available organizations with this name. "
-            "Ask the user to reconsider the organization.",
-        )
-    # if there is more than 1 candidate, ask the user which organization it meant.
-    if len(candidates) > 1:  # Ask for follow up if too many options
-        return (
-            False,
-            "Ask a follow up question which of the available organizations "
-            f"did the user mean. Available options: {candidates}",
-        )
+    # Load the organization names in memory (in background, only the first time or when they change),
+    # and resolve the organization from them without going to the database.
+    organization_resolver.refresh_in_background(_run_query)
+    candidates = organization_resolver.candidates(organization)
+    # Call the function that is created above to get the candidates from database, if they are not found in memory
+    if not candidates:
+        candidates = get_candidates(organization, CANDIDATES_QUERY)
+    logger.debug("Candidates for organization: %s", candidates)
+
+    # no candidates or more than one candidate is a message for the chatbot, exactly one is the organization
+    return organization_result(candidates)
+
 
-    # if there is exact one candidate, return it
-    return True, candidates
+def iter_news_by_organization(organization: str, page_size: int = 5) -> Iterator[Dict]:
+    """The chunks (chunk_text, date, id) of the articles which mention the organization (the exact name),
+    the newest first, read one page at a time."""
+    return paginate(partial(_cached_query, NEWS_BY_ORGANIZATION_QUERY), {"organization": organization}, NEWS_KEY, page_size)
 
 
-def search_by_organization(organization: str):
+@traced()
+def search_by_organization(organization: str, k: int = 2, lazy: bool = False):
+    """Find the news for the organization. With lazy=True it returns an iterator over all of them,
+    K at a time, instead of the first K."""
     candidates = find_organization(organization)
 
     # if there are no candidates or more than 1 candidate for organization, return the message to the chatbot so it will know.
@@ -146,32 +336,41 @@ def search_by_organization(organization: str):
 
     # if there is exactly one organization, search for chunk_texts in database for that organization
     organization = candidates[0]
-    query = """MATCH (c:Chunk)<-[:HAS_CHUNK]-(a:Article) 
-    WHERE EXISTS {(a)-[:MENTIONS]->(:Organization {name: $organization})}
-    WITH c.text as chunk_text
-    RETURN chunk_text
-    LIMIT $k
-    """
-    results = graph.query(query, params={"organization": organization, "k": 2})
-    print("RESULTS :", results)
+    rows = iter_news_by_organization(organization, page_size=k)
+    if lazy:
+        return rows
+    results = [{"chunk_text": r["chunk_text"]} for r in islice(rows, k)]
+    logger.debug("Results: %s", results)
     return results
 
 
-def filter_by_number_employees(number_employees: str):
+def iter_organizations_by_number_employees(number_employees: int, page_size: int = 5) -> Iterator[Dict]:
+    """The organizations (organization_name, number_employees) with at least number_employees employees,
+    the biggest first, read one page at a time."""
+    return paginate(
+        partial(_cached_query, ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY),
+        {"number_employees": number_employees},
+        ORGANIZATIONS_BY_EMPLOYEES_KEY,
+        page_size,
+    )
+
+
+@traced()
+def filter_by_number_employees(number_employees: str, k: int = 5, lazy: bool = False):
     """Find organizations which have more than $number_employees, provided as input by the user.
     number_employees is property in the Organization objects.
-    """
-    query = """MATCH (o:Organization)
-    WHERE o.nbrEmployees >= $number_employees
-    RETURN o.name as organization_name
-    LIMIT $k
+    With lazy=True it returns an iterator over all of them, K at a time, instead of the first K.
     """
     # execute the query in database
-    results = graph.query(query, params={"number_employees": number_employees, "k": 5})
-    print("RESULTS: ", results)
+    rows = iter_organizations_by_number_employees(number_employees, page_size=k)
+    if lazy:
+        return rows
+    results = list(islice(rows, k))
+    logger.debug("Results: %s", results)
     return results
 
 
+@traced()
 def get_number_employees(organization: str):
     """Find number_employees for a given organization, provided as input by the user.
     number_employees is property in the Organization objects.
@@ -184,26 +383,54 @@ def get_number_employees(organization: str):
     else:
         candidates = candidates[1]
 
-    query = """MATCH (o:Organization{name:$org_name})
-    RETURN o.nbrEmployees as number_employees
-    """
-    # Create embedding for the topic entered by the user
-    results = graph.query(query, params={"org_name": candidates[0]})
-    print("RESULTS: ", results)
+    results = number_employees_of(candidates[0])
+    logger.debug("Results: %s", results)
     return results
 
 
-def filter_by_country(country_name: str):
-    """Find news for a given country, provided as input by the user.
-    Articles objects are not directly connected to the country nodes, so we need to traverse the graph.
-    """
-    query = """MATCH (a:Article)-[:MENTIONS]->(o:Organization)-[:IN_CITY]->(city:City)-[:IN_COUNTRY]->(country:Country{name:$country_name})
-    WITH {article_summary: a.summary, organization_name: o.name} as result_dict
-    LIMIT $k
-    RETURN COLLECT(result_dict) as results
+def number_employees_of(organization_name: str) -> List[Dict]:
+    """number_employees of the organization with exactly this name, already resolved with find_organization."""
+    return _cached_query(NUMBER_EMPLOYEES_QUERY, {"org_name": organization_name})
+
+
+@traced()
+def find_country(country_name: str) -> Tuple[bool, list | str]:
+    """Find the country in the database, allowing typos, with the same in-memory index as the organizations.
+    If the country names are not loaded yet, the name is used as provided by the user."""
+    country_resolver.refresh_in_background(_run_query)
+    if not country_resolver.loaded:
+        return True, [country_name]
+    return organization_result(country_resolver.candidates(country_name), "country")
+
+
+def iter_news_by_country(country_name: str, page_size: int = 5) -> Iterator[Dict]:
+    """The articles (article_summary, organization_names, date, id) for the country (the exact name),
+    the newest first, read one page at a time."""
+    params = {"country_name": country_name}
+    rows = paginate(partial(_cached_query, NEWS_BY_COUNTRY_QUERY), params, NEWS_KEY, page_size)
+    first = next(rows, None)
+    if first is None:
+        # no links yet for this country, walk the graph instead
+        rows = paginate(partial(_cached_query, NEWS_BY_COUNTRY_TRAVERSAL_QUERY), params, NEWS_KEY, page_size)
+    else:
+        yield first
+    yield from rows
+
+
+@traced()
+def filter_by_country(country_name: str, page_size: int = 5, lazy: bool = False):
+    """Find news for a given country, provided as input by the user, the newest first.
+    The articles are linked to the countries by the country_index job, until then we traverse the graph
+    (Articles objects are not directly connected to the country nodes).
+    With lazy=True it returns an iterator over all articles instead of the message with the first page.
     """
-    # Create embedding for the topic entered by the user
-    results = graph.query(query, params={"country_name": country_name, "k": 5})
-    results = results[0]
-    print("RESULTS: ", results)
-    return f"Here are article summaries for organizations in {country_name}" + str(results)
+    found, countries = find_country(country_name)
+    if not found:
+        return countries
+    rows = iter_news_by_country(countries[0], page_size)
+    if lazy:
+        return rows
+    # the id is only needed for the next page
+    results = [{key: value for key, value in r.items() if key != "id"} for r in islice(rows, page_size)]
+    logger.debug("Results: %s", results)
+    return f"Here are article summaries for organizations in {countries[0]}" + str(results)
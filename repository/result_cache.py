@@ -0,0 +1,166 @@
+"""Cache for the results of the read queries to the graph database."""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from repository.data_version import get_data_version
+
+
+def make_cache_key(query: str, params: Optional[Dict] = None) -> str:
+    """Key of the cache from the Cypher text and the parameters. The whitespace in the query
+    and the order of the parameters do not change the key."""
+
+    def default(value):
+        # numpy arrays (the embeddings) are compared by their values
+        if hasattr(value, "tolist"):
+            return value.tolist()
+        return str(value)
+
+    text = " ".join(query.split()) + "\0" + json.dumps(params or {}, sort_keys=True, default=default)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU cache with a time to live for every entry and a maximum size in bytes.
+
+    The entries remember the data version for which they were calculated, and they are not
+    returned anymore when the version changes. Any object with the same get, set, invalidate and
+    stats methods can be used instead of this one (see set_result_cache).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (value, expires at, data version, size in bytes)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _remove(self, key: str):
+        # called with the lock acquired
+        _, _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """(True, value) if the key is in the cache, otherwise (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, version, _ = entry
+                if expires_at > time.monotonic() and version == get_data_version():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                self._remove(key)
+                self.expired += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, version: Optional[int] = None):
+        """Cache the value, calculated for the data version (by default the current one). The version has
+        to be read before the query runs: an ingestion during the query makes the value old already."""
+        size = len(pickle.dumps(value))
+        # a result bigger than the whole cache is not cached
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+            version = get_data_version() if version is None else version
+            self._entries[key] = (value, expires_at, version, size)
+            self._bytes += size
+            # remove the least recently used entries until the cache fits in the memory limit
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None):
+        """Remove one key, or all keys if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# the cache is disabled with RESULT_CACHE_MAX_BYTES=0
+_max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+_result_cache: Optional[ResultCache] = ResultCache(_max_bytes) if _max_bytes > 0 else None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    return _result_cache
+
+
+def set_result_cache(cache: Optional[ResultCache]):
+    """Use another cache implementation, or None to disable the cache."""
+    global _result_cache
+    _result_cache = cache
+
+
+def cached_query(
+    run_query: Callable[..., List[Dict]], query: str, params: Optional[Dict] = None, ttl: Optional[float] = None
+) -> List[Dict]:
+    """Run the query with run_query(query, params=params) only if the result is not in the cache."""
+    cache = get_result_cache()
+    if cache is None:
+        return run_query(query, params=params)
+    key = make_cache_key(query, params)
+    found, value = cache.get(key)
+    if found:
+        return value
+    version = get_data_version()
+    value = run_query(query, params=params)
+    cache.set(key, value, ttl, version)
+    return value
+
+
+async def acached_query(
+    run_query: Callable[..., Awaitable[List[Dict]]],
+    query: str,
+    params: Optional[Dict] = None,
+    ttl: Optional[float] = None,
+) -> List[Dict]:
+    """Async version of cached_query, run_query is awaited as run_query(query, params)."""
+    cache = get_result_cache()
+    if cache is None:
+        return await run_query(query, params)
+    key = make_cache_key(query, params)
+    found, value = cache.get(key)
+    if found:
+        return value
+    version = get_data_version()
+    value = await run_query(query, params)
+    cache.set(key, value, ttl, version)
+    return value
+
+
+def invalidate_results():
+    """Remove all cached results, for example after changing the data in the graph by hand."""
+    cache = get_result_cache()
+    if cache is not None:
+        cache.invalidate()
@@ -0,0 +1,297 @@
+"""The indexes which the repository queries need, and a profiler of the queries.
+
+SCHEMA declares the range, text, full-text (entity) and vector (news) indexes. apply_schema() creates the
+missing ones and leaves the existing ones alone, also when they have another name, so it can run on every
+start. profile_queries() runs every read query of the repository with EXPLAIN or PROFILE and flags the
+plans with label scans, cartesian products or too many database hits.
+
+    python -m repository.schema check
+    python -m repository.schema apply --dimension 1536
+    python -m repository.schema profile --max-db-hits 10000
+    python -m repository.schema profile --explain        # only the plans, the queries are not run
+"""
+import argparse
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from repository.cypher import (
+    BATCH_VECTOR_RANGE_SEARCH_QUERY,
+    BRUTE_FORCE_RANGE_SEARCH_QUERY,
+    CANDIDATES_QUERY,
+    NEWS_BY_COUNTRY_QUERY,
+    NEWS_BY_COUNTRY_TRAVERSAL_QUERY,
+    NEWS_BY_ORGANIZATION_QUERY,
+    NUMBER_EMPLOYEES_QUERY,
+    ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY,
+    VECTOR_RANGE_SEARCH_QUERY,
+    VECTOR_SEARCH_QUERY,
+    generate_full_text_query,
+    hybrid_search_queries,
+    query_name,
+)
+from repository.data_version import GRAPH_VERSION_QUERY
+
+# the dimension of the OpenAI embeddings (text-embedding-ada-002), for a new vector index
+DEFAULT_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1536"))
+
+SHOW_INDEXES_QUERY = """SHOW INDEXES
+YIELD name, type, labelsOrTypes, properties, state, options
+RETURN name, type, labelsOrTypes, properties, state, options
+"""
+
+
+@dataclass
+class Index:
+    """An index which a query needs: its type (RANGE, TEXT, FULLTEXT or VECTOR) on the properties of the labels."""
+
+    name: str
+    type: str
+    labels: Tuple[str, ...]
+    properties: Tuple[str, ...]
+    # what needs it, for the report
+    used_by: str = ""
+
+    def create_query(self) -> str:
+        if self.type == "FULLTEXT":
+            labels = "|".join(self.labels)
+            properties = ", ".join(f"n.{p}" for p in self.properties)
+            return f"CREATE FULLTEXT INDEX {self.name} IF NOT EXISTS FOR (n:{labels}) ON EACH [{properties}]"
+        properties = ", ".join(f"n.{p}" for p in self.properties)
+        kind = "" if self.type == "RANGE" else f"{self.type} "
+        query = f"CREATE {kind}INDEX {self.name} IF NOT EXISTS FOR (n:{self.labels[0]}) ON ({properties})"
+        if self.type == "VECTOR":
+            query += (
+                " OPTIONS {indexConfig: {`vector.dimensions`: $dimension, "
+                "`vector.similarity_function`: 'cosine'}}"
+            )
+        return query
+
+    def matches(self, row: Dict) -> bool:
+        """True if the row of SHOW INDEXES is this index, maybe with another name."""
+        return (
+            row["type"] == self.type
+            and sorted(row["labelsOrTypes"] or []) == sorted(self.labels)
+            and list(row["properties"] or []) == list(self.properties)
+        )
+
+
+SCHEMA = (
+    Index("entity", "FULLTEXT", ("Organization", "Person"), ("name",), "find_organization, hybrid_search"),
+    Index("news", "VECTOR", ("Chunk",), ("embedding",), "the topic searches"),
+    Index("organization_name", "RANGE", ("Organization",), ("name",), "NUMBER_EMPLOYEES_QUERY, NEWS_BY_ORGANIZATION_QUERY"),
+    Index("organization_name_text", "TEXT", ("Organization",), ("name",), "CONTAINS and ENDS WITH on names"),
+    Index("organization_employees", "RANGE", ("Organization",), ("nbrEmployees",), "ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY"),
+    Index("country_name", "RANGE", ("Country",), ("name",), "NEWS_BY_COUNTRY_QUERY, find_country"),
+    Index("city_name", "RANGE", ("City",), ("name",), "benchmark.news_graph"),
+    Index("article_id", "RANGE", ("Article",), ("id",), "repository.ingestion"),
+    Index("chunk_id", "RANGE", ("Chunk",), ("id",), "repository.ingestion"),
+    Index("data_version_name", "RANGE", ("DataVersion",), ("name",), "GRAPH_VERSION_QUERY"),
+)
+
+
+def check_schema(run_query: Callable[..., List[Dict]], schema=SCHEMA) -> Dict[str, Dict]:
+    """For every index of the schema: if it exists (and under which name), and its state."""
+    existing = run_query(SHOW_INDEXES_QUERY)
+    status = {}
+    for index in schema:
+        row = next((r for r in existing if index.matches(r)), None)
+        status[index.name] = {
+            "exists": row is not None,
+            "name": row["name"] if row else None,
+            "state": row["state"] if row else None,
+            "used_by": index.used_by,
+        }
+        if row is not None and index.type == "VECTOR":
+            config = (row.get("options") or {}).get("indexConfig") or {}
+            status[index.name]["dimension"] = config.get("vector.dimensions")
+    return status
+
+
+def apply_schema(
+    run_query: Callable[..., List[Dict]], dimension: int = DEFAULT_DIMENSION, schema=SCHEMA, wait: float = 600
+) -> Dict[str, str]:
+    """Create the missing indexes, and wait up to wait seconds until they are online.
+    Returns for every index "exists" or "created"."""
+    status = check_schema(run_query, schema)
+    result = {}
+    for index in schema:
+        if status[index.name]["exists"]:
+            result[index.name] = "exists"
+            continue
+        run_query(index.create_query(), params={"dimension": dimension})
+        result[index.name] = "created"
+    if wait and "created" in result.values():
+        run_query("CALL db.awaitIndexes($wait)", params={"wait": int(wait)})
+    return result
+
+
+@dataclass
+class QueryProfile:
+    """The plan of one query: its operators, rows and database hits, and what looks wrong in it."""
+
+    name: str
+    operators: List[str] = field(default_factory=list)
+    db_hits: int = 0
+    rows: int = 0
+    flags: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+# operators which read all nodes (of a label) instead of using an index
+_SCAN_OPERATORS = ("AllNodesScan", "NodeByLabelScan", "DirectedAllRelationshipsScan", "UndirectedAllRelationshipsScan")
+
+
+def _walk(plan: Dict) -> List[Dict]:
+    operators = [plan]
+    for child in plan.get("children") or []:
+        operators.extend(_walk(child))
+    return operators
+
+
+def analyze_plan(name: str, plan: Dict, max_db_hits: int = 10000, allowed: Tuple[str, ...] = ()) -> QueryProfile:
+    """Flag the label scans, cartesian products and a total of more than max_db_hits database hits
+    of the plan (a dict with operatorType, children and, for PROFILE, dbHits and rows)."""
+    profile = QueryProfile(name)
+    for operator in _walk(plan):
+        # the operator types have the runtime after @, for example NodeByLabelScan@neo4j
+        operator_type = operator.get("operatorType", "").split("@")[0]
+        profile.operators.append(operator_type)
+        profile.db_hits += operator.get("dbHits") or 0
+        if operator_type in _SCAN_OPERATORS and "scan" not in allowed:
+            details = (operator.get("args") or {}).get("Details", "")
+            profile.flags.append(f"{operator_type} {details}".strip())
+        if operator_type == "CartesianProduct" and "cartesian" not in allowed:
+            profile.flags.append("CartesianProduct")
+    profile.rows = plan.get("rows") or 0
+    if profile.db_hits > max_db_hits and "db_hits" not in allowed:
+        profile.flags.append(f"{profile.db_hits} db hits")
+    return profile
+
+
+def _embedding(dimension: int) -> List[float]:
+    # a fixed unit vector, the plans do not depend on the embedding and it does not need the API
+    vector = np.random.default_rng(0).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def registered_queries(dimension: int = DEFAULT_DIMENSION) -> List[Tuple[str, str, Dict, Tuple[str, ...]]]:
+    """The read queries of the repository as (name, query, parameters of a typical question, allowed flags)."""
+    embedding = _embedding(dimension)
+    bounds = {"low_bound_cosine": 0.85, "upper_bound_cosine": 0.92}
+    hybrid = hybrid_search_queries(embedding, "Google", candidates=20)
+    queries = [
+        (CANDIDATES_QUERY, {"index": "entity", "fulltextQuery": generate_full_text_query("Gogle"), "limit": 5}, ()),
+        (VECTOR_SEARCH_QUERY, {"index": "news", "k": 2, "embedding": embedding}, ()),
+        (VECTOR_RANGE_SEARCH_QUERY, {"index": "news", "candidates": 20, "embedding": embedding, **bounds}, ()),
+        (
+            BATCH_VECTOR_RANGE_SEARCH_QUERY,
+            {"index": "news", "topics": [{"topic": "t", "candidates": 20, "embedding": embedding}], **bounds},
+            (),
+        ),
+        # the exact search reads all chunks on purpose, it is the reference for the index
+        (BRUTE_FORCE_RANGE_SEARCH_QUERY, {"embedding": embedding, "k": 2, **bounds}, ("scan", "db_hits")),
+        (*hybrid["vector"], ()),
+        (*hybrid["fulltext"], ()),
+        (NEWS_BY_ORGANIZATION_QUERY, {"organization": "Google", "after": None, "k": 5}, ()),
+        (ORGANIZATIONS_BY_NUMBER_EMPLOYEES_QUERY, {"number_employees": 30000, "after": None, "k": 5}, ()),
+        (NUMBER_EMPLOYEES_QUERY, {"org_name": "Clarity Insights"}, ()),
+        (NEWS_BY_COUNTRY_QUERY, {"country_name": "Russia", "after": None, "k": 5}, ()),
+        (NEWS_BY_COUNTRY_TRAVERSAL_QUERY, {"country_name": "Russia", "after": None, "k": 5}, ()),
+        (GRAPH_VERSION_QUERY, {}, ()),
+    ]
+    return [
+        ("GRAPH_VERSION_QUERY" if query == GRAPH_VERSION_QUERY else query_name(query), query, params, allowed)
+        for query, params, allowed in queries
+    ]
+
+
+def _plan_to_dict(plan: Any) -> Dict:
+    """The plan of the driver (ProfiledPlan or Plan, or already a dict) as a dict."""
+    if isinstance(plan, dict):
+        return plan
+    result = {
+        "operatorType": plan.operator_type,
+        "args": dict(plan.arguments),
+        "children": [_plan_to_dict(child) for child in plan.children],
+    }
+    for attribute, key in (("db_hits", "dbHits"), ("rows", "rows")):
+        if hasattr(plan, attribute):
+            result[key] = getattr(plan, attribute)
+    return result
+
+
+def profile_queries(
+    run_plan: Callable[[str, Dict], Dict],
+    dimension: int = DEFAULT_DIMENSION,
+    explain: bool = False,
+    max_db_hits: int = 10000,
+) -> List[QueryProfile]:
+    """Run every registered query with PROFILE (or EXPLAIN) and analyze its plan.
+    run_plan(query, params) runs the query and returns the plan of its result summary."""
+    prefix = "EXPLAIN " if explain else "PROFILE "
+    profiles = []
+    for name, query, params, allowed in registered_queries(dimension):
+        try:
+            plan = _plan_to_dict(run_plan(prefix + query, params))
+        except Exception as e:
+            profiles.append(QueryProfile(name, error=str(e)))
+            continue
+        profiles.append(analyze_plan(name, plan, max_db_hits, allowed))
+    return profiles
+
+
+def graph_plan_runner(graph) -> Callable[[str, Dict], Dict]:
+    """run_plan for profile_queries with the driver of the Neo4jGraph object (its query() returns only the rows)."""
+
+    def run_plan(query: str, params: Dict) -> Dict:
+        with graph._driver.session(database=graph._database) as session:
+            summary = session.run(query, params).consume()
+            return summary.profile or summary.plan
+
+    return run_plan
+
+
+def vector_index_dimension(run_query: Callable[..., List[Dict]]) -> Optional[int]:
+    """The dimension of the existing news vector index, or None."""
+    return check_schema(run_query)["news"].get("dimension")
+
+
+def print_profiles(profiles: List[QueryProfile]):
+    for profile in profiles:
+        if profile.error:
+            print(f"{profile.name}: ERROR {profile.error}")
+            continue
+        status = "; ".join(profile.flags) if profile.flags else "ok"
+        print(f"{profile.name}: {profile.db_hits} db hits, {profile.rows} rows - {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["check", "apply", "profile"])
+    parser.add_argument("--dimension", type=int, help="of a new vector index (default: the existing one or 1536)")
+    parser.add_argument("--explain", action="store_true", help="only plan the queries, do not run them")
+    parser.add_argument("--max-db-hits", type=int, default=10000)
+    args = parser.parse_args()
+
+    from repository.graph_db import get_graph
+
+    graph = get_graph()
+    dimension = args.dimension or vector_index_dimension(graph.query) or DEFAULT_DIMENSION
+    if args.command == "check":
+        for name, status in check_schema(graph.query).items():
+            print(f"{name}: {status}")
+    elif args.command == "apply":
+        for name, status in apply_schema(graph.query, dimension).items():
+            print(f"{name}: {status}")
+    else:
+        profiles = profile_queries(graph_plan_runner(graph), dimension, args.explain, args.max_db_hits)
+        print_profiles(profiles)
+        if any(p.flags or p.error for p in profiles):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,35 @@
 import os
-from typing import Dict, List, Tuple
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
 
 from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
+from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
 from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
+from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+from langchain_core.agents import AgentAction, AgentFinish, AgentStep
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.utils.function_calling import convert_to_openai_function
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langchain_core.utils.function_calling import convert_to_openai_function, convert_to_openai_tool
 from langchain_openai import ChatOpenAI
 
+from repository.openai_gateway import GatewayChatModel
+from service.chat_history import ChatHistoryManager
+from service.speculation import current_speculation, speculate
 from service.agent_inputs_and_tools import (
     NewsToolTopic,
     NewsToolTopicFewShot,
+    NewsToolTopicsFewShot,
     NewsToolOrganization,
+    NewsToolHybrid,
     NewsToolGetOrganizationEmployees,
     NewsToolGetOrganizationsByEmployees,
     NewsToolByCountry,
+    NewsToolFetchMore,
 )
 
-# object to access the open AI LLM
-llm = ChatOpenAI(temperature=0, model="gpt-4-turbo", streaming=True)
-# creating list of the tools that we created, to provide it to the chatbot
-tools = [
-    NewsToolTopicFewShot(),
-    NewsToolOrganization(),
-    NewsToolGetOrganizationEmployees(),
-    NewsToolGetOrganizationsByEmployees(),
-    NewsToolByCountry(),
-]
-
-#adding the tools to the LLM object
-llm_with_tools = llm.bind(functions=[convert_to_openai_function(t) for t in tools])
-
 # Creating prompt for the chatbot to understand its role
 prompt = ChatPromptTemplate.from_messages(
     [
@@ -42,7 +40,8 @@ prompt = ChatPromptTemplate.from_messages(
             "make sure to ask the user for clarification. Make sure to include any "
             "available options that need to be clarified in the follow up questions. "
             "Do only the things the user specifically requested. Return the responses as "
-            "provided by the database.",
+            "provided by the database. If the question needs several tools which do not depend on "
+            "each other, call them all at once.",
         ),
         # keeping the chat history from the user
         MessagesPlaceholder(variable_name="chat_history"),
@@ -52,33 +51,162 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
+# keeps the last messages of the conversation within a token budget and summarizes the older ones
+chat_history_manager = ChatHistoryManager()
+
+
 # creating the format that the openAI uses to understand chatting history
-def _format_chat_history(chat_history: List[Tuple[str, str]]):
-    buffer = []
-    for line in chat_history:
-        if line["role"] == "user":
-            buffer.append(HumanMessage(content=line["content"]))
-        if line["role"] == "assistant":
-            buffer.append(AIMessage(content=line["content"]))
-    return buffer
-
-
-# Create agent object as chain.
-agent = (
-    # Define that when this object is called we need to provide input as "input", chat history as "chat_history".
-    {
-        "input": lambda x: x["input"],
-        "chat_history": lambda x: (
-            _format_chat_history(x["chat_history"]) if x.get("chat_history") else []
-        ),
-        "agent_scratchpad": lambda x: format_to_openai_function_messages(x["intermediate_steps"]),
-    }
-    # Add the prompt to it
-    | prompt
-    # Add the LLM with the tools
-    | llm_with_tools
-    # USe parser so the chatbot will know how to print the output
-    | OpenAIFunctionsAgentOutputParser()
-)
+def _format_chat_history(chat_history: List[Dict[str, str]], current_input: Optional[str] = None):
+    return chat_history_manager.format(chat_history, current_input)
+
+
+# Limits of one answer: the number of LLM steps (every step runs the tools of one LLM response) and the
+# seconds, after which the agent stops and answers that it could not finish.
+MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "6"))
+MAX_EXECUTION_TIME = float(os.getenv("AGENT_MAX_EXECUTION_TIME", "60"))
+# how many tools of one LLM response run at the same time in the sync agent
+MAX_PARALLEL_TOOLS = int(os.getenv("AGENT_MAX_PARALLEL_TOOLS", "4"))
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """Agent executor which runs the tool calls of one LLM response at the same time.
+
+    The async run (astream_events, which the chat service uses) already awaits all tool calls of a step
+    together; this runs them on a thread pool in the sync run (invoke) too. The results are added to the
+    scratchpad in the order of the calls.
+    """
+
+    max_parallel_tools: int = MAX_PARALLEL_TOOLS
+
+    def _iter_next_step(
+        self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None
+    ) -> Iterator[Union[AgentFinish, AgentAction, AgentStep]]:
+        if self.handle_parsing_errors:
+            # the base class answers the parsing errors to the LLM, and runs the tools one after the other
+            yield from super()._iter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+            )
+            return
+        intermediate_steps = self._prepare_intermediate_steps(intermediate_steps)
+        output = self.agent.plan(
+            intermediate_steps, callbacks=run_manager.get_child() if run_manager else None, **inputs
+        )
+        if isinstance(output, AgentFinish):
+            yield output
+            return
+        actions = [output] if isinstance(output, AgentAction) else output
+        yield from actions
+
+        def perform(action: AgentAction) -> AgentStep:
+            return self._perform_agent_action(name_to_tool_map, color_mapping, action, run_manager)
+
+        if len(actions) == 1:
+            yield perform(actions[0])
+            return
+        # the context (the current span) is copied to the threads
+        with ContextThreadPoolExecutor(max_workers=min(len(actions), self.max_parallel_tools)) as pool:
+            yield from pool.map(perform, actions)
+
+    async def astream(
+        self, input: Union[Dict[str, Any], Any], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """The async run (astream_events runs it too) with the speculative stage: the lookups which the tools
+        will likely need for the question start together with the first LLM call (see service/speculation.py)."""
+        question = input.get("input") if isinstance(input, dict) else None
+        with speculate(question):
+            async for chunk in super().astream(input, config, **kwargs):
+                yield chunk
+
+
+def _settle_speculation(output):
+    # the first LLM response chose the tools, the prefetches which none of them needs are cancelled
+    speculation = current_speculation()
+    if speculation is not None:
+        speculation.settle(output)
+    return output
+
+
+async def _asettle_speculation(output):
+    return _settle_speculation(output)
+
+
+# The LLM, the tools and the agent are created on the first use and shared by the whole process,
+# so importing this module is cheap and does not need the network.
+_agent_executor: Optional[AgentExecutor] = None
+_lock = threading.Lock()
+
+
+def create_agent_executor(llm: Optional[BaseChatModel] = None, parallel_tool_calls: bool = True) -> AgentExecutor:
+    """Create the agent with its tools. By default with the OpenAI LLM, benchmarks give a local stand-in.
+
+    With parallel_tool_calls the LLM can call several tools in one response (the tools API), otherwise
+    one function per response (the legacy functions API, which needs an LLM round trip for every tool).
+    """
+    # object to access the open AI LLM
+    if llm is None:
+        # the calls of all sessions are rate limited together, and the 429s are retried by the gateway
+        llm = GatewayChatModel(inner=ChatOpenAI(temperature=0, model="gpt-4-turbo", streaming=True, max_retries=0))
+    # creating list of the tools that we created, to provide it to the chatbot
+    tools = [
+        NewsToolTopicFewShot(),
+        NewsToolTopicsFewShot(),
+        NewsToolOrganization(),
+        NewsToolHybrid(),
+        NewsToolGetOrganizationEmployees(),
+        NewsToolGetOrganizationsByEmployees(),
+        NewsToolByCountry(),
+        NewsToolFetchMore(),
+    ]
+
+    #adding the tools to the LLM object
+    if parallel_tool_calls:
+        llm_with_tools = llm.bind(tools=[convert_to_openai_tool(t) for t in tools])
+        format_scratchpad, output_parser = format_to_openai_tool_messages, OpenAIToolsAgentOutputParser()
+    else:
+        llm_with_tools = llm.bind(functions=[convert_to_openai_function(t) for t in tools])
+        format_scratchpad, output_parser = format_to_openai_function_messages, OpenAIFunctionsAgentOutputParser()
+
+    # Create agent object as chain.
+    agent = (
+        # Define that when this object is called we need to provide input as "input", chat history as "chat_history".
+        {
+            "input": lambda x: x["input"],
+            "chat_history": lambda x: (
+                _format_chat_history(x["chat_history"], x["input"]) if x.get("chat_history") else []
+            ),
+            "agent_scratchpad": lambda x: format_scratchpad(x["intermediate_steps"]),
+        }
+        # Add the prompt to it
+        | prompt
+        # Add the LLM with the tools
+        | llm_with_tools
+        # USe parser so the chatbot will know how to print the output
+        | output_parser
+        # stop the speculative work which the chosen tools do not need
+        | RunnableLambda(_settle_speculation, afunc=_asettle_speculation)
+    )
+
+    return ParallelAgentExecutor(
+        agent=agent,
+        tools=tools,
+        max_iterations=MAX_ITERATIONS,
+        max_execution_time=MAX_EXECUTION_TIME,
+        early_stopping_method="force",
+    )
+
+
+def get_agent_executor() -> AgentExecutor:
+    """The agent executor of the process, created on the first call."""
+    global _agent_executor
+    if _agent_executor is None:
+        with _lock:
+            if _agent_executor is None:
+                _agent_executor = create_agent_executor()
+    return _agent_executor
+
 
-agent_executor = AgentExecutor(agent=agent, tools=tools)
+def __getattr__(name: str):
+    # the old module attribute agent_executor still works, and creates the agent on first use
+    if name == "agent_executor":
+        return get_agent_executor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,5 @@
-from typing import Optional, Type
+import logging
+from typing import List, Optional, Type
 from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import BaseTool
 from langchain.callbacks.manager import CallbackManagerForToolRun
@@ -7,16 +8,39 @@ from repository.queries import (
     search_news_by_topic,
     search_by_organization,
     filter_news_by_topic_with_score,
+    filter_news_by_topics_with_score,
     get_number_employees,
     filter_by_number_employees,
-    filter_by_country,
+    find_country,
+    iter_news_by_country,
+    hybrid_search,
 )
+from repository.async_queries import (
+    asearch_news_by_topic,
+    asearch_by_organization,
+    afilter_news_by_topic_with_score,
+    afilter_news_by_topics_with_score,
+    aget_number_employees,
+    afilter_by_number_employees,
+    afind_country,
+    aiter_news_by_country,
+    ahybrid_search,
+)
+from service.speculation import COUNTRY, EMPLOYEES, ORGANIZATION, TOPIC, aclaim
+from service.tool_paging import page_result, apage_result, fetch_more, afetch_more
+from service.tool_output import format_tool_result
+
+logger = logging.getLogger(__name__)
 
 
 fewshot_examples_topic = """{Input:What are the health benefits for employees in the news? Topic: Health benefits}
 {Input: Are there any news about new products? Topic: new products}
 """
 
+fewshot_examples_topics = """{Input:What are the news about health benefits and remote work? Topics: [Health benefits, remote work]}
+{Input: Are there any news about new products or layoffs? Topics: [new products, layoffs]}
+"""
+
 fewshot_examples = """{Input:What are the health benefits for Google employees in the news? Topic: Health benefits}
 {Input: What is the latest positive news about Google? Topic: None}
 {Input: Are there any news about VertexAI regarding Google? Topic: VertexAI}
@@ -24,6 +48,42 @@ fewshot_examples = """{Input:What are the health benefits for Google employees i
 """
 
 
+# the rows of the paged results without the keys of the pagination (decreasing the input tokens to GPT)
+def _chunk_text(row: dict) -> str:
+    return row["chunk_text"]
+
+
+def _without_id(row: dict) -> dict:
+    return {key: value for key, value in row.items() if key != "id"}
+
+
+def _paged(result, k: int, format_row=_chunk_text, message: Optional[str] = None):
+    # a string is a message for the chatbot (for example more candidates for the organization)
+    if isinstance(result, str):
+        return result
+    return page_result(result, format_row, message, max_items=k)
+
+
+async def _apaged(result, k: int, format_row=_chunk_text, message: Optional[str] = None):
+    if isinstance(result, str):
+        return result
+    return await apage_result(result, format_row, message, max_items=k)
+
+
+# the messages of the country tool name the country found in the database, not the one written by the user
+def _country_message(country: str) -> str:
+    return f"Here are article summaries for organizations in {country}"
+
+
+def _country_result(result: dict, country: str) -> dict:
+    if not result["results"]:
+        result["message"] = (
+            f"There are no articles about organizations in {country}. If this is not the country the user "
+            "meant, the country was not found in the database."
+        )
+    return result
+
+
 # langchain standard for creating Input and Tools, for the chatbot to call them
 class NewsInputTopic(BaseModel):
     # define the input, in this case it is topic, and create description which will be used by the chatbot.
@@ -41,6 +101,14 @@ class NewsInputTopicFewShot(BaseModel):
     )
 
 
+class NewsInputTopicsFewShot(BaseModel):
+    # define the input, in this case it is a list of topics, so all of them are searched with one call of the tool.
+    topics: List[str] = Field(
+        description="All topics that the user wants to find information for, when there is more than one. "
+        "Here are some examples: " + fewshot_examples_topics
+    )
+
+
 class NewsInputOrganization(BaseModel):
     # define the input, in this case it is organization, and create description which will be used by the chatbot.
     organization: Optional[str] = Field(
@@ -48,6 +116,17 @@ class NewsInputOrganization(BaseModel):
     )
 
 
+class NewsInputHybrid(BaseModel):
+    # define the inputs, in this case topic and organization, both are searched with one call of the tool.
+    topic: Optional[str] = Field(
+        description="Any particular topic that the user wants to finds information for. Here are some examples: "
+        + fewshot_examples
+    )
+    organization: Optional[str] = Field(
+        description="Organization that the user wants to find information about."
+    )
+
+
 class NewsInputGetOrganizationEmployees(BaseModel):
     # define the input, in this case it is organization, and create description which will be used by the chatbot.
     organization: Optional[str] = Field(
@@ -63,6 +142,13 @@ class NewsInputFilterOrganizationsByEmployees(BaseModel):
     )
 
 
+class NewsInputFetchMore(BaseModel):
+    # define the input, in this case it is the cursor returned by another tool.
+    cursor: str = Field(
+        description="The next_cursor value from the previous result of a news tool."
+    )
+
+
 class NewsInputFilterByCountry(BaseModel):
     # define the input, in this case it is  country name, and create description which will be used by the chatbot.
     country_name: Optional[str] = Field(
@@ -84,15 +170,15 @@ class NewsToolTopic(BaseTool):
         self, topic: Optional[str] = None, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use the tool."""
-        print("Topic extracted:", topic)
-        return search_news_by_topic(topic)
-    # running in asynchronously -> not using in our usecase
+        logger.debug("Topic extracted: %s", topic)
+        return format_tool_result(self.name, search_news_by_topic(topic))
+    # running asynchronously -> awaits the async repository functions, so it does not block the event loop
     async def _arun(
         self, topic: Optional[str] = None, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use the tool asynchronously."""
-        print("Topic extracted:", topic)
-        return search_news_by_topic(topic)
+        logger.debug("Topic extracted: %s", topic)
+        return format_tool_result(self.name, await asearch_news_by_topic(topic))
 
 
 class NewsToolTopicFewShot(BaseTool):
@@ -105,15 +191,44 @@ class NewsToolTopicFewShot(BaseTool):
         self, topic: Optional[str] = None, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use the tool."""
-        print("Topic extracted:", topic)
-        return filter_news_by_topic_with_score(topic, 0.85, 0.92)
+        logger.debug("Topic extracted: %s", topic)
+        results = _paged(filter_news_by_topic_with_score(topic, 0.85, 0.92, lazy=True), 2)
+        return format_tool_result(self.name, results)
 
     async def _arun(
         self, topic: Optional[str] = None, run_manager: Optional[CallbackManagerForToolRun] = None
     ) -> str:
         """Use the tool asynchronously."""
-        print("Topic extracted:", topic)
-        return filter_news_by_topic_with_score(topic, 0.85, 0.92)
+        logger.debug("Topic extracted: %s", topic)
+        # the embedding of the topic, if it was prefetched while the LLM chose the tool
+        topic_embedding = await aclaim(TOPIC, topic)
+        rows = await afilter_news_by_topic_with_score(topic, 0.85, 0.92, lazy=True, topic_embedding=topic_embedding)
+        results = await _apaged(rows, 2)
+        return format_tool_result(self.name, results)
+
+
+class NewsToolTopicsFewShot(BaseTool):
+    # the name of the function cannot contain empty spaces
+    name = "NewsInformationTopicsFewShot"
+    description = (
+        "Useful for finding relevant news information on several topics specified by the user at once. "
+        "Use it instead of calling NewsInformationTopicFewShot for every topic."
+    )
+    args_schema: Type[BaseModel] = NewsInputTopicsFewShot
+
+    def _run(
+        self, topics: List[str], run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool."""
+        logger.debug("Topics extracted: %s", topics)
+        return format_tool_result(self.name, filter_news_by_topics_with_score(topics, 0.85, 0.92))
+
+    async def _arun(
+        self, topics: List[str], run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool asynchronously."""
+        logger.debug("Topics extracted: %s", topics)
+        return format_tool_result(self.name, await afilter_news_by_topics_with_score(topics, 0.85, 0.92))
 
 
 class NewsToolOrganization(BaseTool):
@@ -130,8 +245,8 @@ class NewsToolOrganization(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool."""
-        print("Organization extracted:", organization)
-        return search_by_organization(organization)
+        logger.debug("Organization extracted: %s", organization)
+        return format_tool_result(self.name, _paged(search_by_organization(organization, lazy=True), 2))
 
     async def _arun(
         self,
@@ -139,8 +254,47 @@ class NewsToolOrganization(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        print("Organization extracted:", organization)
-        return search_by_organization(organization)
+        logger.debug("Organization extracted: %s", organization)
+        # wait for the prefetch of the organization, its first page is then in the result cache
+        await aclaim(ORGANIZATION, organization)
+        results = await _apaged(await asearch_by_organization(organization, lazy=True), 2)
+        return format_tool_result(self.name, results)
+
+
+class NewsToolHybrid(BaseTool):
+    # the name of the function cannot contain empty spaces
+    name = "NewsInformationHybrid"
+    description = (
+        "Useful for finding relevant news information about a topic for an organization specified by the user, "
+        "for example news about new products of Google. It searches by topic and by organization at once."
+    )
+    args_schema: Type[BaseModel] = NewsInputHybrid
+
+    def _run(
+        self,
+        topic: Optional[str] = None,
+        organization: Optional[str] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool."""
+        logger.debug("Topic and organization extracted: %s, %s", topic, organization)
+        results = hybrid_search(topic, organization)["results"]
+        # the scores and the sources are not needed by the chatbot (decreasing the input tokens to GPT)
+        results = [{"title": r["title"], "chunk_text": r["chunk_text"]} for r in results]
+        return format_tool_result(self.name, results)
+
+    async def _arun(
+        self,
+        topic: Optional[str] = None,
+        organization: Optional[str] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool asynchronously."""
+        logger.debug("Topic and organization extracted: %s, %s", topic, organization)
+        topic_embedding = await aclaim(TOPIC, topic or organization)
+        results = (await ahybrid_search(topic, organization, topic_embedding=topic_embedding))["results"]
+        results = [{"title": r["title"], "chunk_text": r["chunk_text"]} for r in results]
+        return format_tool_result(self.name, results)
 
 
 class NewsToolGetOrganizationEmployees(BaseTool):
@@ -155,8 +309,8 @@ class NewsToolGetOrganizationEmployees(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool."""
-        print("Organization extracted:", organization)
-        return get_number_employees(organization)
+        logger.debug("Organization extracted: %s", organization)
+        return format_tool_result(self.name, get_number_employees(organization))
 
     async def _arun(
         self,
@@ -164,8 +318,9 @@ class NewsToolGetOrganizationEmployees(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        print("Organization extracted:", organization)
-        return get_number_employees(organization)
+        logger.debug("Organization extracted: %s", organization)
+        await aclaim(EMPLOYEES, organization)
+        return format_tool_result(self.name, await aget_number_employees(organization))
 
 
 class NewsToolGetOrganizationsByEmployees(BaseTool):
@@ -180,8 +335,9 @@ class NewsToolGetOrganizationsByEmployees(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool."""
-        print("Number extracted:", number_employees)
-        return filter_by_number_employees(number_employees)
+        logger.debug("Number extracted: %s", number_employees)
+        results = _paged(filter_by_number_employees(number_employees, lazy=True), 5, _without_id)
+        return format_tool_result(self.name, results)
 
     async def _arun(
         self,
@@ -189,8 +345,9 @@ class NewsToolGetOrganizationsByEmployees(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        print("Number extracted:", number_employees)
-        return filter_by_number_employees(number_employees)
+        logger.debug("Number extracted: %s", number_employees)
+        results = await _apaged(await afilter_by_number_employees(number_employees, lazy=True), 5, _without_id)
+        return format_tool_result(self.name, results)
 
 
 class NewsToolByCountry(BaseTool):
@@ -205,8 +362,13 @@ class NewsToolByCountry(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool."""
-        print("country extracted:", country_name)
-        return filter_by_country(country_name)
+        logger.debug("Country extracted: %s", country_name)
+        found, countries = find_country(country_name)
+        if not found:
+            # the country is not known or there are more candidates, the message says it
+            return format_tool_result(self.name, countries)
+        results = _paged(iter_news_by_country(countries[0]), 5, _without_id, _country_message(countries[0]))
+        return format_tool_result(self.name, _country_result(results, countries[0]))
 
     async def _arun(
         self,
@@ -214,5 +376,31 @@ class NewsToolByCountry(BaseTool):
         run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        print("country extracted:", country_name)
-        return filter_by_country(country_name)
+        logger.debug("Country extracted: %s", country_name)
+        await aclaim(COUNTRY, country_name)
+        found, countries = await afind_country(country_name)
+        if not found:
+            return format_tool_result(self.name, countries)
+        rows = aiter_news_by_country(countries[0])
+        results = await _apaged(rows, 5, _without_id, _country_message(countries[0]))
+        return format_tool_result(self.name, _country_result(results, countries[0]))
+
+
+class NewsToolFetchMore(BaseTool):
+    # the name of the function cannot contain empty spaces
+    name = "NewsInformationFetchMore"
+    description = (
+        "Useful when a previous result of a news tool has next_cursor and the user wants more results, "
+        "or the results so far are not enough to answer."
+    )
+    args_schema: Type[BaseModel] = NewsInputFetchMore
+
+    def _run(self, cursor: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Use the tool."""
+        logger.debug("Cursor extracted: %s", cursor)
+        return format_tool_result(self.name, fetch_more(cursor))
+
+    async def _arun(self, cursor: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Use the tool asynchronously."""
+        logger.debug("Cursor extracted: %s", cursor)
+        return format_tool_result(self.name, await afetch_more(cursor))
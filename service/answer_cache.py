@@ -0,0 +1,230 @@
+"""Cache of whole answers for questions which were already asked with other words.
+
+The question is embedded and compared with the questions answered before in the same chat context (the
+last messages before the question, so "and their employees?" after different questions is not the same
+question). If the most similar one is similar enough, its answer is returned without running the agent.
+The numbers and the names in the two questions have to be the same too: "employees of Google" and
+"employees of Microsoft", or "news from 2023" and "news from 2024", are very similar as embeddings, but
+they have other answers.
+The answers expire after a time to live, and when the data in the graph changes (see data_version.py).
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from repository.data_version import get_data_version, poll_graph_version
+from repository.embedding_cache import normalize_text, query_vector
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+# words with a capital letter or a digit, the names of organizations, countries, products
+_NAME = re.compile(r"\b\w*[A-Z0-9]\w*\b")
+_SENTENCE_START = re.compile(r"(?:^|[.?!]\s+)(\w+)")
+# words which start the questions, they are capitalized but they are not names
+_QUESTION_WORDS = {
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how", "are", "is", "was", "were", "do",
+    "does", "did", "can", "could", "provide", "show", "tell", "give", "find", "list", "any", "the", "a", "an",
+    "i", "in", "and", "please", "latest", "news",
+}
+
+
+def key_terms(question: str) -> FrozenSet[str]:
+    """The numbers and the names of the question, which have to be the same for a cache hit."""
+    numbers = set(_NUMBER.findall(question))
+    starts = {m.start(1) for m in _SENTENCE_START.finditer(question)}
+    names = {
+        m.group().casefold()
+        for m in _NAME.finditer(question)
+        if not _NUMBER.fullmatch(m.group()) and not (m.start() in starts and m.group().lower() in _QUESTION_WORDS)
+    }
+    return frozenset(numbers | names)
+
+
+@dataclass
+class _Partition:
+    """The cached questions of one chat context: their normalized embeddings as rows of a matrix."""
+
+    vectors: np.ndarray
+    answers: List[str] = field(default_factory=list)
+    questions: List[str] = field(default_factory=list)
+    terms: List[FrozenSet[str]] = field(default_factory=list)
+    # when every answer was stored (time.monotonic()) and for which data version
+    created: List[float] = field(default_factory=list)
+    versions: List[int] = field(default_factory=list)
+
+
+class SemanticAnswerCache:
+    """Answers by the similarity of the question embeddings, in memory.
+
+    Only the answers calculated for the current data version and younger than ttl seconds are returned.
+    At most max_entries answers are kept, the oldest are removed first.
+    """
+
+    def __init__(
+        self,
+        embeddings: Optional[Embeddings] = None,
+        threshold: Optional[float] = None,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        context_messages: int = 2,
+        run_query: Optional[Callable[..., List[Dict]]] = None,
+    ):
+        self._embeddings = embeddings
+        # executes a Cypher query, like graph.query, to read the data version of the graph
+        self._run_query = run_query
+        self.threshold = threshold or float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))
+        self.ttl = ttl or float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+        self.context_messages = context_messages
+        self._partitions: Dict[str, _Partition] = {}
+        self._entries = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stale = 0
+        self.different_terms = 0
+        self.stored = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            from repository.graph_db import get_embeddings
+
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    def context_fingerprint(self, chat_history: List[Dict[str, str]]) -> str:
+        """Hash of the last context_messages messages before the question."""
+        recent = chat_history[-self.context_messages:] if self.context_messages else []
+        text = "\0".join(f"{m['role']}:{normalize_text(m['content']).lower()}" for m in recent)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _embed(self, question: str) -> np.ndarray:
+        # the array of the embedding cache, the division makes a new one
+        vector = query_vector(self.embeddings, normalize_text(question).lower())
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _check_data_version(self):
+        # another process may have changed the data, check it from time to time
+        if self._run_query is None:
+            from repository.graph_db import get_graph
+
+            self._run_query = get_graph().query
+        poll_graph_version(self._run_query)
+
+    def lookup(self, question: str, chat_history: List[Dict[str, str]]) -> Optional[str]:
+        """The cached answer of a similar question in the same chat context, or None."""
+        if self.max_entries <= 0:
+            return None
+        self._check_data_version()
+        vector = self._embed(question)
+        terms = key_terms(question)
+        fingerprint = self.context_fingerprint(chat_history)
+        with self._lock:
+            self.lookups += 1
+            partition = self._partitions.get(fingerprint)
+            if partition is None or not partition.answers:
+                return None
+            similarities = partition.vectors @ vector
+            # the most similar question with the same numbers and names
+            similar = np.nonzero(similarities >= self.threshold)[0]
+            similar = similar[np.argsort(-similarities[similar])]
+            best = next((int(i) for i in similar if partition.terms[i] == terms), None)
+            if best is None:
+                if len(similar):
+                    self.different_terms += 1
+                return None
+            if (
+                time.monotonic() - partition.created[best] > self.ttl
+                or partition.versions[best] != get_data_version()
+            ):
+                self.stale += 1
+                self._remove(fingerprint, best)
+                return None
+            self.hits += 1
+            logger.info(
+                "Answer cache hit: %r ~ %r (%.3f)", question, partition.questions[best], similarities[best]
+            )
+            return partition.answers[best]
+
+    def store(self, question: str, chat_history: List[Dict[str, str]], answer: str):
+        """Remember the answer of the question in the chat context."""
+        if self.max_entries <= 0 or not answer.strip():
+            return
+        vector = self._embed(question)
+        fingerprint = self.context_fingerprint(chat_history)
+        with self._lock:
+            partition = self._partitions.get(fingerprint)
+            if partition is None:
+                partition = self._partitions[fingerprint] = _Partition(np.zeros((0, len(vector)), dtype=np.float32))
+            partition.vectors = np.vstack([partition.vectors, vector[None, :]])
+            partition.answers.append(answer)
+            partition.questions.append(question)
+            partition.terms.append(key_terms(question))
+            partition.created.append(time.monotonic())
+            partition.versions.append(get_data_version())
+            self._entries += 1
+            self.stored += 1
+            while self._entries > self.max_entries:
+                self._remove_oldest()
+
+    def _remove(self, fingerprint: str, index: int):
+        # called with the lock acquired
+        partition = self._partitions[fingerprint]
+        partition.vectors = np.delete(partition.vectors, index, axis=0)
+        for values in (partition.answers, partition.questions, partition.terms, partition.created, partition.versions):
+            del values[index]
+        self._entries -= 1
+        if not partition.answers:
+            del self._partitions[fingerprint]
+
+    def _remove_oldest(self):
+        fingerprint = min(self._partitions, key=lambda f: self._partitions[f].created[0])
+        self._remove(fingerprint, 0)
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._entries = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "entries": self._entries,
+                "contexts": len(self._partitions),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "stale": self.stale,
+                "different_terms": self.different_terms,
+                "stored": self.stored,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """The answer cache of the process. ANSWER_CACHE_MAX_ENTRIES=0 disables it."""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache()
+    return _answer_cache
+
+
+def set_answer_cache(cache: Optional[SemanticAnswerCache]):
+    """Replace the answer cache, for example with one that uses fake embeddings in benchmarks."""
+    global _answer_cache
+    _answer_cache = cache
@@ -0,0 +1,160 @@
+"""Chat history for the agent prompt: a sliding window of the last messages within a token budget,
+and a running summary of the older messages."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import tiktoken
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# the tokenizer of gpt-4-turbo, loaded on the first use (tiktoken downloads it the first time)
+_encoding = None
+# every message in the prompt has a few tokens for the role and the separators
+_TOKENS_PER_MESSAGE = 4
+
+
+def get_encoding() -> tiktoken.Encoding:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Number of tokens of the text for the OpenAI chat models."""
+    return len(get_encoding().encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The beginning of the text with at most max_tokens tokens, cut at a token boundary."""
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoding().decode(tokens[:max_tokens])
+
+
+class ChatHistoryManager:
+    """Convert the chat history from the page to LangChain messages for the prompt.
+
+    Only the last messages which fit in max_tokens are sent as they are, the older messages are
+    replaced with a summary. The window moves in blocks of summary_block messages, so the summary
+    is updated (one LLM call) only every few turns and not on every turn. The converted messages
+    and the summaries are cached, so every turn converts only the new messages.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        summary_block: int = 6,
+        llm: Optional[BaseChatModel] = None,
+        max_cached_items: int = 2000,
+    ):
+        self.max_tokens = max_tokens
+        self.summary_block = summary_block
+        self._llm = llm
+        self.max_cached_items = max_cached_items
+        self._messages: "OrderedDict[tuple, BaseMessage]" = OrderedDict()
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def llm(self) -> BaseChatModel:
+        # created only when the first summary is needed
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+
+            from repository.openai_gateway import GatewayChatModel, get_summary_limiter
+
+            # rate limited like the agent model (with the limits of its own model), the gateway retries the 429s
+            self._llm = GatewayChatModel(
+                inner=ChatOpenAI(
+                    temperature=0, model=os.getenv("CHAT_SUMMARY_MODEL", "gpt-3.5-turbo"), max_retries=0
+                ),
+                limiter=get_summary_limiter(),
+                streaming=False,
+            )
+        return self._llm
+
+    def _cache(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_cached_items:
+                cache.popitem(last=False)
+
+    def _message(self, line: Dict[str, str]) -> Optional[BaseMessage]:
+        key = (line["role"], line["content"])
+        message = self._messages.get(key)
+        if message is None:
+            if line["role"] == "user":
+                message = HumanMessage(content=line["content"])
+            elif line["role"] == "assistant":
+                message = AIMessage(content=line["content"])
+            else:
+                return None
+            self._cache(self._messages, key, message)
+        return message
+
+    def _summarize(self, older: List[Dict[str, str]]) -> str:
+        """Summary of the older messages. The summary of every prefix is cached by the hash of the messages,
+        so only the messages after the last summarized prefix are sent to the LLM."""
+        hashes = []
+        running = hashlib.sha256()
+        for line in older:
+            running.update(f"{line['role']}\0{line['content']}\0".encode("utf-8"))
+            hashes.append(running.hexdigest())
+        if hashes[-1] in self._summaries:
+            return self._summaries[hashes[-1]]
+
+        # find the longest prefix that is already summarized
+        summary, start = "", 0
+        for i in range(len(hashes) - 1, -1, -1):
+            if hashes[i] in self._summaries:
+                summary, start = self._summaries[hashes[i]], i + 1
+                break
+        new_lines = "\n".join(f"{line['role']}: {line['content']}" for line in older[start:])
+        summary = self.llm.invoke(
+            "Update the summary of the conversation between a user and a news assistant with the new messages. "
+            "Keep the organizations, countries, topics and numbers that were mentioned. "
+            "Answer only with the summary.\n\n"
+            f"Summary:\n{summary or 'None'}\n\nNew messages:\n{new_lines}",
+            # without the callbacks of the agent run, so the summary is not streamed to the user as the answer
+            config={"callbacks": []},
+        ).content
+        self._cache(self._summaries, hashes[-1], summary)
+        return summary
+
+    def format(self, chat_history: List[Dict[str, str]], current_input: Optional[str] = None) -> List[BaseMessage]:
+        """Convert the chat history to messages for the prompt."""
+        history = [line for line in chat_history if line["role"] in ("user", "assistant")]
+        # the page adds the current question to the history before calling the agent,
+        # but the prompt has it already as input
+        if current_input is not None and history and history[-1]["role"] == "user" \
+                and history[-1]["content"] == current_input:
+            history = history[:-1]
+
+        # from the newest message back, keep the messages that fit in the budget
+        tokens = 0
+        cut = len(history)
+        while cut > 0:
+            message_tokens = count_tokens(history[cut - 1]["content"]) + _TOKENS_PER_MESSAGE
+            if tokens + message_tokens > self.max_tokens:
+                break
+            tokens += message_tokens
+            cut -= 1
+        # move the cut to the end of the block, so the summary changes only once per block
+        if cut > 0:
+            cut = min(len(history), -(-cut // self.summary_block) * self.summary_block)
+
+        messages = []
+        if cut > 0:
+            messages.append(
+                SystemMessage(content=f"Summary of the earlier conversation: {self._summarize(history[:cut])}")
+            )
+        messages.extend(self._message(line) for line in history[cut:])
+        return messages
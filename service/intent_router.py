@@ -0,0 +1,191 @@
+"""Fast path for the structured questions, without the LLM agent.
+
+Questions like "How many employees has Clarity Insights?" or "Which organizations have over 30000 employees?"
+need exactly one repository function, and the agent would spend one LLM call to choose it and one more to
+phrase its result. The router matches the whole question against the templates of these questions, takes
+the organization or the number from it, calls the repository function and answers from a template.
+
+It only answers when it is sure: the whole question has to match a template, the organization has to be
+resolved to exactly one organization, and the result has to be there. Everything else (other questions,
+follow-ups like "how many employees does it have?", ambiguous or unknown organizations, for which the agent
+asks the user) is answered by the agent.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from observability.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# words which refer to the chat history, the question is a follow-up for the agent
+_REFERENCES = {"it", "its", "they", "them", "their", "this", "that", "these", "those", "he", "she", "him", "her"}
+
+
+@dataclass
+class Intent:
+    """A template of a question: the patterns of the whole question and the function which answers it
+    from the named groups of the pattern, or returns None when the agent should answer instead."""
+
+    name: str
+    patterns: Tuple[re.Pattern, ...]
+    answer: Callable[..., Optional[str]]
+
+
+# a whole number, or one with the same thousands separator between all groups of three digits ("30,000")
+_WHOLE_NUMBER = re.compile(r"\d+|\d{1,3}(?P<separator>[,.\s])\d{3}(?:(?P=separator)\d{3})*")
+
+
+def _number(value: str) -> Optional[int]:
+    """The number, or None if it is not a whole number ("1.5")."""
+    value = value.strip()
+    if not _WHOLE_NUMBER.fullmatch(value):
+        return None
+    return int(re.sub(r"[,.\s]", "", value))
+
+
+def _answer_number_employees(organization: str) -> Optional[str]:
+    from repository.queries import find_organization, number_employees_of
+
+    found, candidates = find_organization(organization)
+    if not found:
+        # unknown or ambiguous organization, the agent asks the user
+        return None
+    # the name is resolved, get_number_employees would resolve it again
+    results = number_employees_of(candidates[0])
+    if not isinstance(results, list) or not results or results[0].get("number_employees") is None:
+        return None
+    return f"{candidates[0]} has {results[0]['number_employees']:,} employees."
+
+
+def _answer_organizations_by_employees(number_employees: str, k: int = 5) -> Optional[str]:
+    from repository.queries import filter_by_number_employees
+
+    number = _number(number_employees)
+    if number is None:
+        return None
+    results = filter_by_number_employees(number, k)
+    if not isinstance(results, list):
+        return None
+    if not results:
+        return f"There are no organizations with at least {number:,} employees in the database."
+    lines = [f"- {r['organization_name']}: {r['number_employees']:,} employees" for r in results]
+    more = " (the biggest ones)" if len(results) == k else ""
+    return f"These organizations have at least {number:,} employees{more}:\n" + "\n".join(lines)
+
+
+_ORGANIZATION = r"(?P<organization>[\w&.,'\- ]+?)"
+_NUMBER = r"(?P<number_employees>\d[\d,. ]*)"
+
+INTENTS = (
+    Intent(
+        "number_employees",
+        (
+            re.compile(rf"how many employees (?:has|does) {_ORGANIZATION}(?: have)?\s*\??", re.I),
+            re.compile(rf"what is the number of employees (?:of|for|at) {_ORGANIZATION}\s*\??", re.I),
+            re.compile(rf"how many people work (?:at|for|in) {_ORGANIZATION}\s*\??", re.I),
+        ),
+        _answer_number_employees,
+    ),
+    Intent(
+        "organizations_by_employees",
+        (
+            re.compile(
+                rf"(?:which|what) (?:organizations|companies) have (?:over|more than|at least|above) {_NUMBER}"
+                rf" employees\s*\??",
+                re.I,
+            ),
+        ),
+        _answer_organizations_by_employees,
+    ),
+)
+
+
+class IntentRouter:
+    """Answers the questions which match one of the intents, counts how many it answered (the bypass rate)
+    and how long it took. INTENT_ROUTER_ENABLED=0 sends all questions to the agent."""
+
+    def __init__(self, intents=INTENTS, enabled: Optional[bool] = None):
+        self.intents = intents
+        self.enabled = enabled if enabled is not None else os.getenv("INTENT_ROUTER_ENABLED", "1") != "0"
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.routed = 0
+        self.fallbacks = 0
+        self.routed_seconds = 0.0
+
+    def match(self, question: str) -> Optional[Tuple[Intent, Dict[str, str]]]:
+        """The intent and the slots of the question, or None."""
+        question = " ".join(question.split())
+        for intent in self.intents:
+            for pattern in intent.patterns:
+                match = pattern.fullmatch(question)
+                if match is None:
+                    continue
+                slots = {name: value.strip(" ,.") for name, value in match.groupdict().items()}
+                # "it", "them", ... refer to the chat history, the agent knows what they are
+                if any(not value or set(value.lower().split()) & _REFERENCES for value in slots.values()):
+                    return None
+                return intent, slots
+        return None
+
+    def route(self, question: str) -> Optional[str]:
+        """The answer of the question, or None when the agent should answer it."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        matched = self.match(question)
+        answer = None
+        if matched is not None:
+            intent, slots = matched
+            try:
+                with span("router", intent.name):
+                    answer = intent.answer(**slots)
+            except Exception as e:
+                # the router only saves time, the agent answers when it does not work
+                logger.warning("Intent router failed for %r: %s", question, e)
+        with self._lock:
+            self.questions += 1
+            if answer is not None:
+                self.routed += 1
+                self.routed_seconds += time.perf_counter() - start
+            elif matched is not None:
+                self.fallbacks += 1
+        if answer is not None:
+            logger.info("Routed %r to %s", question, matched[0].name)
+        return answer
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "questions": self.questions,
+                "routed": self.routed,
+                # matched a template, but the agent had to answer
+                "fallbacks": self.fallbacks,
+                "bypass_rate": self.routed / self.questions if self.questions else 0.0,
+                "average_routed_seconds": self.routed_seconds / self.routed if self.routed else 0.0,
+            }
+
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> IntentRouter:
+    """The intent router of the process."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter()
+    return _router
+
+
+def set_intent_router(router: Optional[IntentRouter]):
+    """Replace the intent router, for example with a disabled one in benchmarks."""
+    global _router
+    _router = router
@@ -0,0 +1,229 @@
+"""Serving of many chat sessions from one process: one shared agent executor, the state of every
+session kept separately, and a limit on how many answers are generated at the same time."""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain.agents import AgentExecutor
+
+from observability.metrics import registry
+from observability.tracing import Span, start_span
+from service.agent import get_agent_executor
+from service.answer_cache import SemanticAnswerCache, get_answer_cache
+from service.intent_router import IntentRouter, get_intent_router
+from service.speculation import get_prefetcher
+from service.streaming import TurnMetrics, stream_agent_answer
+
+logger = logging.getLogger(__name__)
+
+
+class ChatServiceBusy(Exception):
+    """Raised when no answer slot became free in time."""
+
+
+@dataclass
+class ChatSession:
+    """State of one conversation: the messages and the metrics of every turn. The version is the number of
+    times it was saved in a session store (see session_store.py), to detect concurrent turns."""
+
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    metrics: List[Dict[str, Any]] = field(default_factory=list)
+    version: int = 0
+
+
+class ChatService:
+    """Answers the questions of all sessions with the same agent executor.
+
+    The agent executor and the connections to the graph database (the driver has its own connection
+    pool) are shared and thread-safe. At most max_concurrency answers are generated at the same time,
+    the other sessions wait up to acquire_timeout seconds for a free slot. The questions which are similar
+    to an already answered one are answered from the answer cache, and the structured questions (like the
+    number of employees of an organization) by the intent router, without the agent and without a slot.
+    """
+
+    def __init__(
+        self,
+        agent_executor: Optional[AgentExecutor] = None,
+        max_concurrency: Optional[int] = None,
+        acquire_timeout: float = 60,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        router: Optional[IntentRouter] = None,
+    ):
+        self._agent_executor = agent_executor
+        self._answer_cache = answer_cache
+        self._router = router
+        self.max_concurrency = max_concurrency or int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.max_active = 0
+        self.turns = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def agent_executor(self) -> AgentExecutor:
+        if self._agent_executor is None:
+            self._agent_executor = get_agent_executor()
+        return self._agent_executor
+
+    @property
+    def answer_cache(self) -> SemanticAnswerCache:
+        if self._answer_cache is None:
+            self._answer_cache = get_answer_cache()
+        return self._answer_cache
+
+    @property
+    def router(self) -> IntentRouter:
+        if self._router is None:
+            self._router = get_intent_router()
+        return self._router
+
+    def _cached_answer(self, prompt: str, chat_history: List[Dict[str, str]]) -> Optional[str]:
+        # the cache only saves time, the question is answered by the agent when it does not work
+        try:
+            return self.answer_cache.lookup(prompt, chat_history)
+        except Exception as e:
+            logger.warning("Answer cache lookup failed: %s", e)
+            return None
+
+    def _store_answer(self, prompt: str, chat_history: List[Dict[str, str]], answer: str):
+        try:
+            self.answer_cache.store(prompt, chat_history, answer)
+        except Exception as e:
+            logger.warning("Answer cache store failed: %s", e)
+
+    def _acquire(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        with self._lock:
+            self.waiting -= 1
+            self.wait_seconds += time.perf_counter() - start
+            if not acquired:
+                self.rejected += 1
+                raise ChatServiceBusy("Too many questions at the same time, try again later.")
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+            self.turns += 1
+        self._slots.release()
+
+    def stream_answer(
+        self,
+        session: ChatSession,
+        prompt: str,
+        on_tool_event: Optional[Callable[[str, str, Dict], None]] = None,
+    ) -> Iterator[str]:
+        """Add the question to the session and yield the tokens of the answer. The answer and the
+        metrics of the turn are added to the session at the end. A turn that fails (or is refused with
+        ChatServiceBusy) leaves the session as it was."""
+        # the chat context of the question, without the question
+        chat_history = list(session.messages)
+        question = {"role": "user", "content": prompt}
+        metrics = TurnMetrics()
+        turn = start_span("turn", "chat")
+        # the answers which do not need the agent: a similar question answered before, or a structured question
+        answer, source = self._cached_answer(prompt, chat_history), "answer_cache"
+        if answer is None:
+            answer, source = self.router.route(prompt), "router"
+        if answer is not None:
+            metrics.source = source
+            metrics.first_token = metrics.finished = time.perf_counter()
+            session.messages += [question, {"role": "assistant", "content": answer}]
+            session.metrics.append(metrics.to_dict())
+            self._end_turn(turn, metrics)
+            yield answer
+            return
+        # the question is added to the session only with a slot, a refused turn leaves the session as it was
+        try:
+            self._acquire()
+        except ChatServiceBusy as e:
+            self._end_turn(turn, metrics, e)
+            raise
+        tokens = []
+        error = None
+        session.messages.append(question)
+        try:
+            for token in stream_agent_answer(
+                {"input": prompt, "chat_history": session.messages},
+                metrics,
+                on_tool_event,
+                self.agent_executor,
+            ):
+                tokens.append(token)
+                yield token
+            # only complete answers are cached
+            self._store_answer(prompt, chat_history, "".join(tokens))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release()
+            if error is None:
+                # the whole answer, or the part that was read before the client stopped the turn
+                session.messages.append({"role": "assistant", "content": "".join(tokens)})
+                session.metrics.append(metrics.to_dict())
+            else:
+                # without the failed turn, so the next turns do not get a missing or cut answer as context
+                del session.messages[len(chat_history)]
+            self._end_turn(turn, metrics, error)
+
+    @staticmethod
+    def _end_turn(turn: Span, metrics: TurnMetrics, error: Optional[BaseException] = None):
+        # the span of the whole turn, by what answered it
+        turn.name = metrics.source
+        turn.set(
+            time_to_first_token=metrics.time_to_first_token,
+            tool_calls=len(metrics.tool_calls),
+            llm_calls=metrics.llm_calls,
+        )
+        turn.end(error)
+
+    def answer(self, session: ChatSession, prompt: str) -> str:
+        """Same as stream_answer, but returns the whole answer."""
+        return "".join(self.stream_answer(session, prompt))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_active": self.max_active,
+            "max_concurrency": self.max_concurrency,
+            "turns": self.turns,
+            "rejected": self.rejected,
+            "average_wait_seconds": self.wait_seconds / self.turns if self.turns else 0.0,
+            "answer_cache": self.answer_cache.stats(),
+            "router": self.router.stats(),
+            "speculation": get_prefetcher().stats(),
+            "stages": registry.snapshot(),
+        }
+
+
+_chat_service: Optional[ChatService] = None
+_service_lock = threading.Lock()
+
+
+def get_chat_service() -> ChatService:
+    """The chat service of the process, created on the first call."""
+    global _chat_service
+    if _chat_service is None:
+        with _service_lock:
+            if _chat_service is None:
+                _chat_service = ChatService()
+    return _chat_service
+
+
+def set_chat_service(service: ChatService):
+    """Replace the chat service, for example with one that uses a stub agent in benchmarks."""
+    global _chat_service
+    _chat_service = service
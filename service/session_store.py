@@ -0,0 +1,180 @@
+"""Storage of the chat sessions outside of the worker which answers the turn, so any worker of the chat API
+(web/api.py) can answer any turn of any session.
+
+The store is chosen with CHAT_SESSION_STORE: "sqlite" (the default) keeps the sessions in the SQLite file
+CHAT_SESSION_DB, which all workers on the host share, and "memory" keeps them in the process (one worker only).
+Every save increases the version of the session, and a save of a session which was saved by another turn
+since it was loaded raises SessionConflict instead of losing that turn.
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from service.serving import ChatSession
+
+
+class SessionConflict(Exception):
+    """Raised when the session was changed (or deleted) by another turn since it was loaded."""
+
+
+class SessionStore:
+    """The interface of the session stores."""
+
+    def create(self) -> str:
+        """Create an empty session and return its id."""
+        raise NotImplementedError
+
+    def load(self, session_id: str) -> Optional[ChatSession]:
+        """The session, or None if there is no session with this id."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: ChatSession):
+        """Save the session loaded with load(), and increase its version."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """The sessions in a dict of the process, at most max_sessions (the least recently used are removed)."""
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = ChatSession()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def load(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            # the turn changes its own copy, like the copy read from a shared store
+            return copy.deepcopy(session)
+
+    def save(self, session_id: str, session: ChatSession):
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            if stored is None or stored.version != session.version:
+                raise SessionConflict(f"Session {session_id} was changed by another turn")
+            session.version += 1
+            self._sessions[session_id] = copy.deepcopy(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+class SQLiteSessionStore(SessionStore):
+    """The sessions in a SQLite file, shared by the processes on the host. The sessions which were not
+    changed for ttl seconds are removed when new sessions are created."""
+
+    def __init__(self, path: str, ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the connection is shared between the threads, the lock protects it; the other processes
+        # wait up to the timeout for the write lock of the file
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            # readers do not block the writer, so the workers can load sessions while another one saves
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, version INTEGER, messages TEXT, metrics TEXT, updated REAL)"
+            )
+            self._db.commit()
+
+    def create(self) -> str:
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+            self._db.execute(
+                "INSERT INTO sessions (id, version, messages, metrics, updated) VALUES (?, 0, '[]', '[]', ?)",
+                (session_id, now),
+            )
+            self._db.commit()
+        return session_id
+
+    def load(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, messages, metrics FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        version, messages, metrics = row
+        return ChatSession(json.loads(messages), json.loads(metrics), version)
+
+    def save(self, session_id: str, session: ChatSession):
+        with self._lock:
+            # only if nobody saved it since it was loaded
+            cursor = self._db.execute(
+                "UPDATE sessions SET version = ?, messages = ?, metrics = ?, updated = ? WHERE id = ? AND version = ?",
+                (
+                    session.version + 1,
+                    json.dumps(session.messages),
+                    json.dumps(session.metrics),
+                    time.time(),
+                    session_id,
+                    session.version,
+                ),
+            )
+            self._db.commit()
+        if cursor.rowcount == 0:
+            raise SessionConflict(f"Session {session_id} was changed by another turn")
+        session.version += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+
+def create_session_store(kind: Optional[str] = None, path: Optional[str] = None) -> SessionStore:
+    """The store configured with CHAT_SESSION_STORE ("sqlite" or "memory") and CHAT_SESSION_DB."""
+    kind = kind or os.getenv("CHAT_SESSION_STORE", "sqlite")
+    if kind == "memory":
+        return InMemorySessionStore()
+    if kind == "sqlite":
+        return SQLiteSessionStore(path or os.getenv("CHAT_SESSION_DB", ".cache/sessions.sqlite3"))
+    raise ValueError(f"Unknown session store {kind!r}, use sqlite or memory")
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """The session store of the process, created on the first call."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_session_store()
+    return _store
+
+
+def set_session_store(store: Optional[SessionStore]):
+    """Replace the session store, for example with one in a temporary file in benchmarks."""
+    global _store
+    _store = store
@@ -0,0 +1,360 @@
+"""Speculative prefetch of what the tools will likely need, while the LLM chooses the tools.
+
+Every agent turn is serial: the first LLM call chooses the tools, the tools resolve the organization, embed the
+topic and query the database, and only then the LLM writes the answer. The question usually names what the
+tools will get as arguments ("news for Google", "health benefits mentioned in the news"), so cheap rules take
+the candidate organizations, topics and countries from the question, and their lookups start at the same time
+as the first LLM call, as tasks on the event loop of the agent.
+
+When a tool is called with an argument that was prefetched, it waits for the prefetch instead of doing the work
+again: the topic embedding is given to the tool, the organization and country lookups are read from the result
+cache which the prefetch filled (they are not prefetched when the result cache is disabled). When the LLM has
+chosen the tools, the prefetches that none of them needs are cancelled, and at the end of the turn the ones
+that were not used. The time saved (the prefetched work that was done when the tool asked for it) and the time
+wasted (the work that was not used) are added up in stats() and in the "speculation" spans.
+
+The stage runs when the agent runs asynchronously (astream_events, which the chat service uses), see
+ParallelAgentExecutor.astream. SPECULATION_ENABLED=0 turns it off.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from observability.tracing import span, start_span
+from repository.async_graph_db import get_async_embeddings
+from repository.async_queries import afilter_by_country, aget_number_employees, asearch_by_organization
+from repository.result_cache import get_result_cache
+
+logger = logging.getLogger(__name__)
+
+# what is prefetched, and which tool arguments use it
+TOPIC = "topic"
+ORGANIZATION = "organization"
+EMPLOYEES = "employees"
+COUNTRY = "country"
+
+MAX_PREFETCHES = int(os.getenv("SPECULATION_MAX_PREFETCHES", "4"))
+
+# the phrase after these words is what the question is about, until the next part of the question
+_ABOUT = re.compile(r"\b(?:about|for|on|regarding|concerning|related to)\s+(?P<phrase>[^?!.]+)", re.I)
+_PHRASE_END = re.compile(
+    r"\s*(?:,|\band\b|\bmentioned\b|\bin the news\b|\bregarding\b|\bbased in\b|\bfor\b|\bof\b).*$", re.I
+)
+_COUNTRY = re.compile(r"\b(?:based|located) in\s+(?P<country>[A-Z][\w\-]*(?:\s+[A-Z][\w\-]*)*)")
+# runs of capitalized words, the names of organizations
+_NAME = re.compile(r"\b[A-Z][\w&'\-]*(?:\s+[A-Z0-9][\w&'\-]*)*")
+_EMPLOYEES = re.compile(r"\bemployees?\b|\bpeople work", re.I)
+_NEWS = re.compile(r"\bnews\b", re.I)
+# capitalized because they start the question, not names
+_QUESTION_WORDS = {
+    "what", "which", "who", "how", "are", "is", "do", "does", "can", "provide", "show", "tell", "give", "find",
+    "any", "the", "i", "latest", "news",
+}
+# phrases of only these words are not topics
+_GENERIC = {"the", "latest", "recent", "news", "organizations", "organization", "companies", "company", "any", "me"}
+
+
+def normalize(value: str) -> str:
+    """The form of the arguments in which the prefetches and the tool calls are compared."""
+    return " ".join(value.split()).strip(" ,.?!").casefold()
+
+
+@dataclass
+class Candidates:
+    """The likely arguments of the tools for a question."""
+
+    topics: List[str] = field(default_factory=list)
+    organizations: List[str] = field(default_factory=list)
+    countries: List[str] = field(default_factory=list)
+    employees: bool = False
+
+
+def _name(run: str) -> str:
+    # without the capitalized question words at the start of the run ("What", "How", ...)
+    words = run.split()
+    while words and words[0].lower() in _QUESTION_WORDS:
+        words.pop(0)
+    return " ".join(words)
+
+
+def _unique(values: List[str]) -> List[str]:
+    # the same value only once, in the order of the question
+    unique = {}
+    for value in values:
+        unique.setdefault(normalize(value), value)
+    return list(unique.values())
+
+
+def extract_candidates(question: str) -> Candidates:
+    """Take the candidate arguments from the question with cheap rules, without the LLM."""
+    candidates = Candidates(employees=bool(_EMPLOYEES.search(question)))
+    candidates.countries = [m.group("country") for m in _COUNTRY.finditer(question)]
+    countries = {normalize(c) for c in candidates.countries}
+    for match in _ABOUT.finditer(question):
+        phrase = _PHRASE_END.sub("", match.group("phrase")).strip()
+        if not phrase or normalize(phrase) in countries:
+            continue
+        if phrase[0].isupper():
+            candidates.organizations.append(_name(phrase))
+        elif not set(phrase.lower().split()) <= _GENERIC:
+            candidates.topics.append(phrase)
+    for match in _NAME.finditer(question):
+        name = _name(match.group())
+        if name and normalize(name) not in countries:
+            candidates.organizations.append(name)
+    candidates.organizations = _unique(candidates.organizations)
+    candidates.topics = _unique(candidates.topics)
+    return candidates
+
+
+@dataclass
+class Prefetch:
+    """One prefetch of a turn, with the perf_counter() times of its stages."""
+
+    kind: str
+    value: str
+    started: float = field(default_factory=time.perf_counter)
+    task: Optional[asyncio.Future] = None
+    finished: Optional[float] = None
+    claimed: Optional[float] = None
+    cancelled: Optional[float] = None
+
+
+class Speculation:
+    """The prefetches of one turn. They run as tasks on the event loop on which the speculation was started."""
+
+    def __init__(self, prefetcher: "SpeculativePrefetcher"):
+        self.prefetcher = prefetcher
+        self.prefetches: Dict[Tuple[str, str], Prefetch] = {}
+        self.settled = False
+        self._span = start_span("speculation", "turn")
+
+    def start(self, kind: str, value: str, work: Callable[[], Awaitable[Any]]):
+        key = (kind, normalize(value))
+        if key in self.prefetches or len(self.prefetches) >= self.prefetcher.max_prefetches:
+            return
+        prefetch = Prefetch(kind, value)
+        prefetch.task = asyncio.ensure_future(self._run(prefetch, work))
+        self.prefetches[key] = prefetch
+
+    @staticmethod
+    async def _run(prefetch: Prefetch, work: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            with span("speculation", prefetch.kind):
+                return await work()
+        except Exception as e:
+            # the tool does the work itself when the prefetch does not work
+            logger.debug("Prefetch of %s %r failed: %s", prefetch.kind, prefetch.value, e)
+            return None
+        finally:
+            prefetch.finished = time.perf_counter()
+
+    async def claim(self, kind: str, value: Optional[str]) -> Any:
+        """The result of the prefetch for the tool argument (after it finished), or None if it was not prefetched."""
+        prefetch = self.prefetches.get((kind, normalize(value))) if value else None
+        if prefetch is None or prefetch.cancelled is not None:
+            return None
+        if prefetch.claimed is None:
+            prefetch.claimed = time.perf_counter()
+        # the prefetch keeps running if the tool is cancelled, the end of the turn cancels it
+        return await asyncio.shield(prefetch.task)
+
+    def settle(self, output: Any):
+        """Cancel the prefetches which none of the tools chosen by the first LLM response needs.
+        output is what the output parser of the agent returned (an action, a list of actions or the finish)."""
+        if self.settled:
+            return
+        self.settled = True
+        values = set()
+        for action in output if isinstance(output, list) else [output]:
+            tool_input = getattr(action, "tool_input", None)
+            if tool_input is None:
+                continue
+            for value in tool_input.values() if isinstance(tool_input, dict) else [tool_input]:
+                for item in value if isinstance(value, list) else [value]:
+                    if isinstance(item, str):
+                        values.add(normalize(item))
+        for (_, key), prefetch in self.prefetches.items():
+            if key not in values:
+                self._cancel(prefetch)
+
+    @staticmethod
+    def _cancel(prefetch: Prefetch):
+        if prefetch.claimed is None and prefetch.cancelled is None and not prefetch.task.done():
+            prefetch.task.cancel()
+            prefetch.cancelled = time.perf_counter()
+
+    def finish(self) -> Dict[str, float]:
+        """Cancel the prefetches which were not used, and add the saved and wasted time to the stats."""
+        now = time.perf_counter()
+        summary = {"prefetched": len(self.prefetches), "used": 0, "cancelled": 0, "saved_seconds": 0.0,
+                   "wasted_seconds": 0.0}
+        for prefetch in self.prefetches.values():
+            self._cancel(prefetch)
+            if prefetch.claimed is not None:
+                summary["used"] += 1
+                # the part of the work which was done when the tool needed it
+                done = prefetch.finished if prefetch.finished is not None else now
+                summary["saved_seconds"] += min(done, prefetch.claimed) - prefetch.started
+                continue
+            if prefetch.cancelled is not None:
+                summary["cancelled"] += 1
+            ended = prefetch.cancelled or prefetch.finished or now
+            summary["wasted_seconds"] += ended - prefetch.started
+        self._span.set(**summary)
+        self._span.end()
+        self.prefetcher.record(summary)
+        return summary
+
+
+_current: ContextVar[Optional[Speculation]] = ContextVar("current_speculation", default=None)
+
+
+def current_speculation() -> Optional[Speculation]:
+    return _current.get()
+
+
+async def aclaim(kind: str, value: Optional[str]) -> Any:
+    """The prefetched result for the argument of a tool in the current turn, or None."""
+    speculation = _current.get()
+    if speculation is None:
+        return None
+    return await speculation.claim(kind, value)
+
+
+async def _prefetch_topic(topic: str):
+    return await get_async_embeddings().aembed_query(topic)
+
+
+async def _first_row(rows):
+    # a string is a message for the chatbot (no or several candidates), the lookup is done
+    if isinstance(rows, str):
+        return
+    try:
+        await rows.__anext__()
+    except StopAsyncIteration:
+        pass
+    finally:
+        await rows.aclose()
+
+
+async def _prefetch_organization(organization: str):
+    # the same call as NewsToolOrganization, so its first page is in the result cache
+    await _first_row(await asearch_by_organization(organization, lazy=True))
+
+
+async def _prefetch_employees(organization: str):
+    await aget_number_employees(organization)
+
+
+async def _prefetch_country(country_name: str):
+    # the same call as NewsToolByCountry
+    await _first_row(await afilter_by_country(country_name, lazy=True))
+
+
+class SpeculativePrefetcher:
+    """Starts the speculations of the turns and adds up what they saved and wasted.
+    SPECULATION_ENABLED=0 turns it off."""
+
+    def __init__(self, enabled: Optional[bool] = None, max_prefetches: int = MAX_PREFETCHES):
+        self.enabled = enabled if enabled is not None else os.getenv("SPECULATION_ENABLED", "1") != "0"
+        self.max_prefetches = max_prefetches
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.prefetched = 0
+        self.used = 0
+        self.cancelled = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def start(self, question: Optional[str]) -> Optional[Speculation]:
+        """Start the prefetches for the question; it has to be called on the event loop of the agent."""
+        if not self.enabled or not question:
+            return None
+        candidates = extract_candidates(question)
+        speculation = Speculation(self)
+        for topic in candidates.topics:
+            speculation.start(TOPIC, topic, lambda topic=topic: _prefetch_topic(topic))
+        # the tools read the lookups from the result cache, without it the prefetch would not be used
+        if get_result_cache() is not None:
+            for organization in candidates.organizations:
+                # "news for X and how many employees has X?" needs both
+                if not candidates.employees or _NEWS.search(question):
+                    speculation.start(ORGANIZATION, organization, lambda o=organization: _prefetch_organization(o))
+                if candidates.employees:
+                    speculation.start(EMPLOYEES, organization, lambda o=organization: _prefetch_employees(o))
+            for country in candidates.countries:
+                speculation.start(COUNTRY, country, lambda c=country: _prefetch_country(c))
+        logger.debug("Prefetching %s for %r", list(speculation.prefetches), question)
+        return speculation
+
+    def record(self, summary: Dict[str, float]):
+        with self._lock:
+            self.turns += 1
+            self.prefetched += summary["prefetched"]
+            self.used += summary["used"]
+            self.cancelled += summary["cancelled"]
+            self.saved_seconds += summary["saved_seconds"]
+            self.wasted_seconds += summary["wasted_seconds"]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "prefetched": self.prefetched,
+                "used": self.used,
+                "cancelled": self.cancelled,
+                "hit_rate": self.used / self.prefetched if self.prefetched else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "wasted_seconds": self.wasted_seconds,
+                "average_saved_seconds": self.saved_seconds / self.turns if self.turns else 0.0,
+            }
+
+
+@contextmanager
+def speculate(
+    question: Optional[str], prefetcher: Optional[SpeculativePrefetcher] = None
+) -> Iterator[Optional[Speculation]]:
+    """Run the block with the prefetches for the question; the tools in it can claim them."""
+    speculation = (prefetcher or get_prefetcher()).start(question)
+    if speculation is None:
+        yield None
+        return
+    token = _current.set(speculation)
+    try:
+        yield speculation
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # the block ended in another context (an async generator closed by the garbage collector)
+            pass
+        summary = speculation.finish()
+        logger.info("Speculation: %s", summary)
+
+
+_prefetcher: Optional[SpeculativePrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> SpeculativePrefetcher:
+    """The speculative prefetcher of the process."""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = SpeculativePrefetcher()
+    return _prefetcher
+
+
+def set_prefetcher(prefetcher: Optional[SpeculativePrefetcher]):
+    """Replace the prefetcher, for example with a disabled one in benchmarks."""
+    global _prefetcher
+    _prefetcher = prefetcher
@@ -0,0 +1,135 @@
+"""Streaming of the agent answer token by token, with time to first token and total latency for every turn."""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain.agents import AgentExecutor
+
+from observability.callbacks import InstrumentationCallbackHandler
+from service.agent import get_agent_executor
+
+logger = logging.getLogger(__name__)
+
+# The agent runs in one event loop in a background thread. It is the same loop for all turns, because the async
+# Neo4j driver that the tools use belongs to the loop in which it was created.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+# marks the end of the events in the queue
+_DONE = object()
+
+
+@dataclass
+class TurnMetrics:
+    """Timings of one turn of the conversation, in seconds from time.perf_counter()."""
+
+    started: float = field(default_factory=time.perf_counter)
+    first_token: Optional[float] = None
+    finished: Optional[float] = None
+    tool_calls: List[str] = field(default_factory=list)
+    # LLM round trips of the agent: one to choose the tools (for every step), one to write the answer
+    llm_calls: int = 0
+    # what answered the question: the agent, the answer cache or the intent router
+    source: str = "agent"
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return None if self.first_token is None else self.first_token - self.started
+
+    @property
+    def total_latency(self) -> Optional[float]:
+        return None if self.finished is None else self.finished - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "total_latency": self.total_latency,
+            "tool_calls": self.tool_calls,
+            "llm_calls": self.llm_calls,
+            "source": self.source,
+        }
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return _loop
+
+
+def stream_agent_answer(
+    agent_input: Dict[str, Any],
+    metrics: Optional[TurnMetrics] = None,
+    on_tool_event: Optional[Callable[[str, str, Dict], None]] = None,
+    agent_executor: Optional[AgentExecutor] = None,
+) -> Iterator[str]:
+    """Run the agent and yield the tokens of the answer as soon as the LLM produces them.
+
+    The tool calls are not part of the answer, they are reported to on_tool_event(event, tool_name, data)
+    with event "on_tool_start" or "on_tool_end", so the page can show the progress. An answer which the LLM
+    did not write (the iteration or time limit of the agent ran out) is yielded at once at the end.
+    By default it runs the agent executor of the process.
+    """
+    agent_executor = agent_executor if agent_executor is not None else get_agent_executor()
+    metrics = metrics if metrics is not None else TurnMetrics()
+    events: "queue.Queue" = queue.Queue()
+
+    async def produce():
+        try:
+            # the spans of the LLM and tool calls of this turn (see observability/)
+            config = {"callbacks": [InstrumentationCallbackHandler()]}
+            async for event in agent_executor.astream_events(agent_input, config=config, version="v1"):
+                events.put(event)
+        except Exception as e:
+            events.put(e)
+        finally:
+            events.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(produce(), _get_event_loop())
+    # the first event is the start of the agent executor, the nested chains have other run ids
+    root_run_id = None
+    streamed = False
+    try:
+        while True:
+            event = events.get()
+            if event is _DONE:
+                break
+            if isinstance(event, Exception):
+                raise event
+            if root_run_id is None:
+                root_run_id = event.get("run_id")
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                # the LLM calls that choose a tool have no content, only the final answer has
+                content = event["data"]["chunk"].content
+                if content:
+                    if metrics.first_token is None:
+                        metrics.first_token = time.perf_counter()
+                    streamed = True
+                    yield content
+            elif kind == "on_chain_end" and root_run_id is not None and event.get("run_id") == root_run_id:
+                # with early_stopping_method="force" the answer after the last step is the fixed text of the
+                # executor, no LLM call streams it
+                output = event["data"].get("output")
+                answer = output.get("output") if isinstance(output, dict) else None
+                if answer and not streamed:
+                    if metrics.first_token is None:
+                        metrics.first_token = time.perf_counter()
+                    yield answer
+            elif kind == "on_chat_model_start":
+                metrics.llm_calls += 1
+            elif kind in ("on_tool_start", "on_tool_end"):
+                if kind == "on_tool_start":
+                    metrics.tool_calls.append(event["name"])
+                if on_tool_event is not None:
+                    on_tool_event(kind, event["name"], event["data"])
+    finally:
+        # stop the agent if the consumer stopped reading before the end
+        future.cancel()
+        metrics.finished = time.perf_counter()
+        logger.info("Turn metrics: %s", metrics.to_dict())
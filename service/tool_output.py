@@ -0,0 +1,137 @@
+"""Compact text for the results of the tools, which the chatbot gets back in the prompt.
+
+The results are lists of texts or of dicts from the repository. Instead of their Python or JSON form
+(quotes, braces and the same keys repeated in every row), a list of dicts is written as a table with the
+keys once in the header, and a list of texts as one text per line. Near-identical texts (the same news in
+several chunks or articles) are written only once, and the whole result is cut to a token budget.
+The tokens before and after are counted for every call, to see how much is saved.
+"""
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from service.chat_history import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_TOKENS = int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "2000"))
+# texts with at least this share of the same word triples are the same news
+DUPLICATE_THRESHOLD = 0.9
+
+# the keys of the paged results, see tool_paging.py
+_PAGE_KEYS = ("message", "results", "next_cursor", "note")
+
+
+def _shingles(text: str) -> frozenset:
+    words = re.sub(r"\W+", " ", text.lower()).split()
+    if len(words) < 3:
+        return frozenset([" ".join(words)])
+    return frozenset(" ".join(words[i:i + 3]) for i in range(len(words) - 2))
+
+
+def _main_text(item: Any) -> str:
+    # the text which decides if two rows are the same: the longest text of a dict
+    if isinstance(item, dict):
+        return max((v for v in item.values() if isinstance(v, str)), key=len, default="")
+    return item if isinstance(item, str) else ""
+
+
+def dedupe(items: List[Any], threshold: float = DUPLICATE_THRESHOLD) -> List[Any]:
+    """The items without the ones whose text is (almost) the same as the text of an earlier item."""
+    kept, kept_shingles = [], []
+    for item in items:
+        text = _main_text(item)
+        if not text:
+            kept.append(item)
+            continue
+        shingles = _shingles(text)
+        duplicate = any(
+            len(shingles & other) >= threshold * min(len(shingles), len(other)) for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(item)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_cell(v) for v in value)
+    # one row per line and the columns separated by |
+    return re.sub(r"\s+", " ", str(value)).replace("|", "/").strip()
+
+
+def encode_rows(items: List[Any]) -> str:
+    """A list of dicts as a table (the keys in the header line), anything else one item per line."""
+    if items and all(isinstance(item, dict) for item in items):
+        columns = list(dict.fromkeys(key for item in items for key in item))
+        lines = [" | ".join(columns)]
+        lines += [" | ".join(_cell(item.get(column)) for column in columns) for item in items]
+        return "\n".join(lines)
+    return "\n".join(f"- {_cell(item)}" for item in items)
+
+
+def encode_result(result: Any) -> str:
+    if result is None:
+        return "No results."
+    if isinstance(result, str):
+        return result
+    if isinstance(result, dict) and "results" in result and set(result) <= set(_PAGE_KEYS):
+        lines = [result["message"]] if result.get("message") else []
+        lines.append(encode_rows(dedupe(result["results"])) if result["results"] else "No results.")
+        if result.get("next_cursor"):
+            lines.append(f"next_cursor: {result['next_cursor']} ({result.get('note', 'more results')})")
+        return "\n".join(lines)
+    if isinstance(result, dict):
+        # results for several topics
+        return "\n".join(f"# {key}\n{encode_result(value)}" for key, value in result.items())
+    if isinstance(result, (list, tuple)):
+        return encode_rows(dedupe(list(result))) if result else "No results."
+    return str(result)
+
+
+def cut_to_budget(text: str, max_tokens: int = MAX_TOKENS) -> str:
+    """The text with at most max_tokens tokens, cut at the end of a line if possible."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = truncate_tokens(text, max_tokens)
+    # the last line is probably cut in the middle, drop it if there is something before it
+    if "\n" in cut and len(cut.rsplit("\n", 1)[1]) < len(cut) // 2:
+        cut = cut.rsplit("\n", 1)[0]
+    return cut + "\n[the rest of the result was cut]"
+
+
+class ToolTokenStats:
+    """How many tokens the results of every tool would have in their Python form, and how many they have."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "raw_tokens": 0, "tokens": 0})
+        self._lock = threading.Lock()
+
+    def add(self, tool: str, raw_tokens: int, tokens: int):
+        with self._lock:
+            stats = self._stats[tool]
+            stats["calls"] += 1
+            stats["raw_tokens"] += raw_tokens
+            stats["tokens"] += tokens
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {tool: dict(stats) for tool, stats in self._stats.items()}
+
+
+tool_token_stats = ToolTokenStats()
+
+
+def format_tool_result(tool: str, result: Any, max_tokens: int = MAX_TOKENS) -> str:
+    """The compact text of the result of the tool, for the prompt."""
+    text = cut_to_budget(encode_result(result), max_tokens)
+    raw_tokens, tokens = count_tokens(str(result)), count_tokens(text)
+    tool_token_stats.add(tool, raw_tokens, tokens)
+    logger.info("Tool result tokens of %s: %d -> %d", tool, raw_tokens, tokens)
+    return text
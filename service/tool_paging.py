@@ -0,0 +1,208 @@
+"""Tool results which can be longer than what the chatbot needs at once.
+
+The tools get lazy iterators from the repository (see repository/pagination.py) and return only the first
+rows which fit in a token and byte budget. If there are more rows, the iterator is kept under a cursor id
+which is returned with the result, and the chatbot can read the next rows with the NewsInformationFetchMore
+tool. The rows are read from the database only when they are needed.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Union
+
+from service.chat_history import count_tokens, truncate_tokens
+
+MAX_ITEMS = 5
+MAX_TOKENS = int(os.getenv("TOOL_RESULT_MAX_TOKENS", "1500"))
+MAX_BYTES = int(os.getenv("TOOL_RESULT_MAX_BYTES", "12000"))
+
+Rows = Union[Iterator[Dict], AsyncIterator[Dict]]
+
+
+def _identity(row: Any) -> Any:
+    return row
+
+
+@dataclass
+class _Cursor:
+    rows: Rows
+    format_row: Callable[[Dict], Any]
+    message: Optional[str]
+    created: float = field(default_factory=time.monotonic)
+
+
+class CursorStore:
+    """The iterators of the results that were not returned yet, by cursor id.
+    Only the last max_cursors are kept, and not longer than ttl seconds."""
+
+    def __init__(self, max_cursors: int = 1000, ttl: float = 1800):
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+        self._cursors: "OrderedDict[str, _Cursor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, cursor: _Cursor, cursor_id: Optional[str] = None) -> str:
+        cursor_id = cursor_id or uuid.uuid4().hex[:12]
+        with self._lock:
+            self._cursors[cursor_id] = cursor
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+        return cursor_id
+
+    def take(self, cursor_id: str) -> Optional[_Cursor]:
+        """Remove the cursor from the store and return it; a cursor can be read only once,
+        the next page gets a new cursor id."""
+        with self._lock:
+            cursor = self._cursors.pop(cursor_id, None)
+        if cursor is None or time.monotonic() - cursor.created > self.ttl:
+            return None
+        return cursor
+
+    def __len__(self) -> int:
+        return len(self._cursors)
+
+
+cursor_store = CursorStore()
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Shorten the text to max_tokens tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    return truncate_tokens(text, max_tokens).rstrip() + "..."
+
+
+def _truncate(item: Any, max_tokens: int) -> Any:
+    # an item which alone does not fit in the budget: shorten its texts
+    if isinstance(item, str):
+        return truncate_text(item, max_tokens)
+    if isinstance(item, dict):
+        texts = [key for key, value in item.items() if isinstance(value, str)]
+        return {
+            key: truncate_text(value, max_tokens // len(texts)) if key in texts else value
+            for key, value in item.items()
+        }
+    return item
+
+
+class _Page:
+    """The items of one page of a tool result, until the budget is used."""
+
+    def __init__(self, max_items: int, max_tokens: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.items: List[Any] = []
+        self.tokens = 0
+        self.bytes = 0
+
+    def add(self, item: Any) -> bool:
+        """Add the item if it fits; the first item always fits, shortened if needed."""
+        if len(self.items) >= self.max_items:
+            return False
+        if not self.items:
+            item = _truncate(item, self.max_tokens)
+        text = str(item)
+        tokens, size = count_tokens(text), len(text.encode("utf-8"))
+        if self.items and (self.tokens + tokens > self.max_tokens or self.bytes + size > self.max_bytes):
+            return False
+        self.items.append(item)
+        self.tokens += tokens
+        self.bytes += size
+        return True
+
+    def result(self, cursor: _Cursor, exhausted: bool, store: CursorStore) -> Dict:
+        result = {"message": cursor.message} if cursor.message else {}
+        result["results"] = self.items
+        if not exhausted:
+            result["next_cursor"] = store.put(cursor)
+            result["note"] = "There are more results, call NewsInformationFetchMore with next_cursor to get them."
+        return result
+
+
+def page_result(
+    rows: Iterator[Dict],
+    format_row: Callable[[Dict], Any] = _identity,
+    message: Optional[str] = None,
+    max_items: int = MAX_ITEMS,
+    max_tokens: int = MAX_TOKENS,
+    max_bytes: int = MAX_BYTES,
+    store: Optional[CursorStore] = None,
+) -> Dict:
+    """The first rows (formatted with format_row) which fit in the budget, and a cursor for the rest."""
+    store = store or cursor_store
+    page = _Page(max_items, max_tokens, max_bytes)
+    exhausted = True
+    for row in rows:
+        if not page.add(format_row(row)):
+            # this row is the first one of the next page
+            rows = chain([row], rows)
+            exhausted = False
+            break
+        if len(page.items) == max_items:
+            # do not read the next row just to know if there is one, it may need another query
+            exhausted = False
+            break
+    return page.result(_Cursor(rows, format_row, message), exhausted, store)
+
+
+async def apage_result(
+    rows: AsyncIterator[Dict],
+    format_row: Callable[[Dict], Any] = _identity,
+    message: Optional[str] = None,
+    max_items: int = MAX_ITEMS,
+    max_tokens: int = MAX_TOKENS,
+    max_bytes: int = MAX_BYTES,
+    store: Optional[CursorStore] = None,
+) -> Dict:
+    """Async version of page_result."""
+    store = store or cursor_store
+    page = _Page(max_items, max_tokens, max_bytes)
+    exhausted = True
+    async for row in rows:
+        if not page.add(format_row(row)):
+            rows = _achain(row, rows)
+            exhausted = False
+            break
+        if len(page.items) == max_items:
+            exhausted = False
+            break
+    return page.result(_Cursor(rows, format_row, message), exhausted, store)
+
+
+async def _achain(first: Dict, rows: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    yield first
+    async for row in rows:
+        yield row
+
+
+def fetch_more(cursor_id: str, max_items: int = MAX_ITEMS, store: Optional[CursorStore] = None) -> Union[Dict, str]:
+    """The next rows of a previous tool result."""
+    store = store or cursor_store
+    cursor = store.take(cursor_id)
+    if cursor is None:
+        return "This cursor is unknown or expired, call the original tool again."
+    if not isinstance(cursor.rows, Iterator):
+        # created by an asynchronous tool call, it can be read only asynchronously
+        store.put(cursor, cursor_id)
+        return "This cursor can be read only asynchronously."
+    return page_result(cursor.rows, cursor.format_row, cursor.message, max_items, store=store)
+
+
+async def afetch_more(cursor_id: str, max_items: int = MAX_ITEMS, store: Optional[CursorStore] = None) -> Union[Dict, str]:
+    """Async version of fetch_more."""
+    store = store or cursor_store
+    cursor = store.take(cursor_id)
+    if cursor is None:
+        return "This cursor is unknown or expired, call the original tool again."
+    if isinstance(cursor.rows, Iterator):
+        # the sync iterator queries the database, so it is read in a thread
+        return await asyncio.to_thread(
+            page_result, cursor.rows, cursor.format_row, cursor.message, max_items, store=store
+        )
+    return await apage_result(cursor.rows, cursor.format_row, cursor.message, max_items, store=store)
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from service.answer_cache import SemanticAnswerCache, key_terms  # noqa: E402
+
+
+class SameEmbeddings:
+    """Every question gets the same vector, so only the numbers and the names tell them apart."""
+
+    def embed_query(self, text):
+        return [1.0, 0.0, 0.0]
+
+
+def _cache():
+    return SemanticAnswerCache(SameEmbeddings(), max_entries=10, run_query=lambda query, params=None: [])
+
+
+def test_key_terms():
+    assert key_terms("How many employees does Google have?") == {"google"}
+    assert key_terms("What is the news from 2023? Which companies are in Germany?") == {"2023", "germany"}
+    assert key_terms("Provide news about health benefits.") == frozenset()
+
+
+def test_hit_needs_the_same_numbers_and_names():
+    cache = _cache()
+    cache.store("How many employees does Google have?", [], "100000")
+
+    assert cache.lookup("how many employees does Google have", []) == "100000"
+    assert cache.lookup("How many employees does Microsoft have?", []) is None
+    assert cache.stats()["different_terms"] == 1
+
+
+def test_numbers_must_match():
+    cache = _cache()
+    cache.store("What were the layoffs in 2023?", [], "Some layoffs")
+
+    assert cache.lookup("What were the layoffs in 2024?", []) is None
+    assert cache.lookup("What were the layoffs in 2023?", []) == "Some layoffs"
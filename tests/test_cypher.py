@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from repository.cypher import (  # noqa: E402
+    HYBRID_FULLTEXT_QUERY,
+    HYBRID_VECTOR_QUERY,
+    hybrid_search_queries,
+    reciprocal_rank_fusion,
+)
+
+
+def _row(chunk_id, article_id):
+    return {"chunk_id": chunk_id, "chunk_text": f"text {chunk_id}", "article_id": article_id, "title": article_id}
+
+
+def test_hybrid_search_queries():
+    assert list(hybrid_search_queries([0.1], None, 20)) == ["vector"]
+    queries = hybrid_search_queries([0.1], "Google", 20)
+    assert queries["vector"][0] == HYBRID_VECTOR_QUERY
+    assert queries["fulltext"][0] == HYBRID_FULLTEXT_QUERY
+    assert queries["fulltext"][1]["fulltextQuery"] == "Google~2"
+
+
+def test_reciprocal_rank_fusion_keeps_the_best_chunk_of_every_article():
+    rankings = {
+        "vector": [_row("c1", "a1"), _row("c2", "a1"), _row("c3", "a2")],
+        "fulltext": [_row("c3", "a2"), _row("c4", "a3")],
+    }
+
+    results = reciprocal_rank_fusion(rankings, k=2, rrf_k=60)
+
+    # c3 is in both rankings, c2 is the second chunk of the article of c1
+    assert [r["chunk_text"] for r in results] == ["text c3", "text c1"]
+    assert results[0]["sources"] == ["vector", "fulltext"]
+    assert results[0]["score"] == pytest.approx(1 / 63 + 1 / 61)
+    assert results[1]["score"] == pytest.approx(1 / 61)
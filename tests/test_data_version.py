@@ -0,0 +1,29 @@
+import pytest
+
+from repository import data_version
+from repository.data_version import get_data_version, poll_graph_version
+
+
+@pytest.fixture(autouse=True)
+def never_polled(monkeypatch):
+    monkeypatch.setattr(data_version, "_graph_version", data_version._UNSET)
+    monkeypatch.setattr(data_version, "_last_poll", 0.0)
+    monkeypatch.setattr(data_version, "POLL_INTERVAL", 0.0)
+
+
+def test_first_poll_only_remembers_the_version():
+    version = get_data_version()
+    poll_graph_version(lambda query: [{"version": 3}])
+    assert get_data_version() == version
+
+
+def test_first_ingestion_after_a_poll_without_version_node_changes_the_version():
+    version = get_data_version()
+    poll_graph_version(lambda query: [])
+    assert get_data_version() == version
+
+    poll_graph_version(lambda query: [{"version": 1}])
+    assert get_data_version() == version + 1
+
+    poll_graph_version(lambda query: [{"version": 1}])
+    assert get_data_version() == version + 1
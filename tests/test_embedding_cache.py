@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from repository.embedding_cache import CachedEmbeddings, query_vector  # noqa: E402
+
+
+class CountingEmbeddings:
+    model = "counting"
+
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [[float(len(t)), 0.5] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_vectors_are_lists_of_floats(tmp_path, in_memory):
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, path=str(tmp_path / "embeddings.sqlite3"))
+    cache.embed_documents(["one", "three"])
+    if not in_memory:
+        cache = CachedEmbeddings(inner, path=str(tmp_path / "embeddings.sqlite3"))
+
+    for vector in (cache.embed_query("one"), *cache.embed_documents(["three", "one"])):
+        assert isinstance(vector, list) and all(type(x) is float for x in vector)
+    assert cache.embed_query("three") == [5.0, 0.5]
+    assert inner.texts == ["one", "three"]
+
+
+def test_changing_a_returned_vector_does_not_change_the_cache():
+    cache = CachedEmbeddings(CountingEmbeddings(), path="")
+    cache.embed_query("one").append(1.0)
+    assert cache.embed_query("one") == [3.0, 0.5]
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_arrays_are_the_read_only_vectors_of_the_cache(tmp_path, in_memory):
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, path=str(tmp_path / "embeddings.sqlite3"))
+    cache.embed_documents(["one"])
+    if not in_memory:
+        cache = CachedEmbeddings(inner, path=str(tmp_path / "embeddings.sqlite3"))
+
+    vector = cache.embed_query_array("one")
+    assert vector.dtype == np.float32 and not vector.flags.writeable
+    assert cache.embed_documents_arrays(["one"])[0] is vector
+    assert query_vector(cache, "one") is vector
+    assert inner.texts == ["one"]
+
+
+def test_query_vector_of_other_embeddings_is_an_array():
+    vector = query_vector(CountingEmbeddings(), "one")
+    assert vector.dtype == np.float32 and vector.tolist() == [3.0, 0.5]
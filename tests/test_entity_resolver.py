@@ -0,0 +1,44 @@
+import random
+import string
+
+from repository.entity_resolver import BKTree, EntityResolver, _edit_distance
+
+
+def test_edit_distance():
+    assert _edit_distance("apple", "apple", 2) == 0
+    assert _edit_distance("apple", "aple", 2) == 1
+    assert _edit_distance("apple", "paple", 2) == 2
+    assert _edit_distance("apple", "banana", 2) == 3
+
+
+def test_bk_tree_finds_the_same_words_as_comparing_with_every_word():
+    rng = random.Random(1)
+    words = {"".join(rng.choices("abcd", k=rng.randint(1, 6))) for _ in range(300)}
+    tree = BKTree()
+    for word in words:
+        tree.add(word)
+    for _ in range(50):
+        query = "".join(rng.choices(string.ascii_lowercase[:5], k=rng.randint(1, 6)))
+        expected = {w for w in words if _edit_distance(query, w, 2) <= 2}
+        assert {w for w, _ in tree.search(query, 2)} == expected
+
+
+def test_candidates_are_empty_until_the_names_are_loaded():
+    resolver = EntityResolver("Organization")
+    resolver.add_names(["Apple Inc"])
+    assert resolver.candidates("Apple Inc") == []
+
+    resolver.replace_names(["Apple Inc", "Microsoft"])
+    assert resolver.candidates("apple inc") == ["Apple Inc"]
+    assert resolver.candidates("Mircosoft") == ["Microsoft"]
+
+
+def test_add_and_remove_names():
+    resolver = EntityResolver("Organization")
+    resolver.replace_names(["Apple Inc"])
+    resolver.add_names(["Apple Records"])
+    assert resolver.candidates("apple") == ["Apple Inc", "Apple Records"]
+
+    resolver.remove_names(["Apple Inc"])
+    assert resolver.candidates("apple") == ["Apple Records"]
+    assert len(resolver) == 1
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from repository.ingestion import (  # noqa: E402
+    EXISTING_HASHES_QUERY,
+    WRITE_ARTICLES_QUERY,
+    WRITE_CHUNKS_QUERY,
+    IngestionPipeline,
+    article_date,
+)
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class FakeGraph:
+    """The articles with the hashes of their chunks, and every chunk row written by WRITE_CHUNKS_QUERY."""
+
+    def __init__(self):
+        self.articles = {}
+        self.written_chunks = []
+
+    def run_query(self, query, params=None):
+        if query == EXISTING_HASHES_QUERY:
+            return [
+                {"id": id, "hash": self.articles[id]["hash"],
+                 "chunks": [{"id": c, "hash": h} for c, h in self.articles[id]["chunks"].items()]}
+                for id in params["ids"] if id in self.articles
+            ]
+        if "processed" in query:
+            return [{"processed": 0}]
+        return []
+
+    def run_write(self, statements):
+        results = []
+        for query, params in statements:
+            if query == WRITE_ARTICLES_QUERY:
+                rows = []
+                for row in params["articles"]:
+                    old = self.articles.get(row["id"], {"chunks": {}})["chunks"]
+                    kept = {c: h for c, h in old.items() if c in row["unchanged_chunk_ids"]}
+                    self.articles[row["id"]] = {"hash": row["hash"], "date": row["date"], "chunks": kept}
+                    rows.append({"id": row["id"], "deleted": [c for c in old if c not in kept]})
+                results.append(rows)
+            elif query == WRITE_CHUNKS_QUERY:
+                for row in params["chunks"]:
+                    self.articles[row["article_id"]]["chunks"][row["id"]] = row["hash"]
+                    self.written_chunks.append(row["id"])
+                results.append([{"id": row["id"], "chunk_id": row["id"]} for row in params["chunks"]])
+        return results
+
+
+def write_lines(path, articles):
+    path.write_text("\n".join(json.dumps(article) for article in articles), encoding="utf-8")
+    return str(path)
+
+
+def pipeline(graph, **kwargs):
+    return IngestionPipeline(graph.run_query, graph.run_write, FakeEmbeddings(), **kwargs)
+
+
+def test_article_repeated_in_a_batch_is_written_once(tmp_path):
+    graph = FakeGraph()
+    path = write_lines(tmp_path / "articles.jsonl", [
+        {"id": "a", "title": "Old", "chunks": ["one", "two"]},
+        {"id": "a", "title": "New", "chunks": ["one", "three"]},
+    ])
+
+    stats = pipeline(graph).run(path)
+
+    assert stats.written_articles == 1
+    assert sorted(graph.written_chunks) == ["a-0", "a-1"]
+
+
+def test_article_repeated_in_a_waiting_batch_is_compared_with_the_written_version(tmp_path):
+    graph = FakeGraph()
+    path = write_lines(tmp_path / "articles.jsonl", [
+        {"id": "a", "title": "Old", "chunks": ["one", "two"]},
+        {"id": "a", "title": "New", "chunks": ["one", "three"]},
+    ])
+
+    stats = pipeline(graph, batch_size=1, concurrency=4).run(path)
+
+    # the second version only writes its changed chunk
+    assert graph.written_chunks == ["a-0", "a-1", "a-1"]
+    assert stats.unchanged_chunks == 1
+    assert stats.deleted_chunks == 1
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-05-01", "2024-05-01"),
+    ("2024-05-01T10:00:00Z", "2024-05-01"),
+    ("2024-05-01T10:00:00.123+02:00", "2024-05-01"),
+    ("2024-05-01 10:00", "2024-05-01"),
+    ("May 1, 2024", None),
+    (None, None),
+])
+def test_article_date(value, expected):
+    assert article_date(value) == expected
+
+
+def test_timestamped_article_is_written_with_its_day(tmp_path):
+    graph = FakeGraph()
+    path = write_lines(tmp_path / "articles.jsonl", [
+        {"id": "a", "title": "News", "date": "2024-05-01T10:00:00Z", "chunks": ["one"]},
+    ])
+
+    pipeline(graph).run(path)
+
+    assert graph.articles["a"]["date"] == "2024-05-01"
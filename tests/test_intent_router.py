@@ -0,0 +1,22 @@
+import pytest
+
+from service.intent_router import IntentRouter, _number
+
+
+@pytest.mark.parametrize(
+    "value, number",
+    [("30000", 30000), ("30,000", 30000), ("30.000", 30000), ("30 000", 30000), ("1,000,000", 1000000),
+     ("1.5", None), ("1,5", None), ("1,000.000", None)],
+)
+def test_number(value, number):
+    assert _number(value) == number
+
+
+def test_match_takes_the_organization():
+    intent, slots = IntentRouter().match("How many employees does Clarity Insights have?")
+    assert intent.name == "number_employees"
+    assert slots == {"organization": "Clarity Insights"}
+
+
+def test_follow_up_is_not_matched():
+    assert IntentRouter().match("How many employees does it have?") is None
@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+
+from repository.local_vector_engine import LocalVectorEngine
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_search_returns_the_most_similar_chunks(tmp_path, dtype):
+    engine = LocalVectorEngine(str(tmp_path), dtype)
+    engine.append([
+        {"id": "a", "text": "first", "embedding": [1.0, 0.0, 0.0]},
+        {"id": "b", "text": "second", "embedding": [0.0, 1.0, 0.0]},
+        {"id": "c", "text": "third", "embedding": [0.7, 0.7, 0.0]},
+    ])
+
+    results = engine.search([1.0, 0.1, 0.0], k=2)
+
+    assert [r["chunk_text"] for r in results] == ["first", "third"]
+
+
+def test_search_with_read_only_query(tmp_path):
+    engine = LocalVectorEngine(str(tmp_path))
+    engine.append([{"id": "a", "text": "first", "embedding": [1.0, 0.0]}])
+    # like the vectors returned by the embedding cache
+    query = np.array([2.0, 0.0], dtype=np.float32)
+    query.setflags(write=False)
+
+    results = engine.search(query, k=1)
+
+    assert results[0]["chunk_text"] == "first"
+    assert results[0]["score"] == pytest.approx(1.0)
+    assert query.tolist() == [2.0, 0.0]
+
+
+def test_deleted_chunks_are_not_returned(tmp_path):
+    engine = LocalVectorEngine(str(tmp_path))
+    engine.append([
+        {"id": "a", "text": "first", "embedding": [1.0, 0.0]},
+        {"id": "b", "text": "second", "embedding": [0.9, 0.1]},
+    ])
+    engine.delete(["a"])
+
+    assert [r["chunk_text"] for r in engine.search([1.0, 0.0], k=2)] == ["second"]
+    assert [r["chunk_text"] for r in LocalVectorEngine(str(tmp_path)).search([1.0, 0.0], k=2)] == ["second"]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_search_while_chunks_are_appended_and_deleted(tmp_path, dtype):
+    engine = LocalVectorEngine(str(tmp_path), dtype)
+    engine.append([{"id": "0", "text": "0", "embedding": [1.0, 0.0]}])
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                engine.search([1.0, 0.0], k=3)
+            except Exception as e:  # pragma: no cover - the failure is reported below
+                errors.append(e)
+
+    searcher = threading.Thread(target=search)
+    searcher.start()
+    try:
+        for i in range(1, 200):
+            engine.append([{"id": str(i), "text": str(i), "embedding": [1.0, i / 200]}])
+            if i % 3 == 0:
+                engine.delete([str(i - 1)])
+    finally:
+        stop.set()
+        searcher.join()
+
+    assert errors == []
+    assert engine.count == 200
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_append_after_an_interrupted_append(tmp_path, dtype):
+    engine = LocalVectorEngine(str(tmp_path), dtype)
+    engine.append([{"id": "a", "text": "first", "embedding": [1.0, 0.0]}])
+    # the rows of an append which crashed before the meta file was written
+    for name, data in [("vectors.bin", b"\x01" * 5), ("scales.bin", b"\x01" * 3), ("offsets.bin", b"\x01" * 8),
+                       ("texts.bin", b"lost"), ("ids.txt", b"lost\n")]:
+        with open(tmp_path / name, "ab") as f:
+            f.write(data)
+
+    engine = LocalVectorEngine(str(tmp_path))
+    assert engine.count == 1
+    engine.append([{"id": "b", "text": "second", "embedding": [0.0, 1.0]}])
+
+    engine = LocalVectorEngine(str(tmp_path))
+    assert engine.ids == ["a", "b"]
+    assert [r["chunk_text"] for r in engine.search([0.0, 1.0], k=2)] == ["second", "first"]
+    assert engine.search([0.0, 1.0], k=1)[0]["score"] == pytest.approx(1.0, abs=1e-2)
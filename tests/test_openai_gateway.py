@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from benchmark.fake_llm import ScriptedChatModel  # noqa: E402
+from repository.openai_gateway import GatewayChatModel  # noqa: E402
+
+
+def test_reservation_counts_the_tools_and_the_tool_calls():
+    model = GatewayChatModel(inner=ScriptedChatModel(), completion_tokens_estimate=0)
+    messages = [HumanMessage(content="How many employees has Google?")]
+    tools = [{"type": "function", "function": {"name": "NumberOfEmployees", "description": "x" * 400}}]
+    call = AIMessage(content="", additional_kwargs={"tool_calls": [{"function": {"arguments": "y" * 400}}]})
+
+    text_only = model._tokens(messages, {})
+
+    assert model._tokens(messages, {"tools": tools}) >= text_only + 100
+    assert model._tokens(messages, {"functions": [tools[0]["function"]]}) >= text_only + 100
+    assert model._tokens(messages + [call], {}) >= text_only + 100
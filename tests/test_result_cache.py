@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from repository.data_version import bump_data_version
+from repository.result_cache import ResultCache, acached_query, cached_query, get_result_cache, set_result_cache
+
+
+@pytest.fixture(autouse=True)
+def result_cache():
+    previous = get_result_cache()
+    set_result_cache(ResultCache())
+    yield
+    set_result_cache(previous)
+
+
+def test_result_of_a_query_during_a_data_change_is_not_returned():
+    calls = []
+
+    def run_query(query, params=None):
+        calls.append(query)
+        # the ingestion changes the data while the first query runs
+        if len(calls) == 1:
+            bump_data_version()
+        return [{"n": len(calls)}]
+
+    assert cached_query(run_query, "RETURN 1") == [{"n": 1}]
+    assert cached_query(run_query, "RETURN 1") == [{"n": 2}]
+    assert cached_query(run_query, "RETURN 1") == [{"n": 2}]
+
+
+def test_async_result_of_a_query_during_a_data_change_is_not_returned():
+    calls = []
+
+    async def run_query(query, params=None):
+        calls.append(query)
+        if len(calls) == 1:
+            bump_data_version()
+        return [{"n": len(calls)}]
+
+    assert asyncio.run(acached_query(run_query, "RETURN 1")) == [{"n": 1}]
+    assert asyncio.run(acached_query(run_query, "RETURN 1")) == [{"n": 2}]
+    assert asyncio.run(acached_query(run_query, "RETURN 1")) == [{"n": 2}]
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from service.answer_cache import SemanticAnswerCache  # noqa: E402
+from service.intent_router import IntentRouter  # noqa: E402
+from service.serving import ChatService, ChatServiceBusy, ChatSession  # noqa: E402
+
+
+def test_refused_turn_leaves_the_session_as_it_was():
+    service = ChatService(
+        object(),
+        max_concurrency=1,
+        acquire_timeout=0.01,
+        answer_cache=SemanticAnswerCache(max_entries=0),
+        router=IntentRouter(enabled=False),
+    )
+    # the only slot is taken by another turn
+    service._acquire()
+    session = ChatSession([{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}])
+
+    with pytest.raises(ChatServiceBusy):
+        service.answer(session, "What is new?")
+
+    assert len(session.messages) == 2
+    assert session.metrics == []
+    assert service.stats()["rejected"] == 1
+
+
+class FailingAgentExecutor:
+    """Streams the start of an answer, then fails."""
+
+    async def astream_events(self, agent_input, version="v1", **kwargs):
+        from types import SimpleNamespace
+
+        yield {"event": "on_chat_model_stream", "name": "ChatOpenAI", "run_id": "llm",
+               "data": {"chunk": SimpleNamespace(content="The answer")}}
+        raise RuntimeError("The API is down")
+
+
+def test_failed_turn_leaves_the_session_as_it_was():
+    service = ChatService(
+        FailingAgentExecutor(),
+        answer_cache=SemanticAnswerCache(max_entries=0),
+        router=IntentRouter(enabled=False),
+    )
+    session = ChatSession([{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}])
+
+    with pytest.raises(RuntimeError):
+        service.answer(session, "What is new?")
+
+    assert session.messages == [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+    assert session.metrics == []
+    assert service.stats()["active"] == 0
+
+
+def test_stopped_turn_keeps_the_part_of_the_answer_that_was_read():
+    service = ChatService(
+        FailingAgentExecutor(),
+        answer_cache=SemanticAnswerCache(max_entries=0),
+        router=IntentRouter(enabled=False),
+    )
+    session = ChatSession()
+
+    tokens = service.stream_answer(session, "What is new?")
+    assert next(tokens) == "The answer"
+    tokens.close()
+
+    assert session.messages == [{"role": "user", "content": "What is new?"},
+                                {"role": "assistant", "content": "The answer"}]
+    assert len(session.metrics) == 1
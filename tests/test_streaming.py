@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain")
+
+from service.streaming import TurnMetrics, stream_agent_answer  # noqa: E402
+
+STOPPED = "Agent stopped due to iteration limit or time limit."
+
+
+class ScriptedAgentExecutor:
+    """Agent executor stand-in which replays the given astream_events events."""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def astream_events(self, agent_input, version="v1", **kwargs):
+        for event in self.events:
+            yield event
+
+
+def _chain(kind, run_id, output=None):
+    return {"event": kind, "name": "AgentExecutor", "run_id": run_id, "data": {"output": output} if output else {}}
+
+
+def _token(content):
+    return {"event": "on_chat_model_stream", "name": "ChatOpenAI", "run_id": "llm",
+            "data": {"chunk": SimpleNamespace(content=content)}}
+
+
+def test_answer_of_the_exhausted_budget_is_yielded():
+    executor = ScriptedAgentExecutor([
+        _chain("on_chain_start", "root"),
+        {"event": "on_chat_model_start", "name": "ChatOpenAI", "run_id": "llm", "data": {}},
+        # the LLM chooses a tool again, then the iteration limit stops the agent
+        _token(""),
+        _chain("on_chain_end", "step", {"output": "not the answer"}),
+        _chain("on_chain_end", "root", {"input": "question", "output": STOPPED}),
+    ])
+    metrics = TurnMetrics()
+
+    tokens = list(stream_agent_answer({"input": "question"}, metrics, agent_executor=executor))
+
+    assert tokens == [STOPPED]
+    assert metrics.first_token is not None
+    assert metrics.llm_calls == 1
+
+
+def test_streamed_answer_is_not_repeated_at_the_end():
+    executor = ScriptedAgentExecutor([
+        _chain("on_chain_start", "root"),
+        _token("Hello "),
+        _token("world"),
+        _chain("on_chain_end", "root", {"input": "question", "output": "Hello world"}),
+    ])
+
+    assert list(stream_agent_answer({"input": "question"}, agent_executor=executor)) == ["Hello ", "world"]
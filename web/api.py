@@ -0,0 +1,290 @@
+"""HTTP chat API of the bot, next to the Streamlit page, for load balancers and other services.
+
+It is an ASGI app, run by uvicorn with several worker processes:
+
+    uvicorn web.api:app --host 0.0.0.0 --port 8000 --workers 4
+
+    POST   /sessions                  create a session, returns {"session_id": ...}
+    GET    /sessions/{id}             the messages and the metrics of the turns
+    DELETE /sessions/{id}
+    POST   /sessions/{id}/messages    {"message": "..."}, the answer as Server-Sent Events
+    GET    /health, /stats, /metrics  the stats of this worker, the metrics in the Prometheus format
+
+The answer is streamed as Server-Sent Events: "tool" events when the agent calls a tool, "token" events with
+the text of the answer, and at the end a "done" event with the metrics of the turn, or an "error" event.
+The workers keep no state of the conversations: the session is loaded from the session store (see
+service/session_store.py) at the start of the turn and saved at the end, so any worker can answer any turn.
+
+Every worker answers at most CHAT_MAX_CONCURRENCY questions at the same time (see ChatService), and lets up
+to CHAT_MAX_QUEUE more wait for a free slot. The turns over that are refused with 503 and Retry-After, so
+the load balancer or the client can try another worker or later, instead of all workers queueing without end.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from observability.logging_config import configure_observability
+from observability.metrics import registry
+from service.serving import ChatService, ChatServiceBusy, get_chat_service
+from service.session_store import SessionConflict, SessionStore, get_session_store
+
+logger = logging.getLogger(__name__)
+
+_SESSION = re.compile(r"/sessions/(?P<session_id>[0-9a-f]{32})(?P<messages>/messages)?")
+MAX_BODY_BYTES = 64 * 1024
+# marks the end of the events of a turn
+_DONE = object()
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Request body is too large")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+    data = json.dumps(body, default=str).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+    raw_headers += [(name.encode(), value.encode()) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": data})
+
+
+class ChatAPI:
+    """The ASGI app. By default it uses the chat service and the session store of the process."""
+
+    def __init__(
+        self,
+        service: Optional[ChatService] = None,
+        store: Optional[SessionStore] = None,
+        max_queue: Optional[int] = None,
+    ):
+        self._service = service
+        self._store = store
+        self._max_queue = max_queue
+        self._turns: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.refused = 0
+        self.conflicts = 0
+
+    @property
+    def service(self) -> ChatService:
+        if self._service is None:
+            self._service = get_chat_service()
+        return self._service
+
+    @property
+    def store(self) -> SessionStore:
+        if self._store is None:
+            self._store = get_session_store()
+        return self._store
+
+    @property
+    def max_queue(self) -> int:
+        if self._max_queue is None:
+            self._max_queue = int(os.getenv("CHAT_MAX_QUEUE", str(2 * self.service.max_concurrency)))
+        return self._max_queue
+
+    @property
+    def max_in_flight(self) -> int:
+        return self.service.max_concurrency + self.max_queue
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # the turns run in threads (the chat service streams the answer synchronously), one for every
+        # turn that is answered or waits for a slot
+        with self._lock:
+            if self._turns is None:
+                self._turns = ThreadPoolExecutor(self.max_in_flight, thread_name_prefix="chat-turn")
+        return self._turns
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        method, path = scope["method"], scope["path"].rstrip("/")
+        try:
+            if path == "/health" and method == "GET":
+                await _send_json(send, 200, {"status": "ok"})
+            elif path == "/stats" and method == "GET":
+                await _send_json(send, 200, self.stats())
+            elif path == "/metrics" and method == "GET":
+                data = registry.render_prometheus().encode("utf-8")
+                await send({"type": "http.response.start", "status": 200,
+                            "headers": [(b"content-type", b"text/plain; version=0.0.4")]})
+                await send({"type": "http.response.body", "body": data})
+            elif path == "/sessions" and method == "POST":
+                session_id = await asyncio.to_thread(self.store.create)
+                await _send_json(send, 201, {"session_id": session_id})
+            else:
+                await self._session_route(method, path, receive, send)
+        except Exception as e:
+            logger.exception("Request %s %s failed", method, path)
+            await _send_json(send, 500, {"error": "internal", "message": str(e)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                configure_observability()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._turns is not None:
+                    self._turns.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _session_route(self, method: str, path: str, receive, send):
+        match = _SESSION.fullmatch(path)
+        if match is None:
+            await _send_json(send, 404, {"error": "not_found"})
+            return
+        session_id = match.group("session_id")
+        if match.group("messages"):
+            if method != "POST":
+                await _send_json(send, 405, {"error": "method_not_allowed"})
+                return
+            await self._turn(session_id, receive, send)
+        elif method == "GET":
+            session = await asyncio.to_thread(self.store.load, session_id)
+            if session is None:
+                await _send_json(send, 404, {"error": "unknown_session"})
+                return
+            await _send_json(send, 200, {"session_id": session_id, "messages": session.messages,
+                                         "metrics": session.metrics})
+        elif method == "DELETE":
+            if await asyncio.to_thread(self.store.delete, session_id):
+                await _send_json(send, 200, {"session_id": session_id, "deleted": True})
+            else:
+                await _send_json(send, 404, {"error": "unknown_session"})
+        else:
+            await _send_json(send, 405, {"error": "method_not_allowed"})
+
+    async def _turn(self, session_id: str, receive, send):
+        try:
+            message = json.loads(await _read_body(receive) or b"{}").get("message")
+        except (ValueError, AttributeError) as e:
+            await _send_json(send, 400, {"error": "bad_request", "message": str(e)})
+            return
+        if not isinstance(message, str) or not message.strip():
+            await _send_json(send, 400, {"error": "bad_request", "message": "message is required"})
+            return
+        # backpressure: the turns over the slots and the queue of this worker are refused at once
+        if self.in_flight >= self.max_in_flight:
+            self.refused += 1
+            await _send_json(send, 503, {"error": "busy"}, {"Retry-After": "1"})
+            return
+        self.in_flight += 1
+        try:
+            session = await asyncio.to_thread(self.store.load, session_id)
+            if session is None:
+                await _send_json(send, 404, {"error": "unknown_session"})
+                return
+            await self._stream_turn(session_id, session, message, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _stream_turn(self, session_id: str, session, message: str, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                # proxies (nginx) must not buffer the stream
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue" = asyncio.Queue()
+        stopped = threading.Event()
+
+        def put(item):
+            loop.call_soon_threadsafe(events.put_nowait, item)
+
+        def on_tool_event(event: str, tool_name: str, data: Dict):
+            if event == "on_tool_start":
+                put(_sse("tool", {"name": tool_name, "input": data.get("input")}))
+
+        def run():
+            tokens = self.service.stream_answer(session, message, on_tool_event)
+            try:
+                for token in tokens:
+                    if stopped.is_set():
+                        break
+                    put(_sse("token", {"text": token}))
+                # closing stops the agent if the client went away, and adds the answer to the session
+                tokens.close()
+                self.store.save(session_id, session)
+                put(_sse("done", dict(session.metrics[-1], worker=os.getpid())))
+            except ChatServiceBusy as e:
+                put(_sse("error", {"error": "busy", "message": str(e)}))
+            except SessionConflict as e:
+                # another turn of the session was saved first (two questions at once), this one is not saved
+                with self._lock:
+                    self.conflicts += 1
+                put(_sse("error", {"error": "conflict", "message": str(e)}))
+            except Exception as e:
+                logger.exception("Turn of session %s failed", session_id)
+                put(_sse("error", {"error": "internal", "message": str(e)}))
+            finally:
+                # on errors too, so the slot of the chat service is released
+                tokens.close()
+                put(_DONE)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            stopped.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        loop.run_in_executor(self._executor(), run)
+        try:
+            while True:
+                event = await events.get()
+                if event is _DONE:
+                    break
+                if not stopped.is_set():
+                    await send({"type": "http.response.body", "body": event, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            stopped.set()
+            watcher.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": os.getpid(),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "refused": self.refused,
+            "conflicts": self.conflicts,
+            "service": self.service.stats(),
+        }
+
+
+def create_app(
+    service: Optional[ChatService] = None, store: Optional[SessionStore] = None, max_queue: Optional[int] = None
+) -> ChatAPI:
+    """The app with another chat service or session store, for example a stub agent in benchmarks
+    (uvicorn module:function --factory)."""
+    return ChatAPI(service, store, max_queue)
+
+
+# the app of the worker processes of uvicorn, the chat service and the store are created on the first request
+app = create_app()
@@ -1,17 +1,28 @@
-from typing import Dict, List, Optional
-from langchain_community.graphs import Neo4jGraph
-from langchain_community.vectorstores import Neo4jVector
-from langchain_openai import OpenAIEmbeddings
-from repository.graph_db import *
-from service.agent import agent_executor
+from observability.logging_config import configure_observability
+from repository.graph_db import (
+    check_graph_db_connection,
+    get_entity_types,
+    get_graph_schema,
+    get_embedding_dimension,
+    get_graph,
+    health_check,
+)
+from repository.schema import apply_schema, graph_plan_runner, print_profiles, profile_queries, vector_index_dimension
 
 
 if __name__ == "__main__":
+    configure_observability()
+    print("Health check:", health_check(), "\n")
     check_graph_db_connection()
+    # create the indexes which the queries need, if they are missing, and check the plans of the queries
+    dimension = vector_index_dimension(get_graph().query) or get_embedding_dimension()
+    print("Indexes:", apply_schema(get_graph().query, dimension), "\n")
+    print_profiles(profile_queries(graph_plan_runner(get_graph()), dimension, explain=True))
     get_entity_types()
     get_graph_schema()
     get_embedding_dimension()
 
 
-# result = agent_executor.invoke({"input": "What are the health benefits mentioned in the news?"})
+# from service.agent import get_agent_executor
+# result = get_agent_executor().invoke({"input": "What are the health benefits mentioned in the news?"})
 # print(result)
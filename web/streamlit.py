@@ -1,39 +1,61 @@
 import streamlit as st
-from repository.graph_db import check_graph_db_connection
-from service.agent import agent_executor
+from observability.logging_config import configure_observability
+from service.serving import ChatServiceBusy, ChatSession, get_chat_service
 import os
 import dotenv
 
 dotenv.load_dotenv()
+configure_observability()
 
 st.title('🦜🔗 News Chatbot')
 
 openai_api_key = os.getenv('OPENAI_API_KEY')
 
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Streamlit runs this script again on every message. The chat service (agent, tools and connections to the
+# database) is created once per process and shared by all sessions.
+@st.cache_resource
+def get_service():
+    return get_chat_service()
 
-for message in st.session_state.messages:
+
+# the messages and the metrics (time to first token and total latency for every turn) of this session
+if "chat_session" not in st.session_state:
+    st.session_state.chat_session = ChatSession()
+chat_session = st.session_state.chat_session
+
+for message in chat_session.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
 # Accept user input
 if prompt := st.chat_input("What is up?"):
-    # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    print(st.session_state.messages)
-
     # Display user message in chat message container
     with st.chat_message("user"):
         st.markdown(prompt)
 
     # Display assistant response in chat message container
     with st.chat_message("assistant"):
-        stream_output = agent_executor.invoke({"input": prompt, "chat_history": st.session_state.messages})["output"]
-        print("STREAM: ", stream_output)
-        st.markdown(stream_output)
-        # response = st.write_stream(stream)
-
-    # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": stream_output})
+        status = st.status("Thinking...", expanded=False)
+
+        # show which tools the agent calls while the answer is not ready yet
+        def show_tool_progress(event, tool_name, data):
+            if event == "on_tool_start":
+                status.update(label=f"Calling {tool_name}...")
+                status.write(f"{tool_name}: {data.get('input')}")
+
+        # the tokens are written as soon as the LLM produces them,
+        # the question and the answer are added to the chat session by the service
+        try:
+            st.write_stream(get_service().stream_answer(chat_session, prompt, show_tool_progress))
+        except ChatServiceBusy:
+            # all slots are answering other questions, the question was not added to the session
+            status.update(label="Busy", state="error")
+            st.warning("Too many questions at the same time, please try again in a moment.")
+        else:
+            status.update(label="Done", state="complete")
+            metrics = chat_session.metrics[-1]
+            st.caption(
+                f"First token after {metrics['time_to_first_token'] or 0:.2f} s, "
+                f"answer after {metrics['total_latency']:.2f} s"
+            )